@@ -0,0 +1,66 @@
+"""Compare top-3 latency and recall@3 of the IVF code example index against brute-force search.
+
+Uses a synthetic clustered corpus, so it runs without any model or server:
+
+    python benchmark_code_example_index.py --examples 50000 --queries 500
+"""
+
+import argparse
+import statistics
+import tempfile
+import time
+
+import numpy as np
+from code_example_index import DIMENSIONS, CodeExampleIndex, normalize_rows
+
+
+def clustered_vectors(rng, centers, count, noise=0.05):
+    assignments = rng.integers(0, len(centers), count)
+    return normalize_rows(
+        centers[assignments] + rng.normal(scale=noise, size=(count, centers.shape[1]))
+    )
+
+
+def main():
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument("--examples", type=int, default=50000)
+    argument_parser.add_argument("--queries", type=int, default=500)
+    argument_parser.add_argument("--topics", type=int, default=200)
+    argument_parser.add_argument("--n-probe", type=int, default=4)
+    args = argument_parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    centers = normalize_rows(rng.normal(size=(args.topics, DIMENSIONS)))
+    index = CodeExampleIndex(tempfile.mkdtemp(), n_probe=args.n_probe)
+
+    start = time.perf_counter()
+    index.add(
+        [f"# example {i}" for i in range(args.examples)],
+        clustered_vectors(rng, centers, args.examples),
+    )
+    print(
+        f"Indexed {len(index)} examples into {len(index.lists)} lists in {time.perf_counter() - start:.2f}s"
+    )
+
+    exact_times, approximate_times, recalls = [], [], []
+    for query in clustered_vectors(rng, centers, args.queries):
+        start = time.perf_counter()
+        exact = index.search_vector(query, 3, exact=True)
+        exact_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        approximate = index.search_vector(query, 3)
+        approximate_times.append(time.perf_counter() - start)
+
+        recalls.append(len(set(exact) & set(approximate)) / 3)
+
+    for name, times in (("brute force", exact_times), ("IVF", approximate_times)):
+        times.sort()
+        print(
+            f"{name:<12} p50 {statistics.median(times) * 1000:.3f}ms  p95 {times[int(len(times) * 0.95)] * 1000:.3f}ms"
+        )
+    print(f"recall@3     {statistics.mean(recalls):.3f}")
+
+
+if __name__ == "__main__":
+    main()
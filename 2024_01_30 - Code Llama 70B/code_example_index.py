@@ -0,0 +1,274 @@
+"""In-process index of code examples, used by the agents' `query_collection` instead of a Weaviate server.
+
+A copy of the module in the Intro to LangGraph demo, since each demo folder runs on its own. Keep the two in sync.
+
+Embeddings live in a memory-mapped float32 matrix on disk and the code in a JSONL file next to it, so the index
+loads instantly and works offline. Search goes through an IVF index (k-means lists, probing the closest few),
+falling back to brute force while the corpus is small, and results are cached per query.
+
+By default texts are embedded locally with hashed character trigrams. Pass `embed` to use a real embedding model,
+e.g. `OpenAIEmbeddings().embed_documents`. A new index takes its dimensions from the first vectors added to it.
+
+The index starts out empty. Build it once from the `code_example` collection of a Weaviate server, or `add` your
+own examples, and check `index_exists` before using it in place of Weaviate:
+
+    python code_example_index.py --weaviate-url http://localhost:8080
+"""
+
+import argparse
+import json
+import os
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+DIMENSIONS = 512
+# Below this many examples, scanning everything is faster than probing lists
+MIN_IVF_SIZE = 1024
+
+
+def hashed_trigram_embeddings(texts, dimensions=DIMENSIONS):
+    vectors = np.zeros((len(texts), dimensions), dtype=np.float32)
+    for row, text in enumerate(texts):
+        padded = f" {' '.join(text.lower().split())} "
+        columns = [
+            zlib.crc32(padded[i : i + 3].encode()) % dimensions
+            for i in range(len(padded) - 2)
+        ]
+        np.add.at(vectors[row], columns, 1)
+    return vectors
+
+
+def normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def index_exists(directory="./code_example_index"):
+    """Whether an index with at least one example has been built in the directory."""
+    meta_path = os.path.join(directory, "meta.json")
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path, "r") as infile:
+        return json.load(infile)["count"] > 0
+
+
+def top_k(scores, k):
+    k = min(k, len(scores))
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best])]
+
+
+class CodeExampleIndex:
+    def __init__(
+        self,
+        directory="./code_example_index",
+        dimensions=None,
+        embed=None,
+        n_probe=4,
+        cache_size=1024,
+    ):
+        self.directory = directory
+        if embed is None:
+            dimensions = dimensions or DIMENSIONS
+            embed = lambda texts: hashed_trigram_embeddings(texts, dimensions)
+        self.embed = embed
+        self.n_probe = n_probe
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        os.makedirs(directory, exist_ok=True)
+
+        meta_path = os.path.join(directory, "meta.json")
+        meta = {"count": 0, "capacity": 0, "dimensions": dimensions}
+        if os.path.exists(meta_path):
+            with open(meta_path, "r") as infile:
+                meta = json.load(infile)
+        self.count = meta["count"]
+        self.dimensions = meta["dimensions"]
+        self._open_embeddings(meta["capacity"])
+
+        self.codes = []
+        examples_path = os.path.join(directory, "examples.jsonl")
+        if os.path.exists(examples_path):
+            with open(examples_path, "r") as infile:
+                self.codes = [json.loads(line)["code"] for line in infile][: self.count]
+
+        self.centroids = None
+        self.lists = []
+        self._trained_size = 0
+        if self.count >= MIN_IVF_SIZE:
+            self.train()
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def embeddings(self):
+        return self._embeddings[: self.count]
+
+    def _open_embeddings(self, capacity):
+        self.capacity = capacity
+        path = os.path.join(self.directory, "embeddings.f32")
+        if not capacity:
+            self._embeddings = np.zeros((0, self.dimensions or 0), dtype=np.float32)
+            return
+        self._embeddings = np.memmap(
+            path, dtype=np.float32, mode="r+", shape=(capacity, self.dimensions)
+        )
+
+    def _grow(self, needed):
+        capacity = max(needed, self.capacity * 2, 1024)
+        path = os.path.join(self.directory, "embeddings.f32")
+        if isinstance(self._embeddings, np.memmap):
+            self._embeddings.flush()
+            del self._embeddings
+        with open(path, "ab") as outfile:
+            outfile.truncate(capacity * self.dimensions * 4)
+        self._open_embeddings(capacity)
+
+    def _save_meta(self):
+        with open(os.path.join(self.directory, "meta.json"), "w") as outfile:
+            json.dump(
+                {
+                    "count": self.count,
+                    "capacity": self.capacity,
+                    "dimensions": self.dimensions,
+                },
+                outfile,
+            )
+
+    def add(self, codes, vectors=None):
+        """Insert code examples. New examples join the nearest existing list, and the lists are retrained as the corpus grows."""
+        codes = list(codes)
+        if not codes:
+            return
+        vectors = normalize_rows(self.embed(codes) if vectors is None else vectors)
+        self._check_dimensions(vectors)
+        start, end = self.count, self.count + len(codes)
+        if end > self.capacity:
+            self._grow(end)
+        self._embeddings[start:end] = vectors
+        self._embeddings.flush()
+
+        with open(os.path.join(self.directory, "examples.jsonl"), "a") as outfile:
+            for code in codes:
+                outfile.write(json.dumps({"code": code}) + "\n")
+        self.codes.extend(codes)
+        self.count = end
+        self._save_meta()
+        self._cache.clear()
+
+        if self.count >= MIN_IVF_SIZE and self.count >= 2 * self._trained_size:
+            self.train()
+        elif self.centroids is not None:
+            assignments = (vectors @ self.centroids.T).argmax(axis=1)
+            for offset, assignment in enumerate(assignments):
+                self.lists[assignment] = np.append(self.lists[assignment], start + offset)
+
+    def _check_dimensions(self, vectors):
+        if vectors.shape[1] == self.dimensions:
+            return
+        if self.count:
+            raise ValueError(
+                f"Got {vectors.shape[1]}-dimensional embeddings, but the index in {self.directory} holds "
+                f"{self.dimensions}-dimensional ones. Use the same embedding model, or a new directory."
+            )
+        # Nothing is stored yet, so the index takes the dimensions of the embedding model it is given
+        self.dimensions = vectors.shape[1]
+        self._open_embeddings(0)
+
+    def train(self, iterations=10, seed=0):
+        """Cluster the embeddings into about sqrt(n) lists with spherical k-means."""
+        embeddings = np.asarray(self.embeddings)
+        n_lists = max(1, int(np.sqrt(len(embeddings))))
+        rng = np.random.default_rng(seed)
+        centroids = embeddings[rng.choice(len(embeddings), n_lists, replace=False)]
+        for _ in range(iterations):
+            assignments = (embeddings @ centroids.T).argmax(axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, embeddings)
+            # Lists that end up empty keep their old centroid
+            empty = np.bincount(assignments, minlength=n_lists) == 0
+            sums[empty] = centroids[empty]
+            centroids = normalize_rows(sums)
+
+        assignments = (embeddings @ centroids.T).argmax(axis=1)
+        order = np.argsort(assignments, kind="stable")
+        boundaries = np.searchsorted(assignments[order], np.arange(n_lists + 1))
+        self.centroids = centroids
+        self.lists = [order[boundaries[i] : boundaries[i + 1]] for i in range(n_lists)]
+        self._trained_size = len(embeddings)
+
+    def search_vector(self, vector, k=3, exact=False):
+        vector = normalize_rows(vector[None, :])[0]
+        if exact or self.centroids is None:
+            return top_k(self.embeddings @ vector, k)
+        probed = top_k(self.centroids @ vector, self.n_probe)
+        candidates = np.concatenate([self.lists[i] for i in probed])
+        if len(candidates) < k:
+            return top_k(self.embeddings @ vector, k)
+        return candidates[top_k(self.embeddings[candidates] @ vector, k)]
+
+    def search(self, query, k=3):
+        """The k most similar code examples to the query."""
+        key = (query, k)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        if not self.count:
+            return []
+        vector = normalize_rows(self.embed([query]))
+        self._check_dimensions(vector)
+        ids = self.search_vector(vector[0], k)
+        results = [self.codes[i] for i in ids]
+        self._cache[key] = results
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return results
+
+
+def import_from_weaviate(index, client, batch_size=100):
+    """Copy the `code_example` collection of a Weaviate server into the local index."""
+    offset = 0
+    while True:
+        response = (
+            client.query.get("code_example", ["code"])
+            .with_limit(batch_size)
+            .with_offset(offset)
+            .do()
+        )
+        results = response["data"]["Get"]["Code_example"]
+        if not results:
+            break
+        index.add([result["code"] for result in results])
+        offset += len(results)
+    return len(index)
+
+
+def format_examples(codes):
+    formatted_response = ""
+    for code in codes:
+        formatted_response += "# Example:\n"
+        formatted_response += f"{code}\n\n\n"
+    return formatted_response
+
+
+def main():
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument("--weaviate-url", default="http://localhost:8080")
+    argument_parser.add_argument("--directory", default="./code_example_index")
+    args = argument_parser.parse_args()
+
+    from weaviate import Client
+
+    if index_exists(args.directory):
+        print(f"{args.directory} already has an index, remove it to build it again")
+        return
+    index = CodeExampleIndex(args.directory)
+    print(f"Indexed {import_from_weaviate(index, Client(args.weaviate_url))} code examples")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Send concurrent chat completion requests through the gateway, with and without batching, using the stub model.
+
+Runs without a model or the openai package:
+
+    python benchmark_gateway.py --requests 64
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from openai_gateway import StubModel, serve
+
+MESSAGES = [{"role": "user", "content": "Topic: Ducks"}]
+
+
+async def post(port, body):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    payload = json.dumps(body).encode()
+    writer.write(
+        f"POST /v1/chat/completions HTTP/1.1\r\nHost: localhost\r\n"
+        f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n".encode()
+        + payload
+    )
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return response.split(b"\r\n\r\n", 1)[1]
+
+
+async def run(requests, port, models=1, **scheduler_kwargs):
+    gateway, server = await serve(StubModel(), port=port, **scheduler_kwargs)
+    async with server:
+        start = time.perf_counter()
+        responses = await asyncio.gather(
+            *(
+                post(
+                    port,
+                    {
+                        "model": f"stub-{i % models}",
+                        "messages": MESSAGES,
+                        "stream": i % 2 == 0,
+                    },
+                )
+                for i in range(requests)
+            )
+        )
+        elapsed = time.perf_counter() - start
+    gateway.scheduler.close()
+    # Every streamed response ends with [DONE], every other one is a full completion
+    assert all(
+        response.endswith(b"data: [DONE]\n\n") or json.loads(response)["choices"]
+        for response in responses
+    )
+    return elapsed, gateway.scheduler.metrics()
+
+
+async def main():
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument("--requests", type=int, default=64)
+    argument_parser.add_argument("--port", type=int, default=8199)
+    args = argument_parser.parse_args()
+
+    for name, kwargs in [
+        ("One request at a time", {"max_batch": 1, "max_concurrent_batches": 1}),
+        ("Batched", {}),
+        # More models than batch slots, so every model's worker has to share them
+        ("Batched, 4 models", {"models": 4}),
+    ]:
+        elapsed, metrics = await run(args.requests, args.port, **kwargs)
+        latency = metrics["queue_latency_ms"]
+        print(
+            f"{name:<22} {args.requests / elapsed:6.1f} requests/s  "
+            f"mean batch {metrics['mean_batch_size']:.1f}  "
+            f"queue p50 {latency['p50']:.1f}ms p95 {latency['p95']:.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,432 @@
+"""A local gateway that exposes the OpenAI chat completions API and batches concurrent requests per model.
+
+Point any OpenAI client at it instead of the model server:
+
+    python openai_gateway.py --backend ollama --port 8100
+    client = OpenAI(base_url="http://localhost:8100/v1", api_key="gateway")
+
+Requests for the same model that arrive within `batch_window` seconds of each other are sent to the backend as one
+batch, up to `max_batch` at a time, and each request's share of the streamed output is sent back to its own client.
+At most `max_concurrent_batches` batches run at once, so the backend never sees more than max_batch times that many
+requests in flight. `tools`/`tool_choice` and `stream=True` work as with the OpenAI API. GET /metrics reports the
+batch sizes and how long requests waited in the queue.
+
+Backends:
+- `StubModel` is a CPU-only stand-in that decodes a whole batch one step at a time, where a step costs a fixed
+  overhead plus a little per sequence, like a real forward pass. Use it to test the gateway without a model.
+- `OpenAIBackend` forwards to an OpenAI-compatible server such as Ollama. Ollama has no batch endpoint, so a batch
+  is just sent as that many concurrent requests. Any batching then happens in Ollama's own parallel slots (set
+  OLLAMA_NUM_PARALLEL to at least `max_batch`), which it would do for concurrent clients without the gateway too.
+  In front of Ollama the gateway only bounds the number of requests in flight, and adds up to `batch_window` of
+  latency to each one. The speedup in benchmark_gateway.py comes from StubModel running a whole batch per step.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from collections import Counter, defaultdict, deque
+
+BATCH_WINDOW = 0.01
+MAX_BATCH = 16
+# One batch generating while the next one is collected and started
+MAX_CONCURRENT_BATCHES = 2
+# Queue latencies kept for /metrics, the most recent ones
+LATENCY_SAMPLES = 10000
+OLLAMA_BASE_URL = "http://localhost:11434/v1"
+
+
+class ChatRequest:
+    def __init__(self, body):
+        self.body = body
+        self.model = body.get("model", "")
+        self.messages = body.get("messages", [])
+        self.tools = body.get("tools") or []
+        self.tool_choice = body.get("tool_choice", "auto" if self.tools else "none")
+        self.max_tokens = body.get("max_tokens")
+        # (delta, finish_reason) pairs for this request, filled in by the batch it runs in
+        self.output = asyncio.Queue()
+        self.queued_at = time.perf_counter()
+
+
+class StubModel:
+    def __init__(self, step_latency=0.02, sequence_latency=0.001, tokens=24):
+        self.step_latency = step_latency
+        self.sequence_latency = sequence_latency
+        self.tokens = tokens
+        # One forward pass at a time, as on a single GPU. Batches that run concurrently take turns
+        self._device = asyncio.Lock()
+
+    def _tool_call(self, request):
+        if not request.tools or request.tool_choice == "none":
+            return None
+        tool = request.tools[0]["function"]
+        if isinstance(request.tool_choice, dict):
+            tool = next(
+                t["function"]
+                for t in request.tools
+                if t["function"]["name"] == request.tool_choice["function"]["name"]
+            )
+        parameters = tool.get("parameters", {})
+        arguments = {name: "stub" for name in parameters.get("required", [])}
+        return {"name": tool["name"], "arguments": json.dumps(arguments)}
+
+    async def generate(self, batch):
+        """Yield (index in batch, delta, finish_reason) for every step of every sequence."""
+        tool_calls = [self._tool_call(request) for request in batch]
+        lengths = [
+            min(self.tokens, request.max_tokens or self.tokens) for request in batch
+        ]
+        active = set(range(len(batch)))
+        step = 0
+        while active:
+            # One forward pass for the whole batch
+            async with self._device:
+                await asyncio.sleep(
+                    self.step_latency + self.sequence_latency * len(active)
+                )
+            for index in sorted(active):
+                tool_call = tool_calls[index]
+                if tool_call is not None:
+                    delta = {
+                        "tool_calls": [
+                            {
+                                "index": 0,
+                                "id": f"call_{uuid.uuid4().hex[:24]}",
+                                "type": "function",
+                                "function": tool_call,
+                            }
+                        ]
+                    }
+                    yield index, delta, "tool_calls"
+                    active.discard(index)
+                elif step < lengths[index]:
+                    yield index, {"content": f" token{step}"}, None
+                else:
+                    yield index, {}, "stop" if lengths[index] == self.tokens else "length"
+                    active.discard(index)
+            step += 1
+
+
+class OpenAIBackend:
+    def __init__(self, base_url=OLLAMA_BASE_URL, api_key="ollama"):
+        # Imported here so the stub backend runs without the openai package
+        from openai import AsyncOpenAI
+
+        self.client = AsyncOpenAI(base_url=base_url, api_key=api_key)
+
+    async def generate(self, batch):
+        merged = asyncio.Queue()
+
+        async def forward(index, request):
+            try:
+                body = {k: v for k, v in request.body.items() if k != "stream"}
+                stream = await self.client.chat.completions.create(**body, stream=True)
+                async for chunk in stream:
+                    if chunk.choices:
+                        choice = chunk.choices[0]
+                        delta = choice.delta.model_dump(exclude_none=True)
+                        delta.pop("role", None)
+                        await merged.put((index, delta, choice.finish_reason))
+            except Exception as e:
+                await merged.put((index, {"content": f"Upstream error: {e!r}"}, "stop"))
+            finally:
+                await merged.put((index, None, None))
+
+        tasks = [
+            asyncio.create_task(forward(i, request)) for i, request in enumerate(batch)
+        ]
+        remaining = len(tasks)
+        try:
+            while remaining:
+                index, delta, finish_reason = await merged.get()
+                if delta is None:
+                    remaining -= 1
+                else:
+                    yield index, delta, finish_reason
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+class BatchScheduler:
+    """Groups concurrent requests per model into batches and fans the batch output back out."""
+
+    def __init__(
+        self,
+        backend,
+        batch_window=BATCH_WINDOW,
+        max_batch=MAX_BATCH,
+        max_concurrent_batches=MAX_CONCURRENT_BATCHES,
+    ):
+        self.backend = backend
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.queues = defaultdict(asyncio.Queue)
+        self.workers = {}
+        # Shared by every model's worker, since they all go to the same backend
+        self.batch_slots = asyncio.Semaphore(max_concurrent_batches)
+        self.batch_sizes = Counter()
+        self.queue_latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.requests = 0
+
+    def submit(self, request):
+        self.requests += 1
+        self.queues[request.model].put_nowait(request)
+        if request.model not in self.workers:
+            self.workers[request.model] = asyncio.create_task(
+                self._worker(request.model)
+            )
+        return request
+
+    async def _collect(self, queue, first):
+        batch = [first]
+        deadline = asyncio.get_running_loop().time() + self.batch_window
+        while len(batch) < self.max_batch:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # Anything else already waiting joins too, without waiting any longer
+        while len(batch) < self.max_batch and not queue.empty():
+            batch.append(queue.get_nowait())
+        return batch
+
+    async def _worker(self, model):
+        queue = self.queues[model]
+        running = set()
+        while True:
+            # Only take a slot once there is a request, so an idle model never holds one. Requests that arrive
+            # while waiting for the slot make the batch bigger
+            first = await queue.get()
+            await self.batch_slots.acquire()
+            try:
+                batch = await self._collect(queue, first)
+            except BaseException:
+                self.batch_slots.release()
+                raise
+            started = time.perf_counter()
+            self.batch_sizes[len(batch)] += 1
+            self.queue_latencies.extend(started - request.queued_at for request in batch)
+            # The next batch can be collected while this one is still generating
+            task = asyncio.create_task(self._run(batch))
+            running.add(task)
+            task.add_done_callback(running.discard)
+            task.add_done_callback(lambda _: self.batch_slots.release())
+
+    def close(self):
+        for worker in self.workers.values():
+            worker.cancel()
+
+    async def _run(self, batch):
+        finished = set()
+        try:
+            async for index, delta, finish_reason in self.backend.generate(batch):
+                batch[index].output.put_nowait((delta, finish_reason))
+                if finish_reason:
+                    finished.add(index)
+        except Exception as e:
+            for index, request in enumerate(batch):
+                if index not in finished:
+                    request.output.put_nowait(
+                        ({"content": f"Backend error: {e!r}"}, "stop")
+                    )
+                    finished.add(index)
+        finally:
+            for index, request in enumerate(batch):
+                if index not in finished:
+                    request.output.put_nowait(({}, "stop"))
+
+    def metrics(self):
+        latencies = sorted(self.queue_latencies)
+
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+        batches = sum(self.batch_sizes.values())
+        batched = sum(size * count for size, count in self.batch_sizes.items())
+        return {
+            "requests": self.requests,
+            "batches": batches,
+            "mean_batch_size": batched / batches if batches else 0.0,
+            "batch_sizes": {
+                str(size): count for size, count in sorted(self.batch_sizes.items())
+            },
+            "queue_latency_ms": {
+                "p50": percentile(0.5),
+                "p95": percentile(0.95),
+                "max": percentile(1.0),
+            },
+        }
+
+
+async def completion_chunks(request):
+    """OpenAI chat.completion.chunk objects for a submitted request."""
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+
+    def chunk(delta, finish_reason=None):
+        return {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": request.model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+
+    yield chunk({"role": "assistant", "content": ""})
+    while True:
+        delta, finish_reason = await request.output.get()
+        yield chunk(delta, finish_reason)
+        if finish_reason:
+            return
+
+
+async def completion(request):
+    """Collect a submitted request into an OpenAI chat.completion object."""
+    content, tool_calls, finish_reason = "", {}, None
+    completion_tokens = 0
+    async for chunk in completion_chunks(request):
+        choice = chunk["choices"][0]
+        delta = choice["delta"]
+        content += delta.get("content") or ""
+        completion_tokens += 1 if delta.get("content") else 0
+        for tool_call in delta.get("tool_calls") or []:
+            merged = tool_calls.setdefault(
+                tool_call["index"],
+                {"id": "", "type": "function", "function": {"name": "", "arguments": ""}},
+            )
+            merged["id"] = tool_call.get("id") or merged["id"]
+            function = tool_call.get("function") or {}
+            merged["function"]["name"] += function.get("name") or ""
+            merged["function"]["arguments"] += function.get("arguments") or ""
+        finish_reason = choice["finish_reason"] or finish_reason
+
+    message = {"role": "assistant", "content": content or None}
+    if tool_calls:
+        message["tool_calls"] = [tool_calls[index] for index in sorted(tool_calls)]
+    # Rough counts, the gateway doesn't tokenize
+    prompt_tokens = sum(
+        len(str(message.get("content") or "").split()) for message in request.messages
+    )
+    return {
+        "id": chunk["id"],
+        "object": "chat.completion",
+        "created": chunk["created"],
+        "model": request.model,
+        "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+class Gateway:
+    def __init__(self, scheduler, models=()):
+        self.scheduler = scheduler
+        self.models = list(models)
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            if not request_line:
+                return
+            method, path, _ = request_line.decode().split(" ", 2)
+            headers = {}
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                name, _, value = line.decode().partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            path = path.split("?")[0].rstrip("/")
+
+            if method == "POST" and path.endswith("/chat/completions"):
+                await self.chat_completions(json.loads(body or b"{}"), writer)
+            elif method == "GET" and path.endswith("/models"):
+                models = [{"id": model, "object": "model"} for model in self.models]
+                await self.send_json(writer, {"object": "list", "data": models})
+            elif method == "GET" and path == "/metrics":
+                await self.send_json(writer, self.scheduler.metrics())
+            else:
+                error = {"error": {"message": f"Unknown route {method} {path}"}}
+                await self.send_json(writer, error, status="404 Not Found")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            error = {"error": {"message": repr(e)}}
+            await self.send_json(writer, error, status="400 Bad Request")
+        finally:
+            writer.close()
+
+    async def send_json(self, writer, payload, status="200 OK"):
+        body = json.dumps(payload).encode()
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+
+    async def chat_completions(self, body, writer):
+        request = self.scheduler.submit(ChatRequest(body))
+        if not body.get("stream"):
+            await self.send_json(writer, await completion(request))
+            return
+
+        # Server-sent events until the connection closes, as the OpenAI API streams
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\n"
+            b"Connection: close\r\n\r\n"
+        )
+        async for chunk in completion_chunks(request):
+            writer.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            await writer.drain()
+        writer.write(b"data: [DONE]\n\n")
+        await writer.drain()
+
+
+async def serve(backend, host="127.0.0.1", port=8100, models=(), **scheduler_kwargs):
+    gateway = Gateway(BatchScheduler(backend, **scheduler_kwargs), models)
+    server = await asyncio.start_server(gateway.handle, host, port)
+    return gateway, server
+
+
+async def main():
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument("--backend", choices=["stub", "ollama"], default="ollama")
+    argument_parser.add_argument("--upstream-url", default=OLLAMA_BASE_URL)
+    argument_parser.add_argument("--host", default="127.0.0.1")
+    argument_parser.add_argument("--port", type=int, default=8100)
+    argument_parser.add_argument("--batch-window", type=float, default=BATCH_WINDOW)
+    argument_parser.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    argument_parser.add_argument(
+        "--max-concurrent-batches", type=int, default=MAX_CONCURRENT_BATCHES
+    )
+    args = argument_parser.parse_args()
+
+    backend = StubModel() if args.backend == "stub" else OpenAIBackend(args.upstream_url)
+    _, server = await serve(
+        backend,
+        args.host,
+        args.port,
+        batch_window=args.batch_window,
+        max_batch=args.max_batch,
+        max_concurrent_batches=args.max_concurrent_batches,
+    )
+    print(f"Gateway on http://{args.host}:{args.port}/v1 ({args.backend} backend)")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -37,6 +37,8 @@ prompt = ChatPromptTemplate.from_messages(
 llm = ChatOpenAI(
     model="gpt-3.5-turbo-0125",
     streaming=True,
+    # Streamed responses only report token usage when asked to, which the budget needs
+    stream_usage=True,
     temperature=0.0,
 )
 
@@ -0,0 +1,89 @@
+"""Check that BudgetTracker and GraphInstrumentation count the usage a model reports, streamed or not.
+
+No model is called. A stub model reports its usage the way ChatOpenAI does with `stream_usage=True`: on the
+usage_metadata of a final, empty chunk. Run it from the demo folder:
+
+    python -m benchmarks.budget_usage
+"""
+
+import asyncio
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from tools.budget import Budget, BudgetTracker, price_for
+from tools.instrumentation import GraphInstrumentation
+
+USAGE = {
+    "input_tokens": 1200,
+    "output_tokens": 300,
+    "total_tokens": 1500,
+    "input_token_details": {"cache_read": 1024},
+}
+
+
+class UsageReportingModel(BaseChatModel):
+    """Answer with fixed text, and report fixed usage on the message or on the last streamed chunk."""
+
+    model_name: str = "gpt-3.5-turbo-0125"
+    response: str = "Saved the family's allergies."
+
+    @property
+    def _llm_type(self):
+        return "usage-stub"
+
+    @property
+    def _identifying_params(self):
+        # Passed to the callbacks as invocation_params, which is where the tracker looks up the price
+        return {"model_name": self.model_name}
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        message = AIMessage(content=self.response, usage_metadata=USAGE)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        for word in self.response.split(" "):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=USAGE))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        for chunk in self._stream(messages, stop, run_manager, **kwargs):
+            await asyncio.sleep(0)
+            yield chunk
+
+
+async def run_async(llm, messages, config):
+    async for _ in llm.astream(messages, config):
+        pass
+
+
+def check(name, call):
+    tracker = BudgetTracker(Budget(max_iterations=None))
+    instrumentation = GraphInstrumentation()
+    llm = UsageReportingModel()
+    messages = [HumanMessage(content="We are all allergic to peanuts.")]
+    call(llm, messages, {"callbacks": [tracker, instrumentation]})
+
+    price = price_for(llm.model_name)
+    expected_cost = (USAGE["input_tokens"] * price[0] + USAGE["output_tokens"] * price[1]) / 1e6
+    span = instrumentation.spans[0]["attributes"]
+    assert tracker.estimated_calls == 0, f"{name}: usage was estimated instead of read"
+    assert (tracker.tokens_in, tracker.tokens_out) == (1200, 300), f"{name}: {tracker.tokens_in}, {tracker.tokens_out}"
+    assert abs(tracker.cost - expected_cost) < 1e-12, f"{name}: cost {tracker.cost}"
+    assert (span["tokens_in"], span["tokens_out"]) == (1200, 300), f"{name}: {span}"
+    # langchain-core 0.2 drops input_token_details when it merges streamed chunks, so only a complete message
+    # is sure to keep its cache reads
+    if name == "invoke":
+        assert span["cached_tokens"] == 1024, f"{name}: {span}"
+    print(f"{name:<10} {tracker.tokens_in} in, {tracker.tokens_out} out, {span['cached_tokens']} cached, ${tracker.cost:.6f}")
+
+
+def main():
+    check("invoke", lambda llm, messages, config: llm.invoke(messages, config))
+    check("stream", lambda llm, messages, config: list(llm.stream(messages, config)))
+    check("astream", lambda llm, messages, config: asyncio.run(run_async(llm, messages, config)))
+    print("Usage was read, not estimated, for every call")
+
+
+if __name__ == "__main__":
+    main()
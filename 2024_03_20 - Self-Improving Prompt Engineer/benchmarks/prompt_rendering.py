@@ -0,0 +1,78 @@
+"""Measure rows/sec of pure prompt rendering for the eval loop, template vs precompiled prompt.
+
+No model is called. Run it from the demo folder:
+
+    python -m benchmarks.prompt_rendering --rows 20000
+"""
+
+import argparse
+import json
+import os
+import time
+
+# generate_prompt_output creates its client on import, which needs a key even though nothing is sent
+os.environ.setdefault("OPENAI_API_KEY", "stub")
+
+from langchain_core.messages import HumanMessage
+from tools.generate_prompt_output import _compile_prompt, compile_prompt, prompt
+
+EVAL_FILE_PATH = "./data/eval_dataset.jsonl"
+PROMPT_INPUTS = {
+    "opener": "You are an assistant that saves important facts about a family.",
+    "instructions": "Save allergies, likes, dislikes and attributes of each family member.",
+    "chain_of_thought": "Think step by step about which facts are new.",
+    "closer": "Be thorough, and never save the same fact twice.",
+}
+
+
+def load_rows(count):
+    with open(EVAL_FILE_PATH, "r") as infile:
+        rows = [json.loads(line) for line in infile if line.strip()]
+    return [rows[i % len(rows)] for i in range(count)]
+
+
+def render_template(rows):
+    for row in rows:
+        inputs = dict(PROMPT_INPUTS)
+        inputs["messages"] = [HumanMessage(content=row["input"])]
+        inputs["memories"] = row.get("memories", [])
+        prompt.invoke(inputs).to_messages()
+
+
+def render_compiled(rows):
+    for row in rows:
+        compile_prompt(PROMPT_INPUTS).messages(
+            row.get("memories", []), [HumanMessage(content=row["input"])]
+        )
+
+
+def main():
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument("--rows", type=int, default=20000)
+    args = argument_parser.parse_args()
+    rows = load_rows(args.rows)
+
+    # Both paths must produce the same messages
+    row = rows[0]
+    expected = prompt.invoke(
+        {
+            **PROMPT_INPUTS,
+            "messages": [HumanMessage(content=row["input"])],
+            "memories": row.get("memories", []),
+        }
+    ).to_messages()
+    actual = compile_prompt(PROMPT_INPUTS).messages(
+        row.get("memories", []), [HumanMessage(content=row["input"])]
+    )
+    assert expected == actual, "Compiled prompt does not match the template"
+
+    for name, render in (("template", render_template), ("compiled", render_compiled)):
+        _compile_prompt.cache_clear()
+        start = time.perf_counter()
+        render(rows)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<10}{len(rows) / elapsed:>12.0f} rows/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""Fuzz and benchmark the tool call extractor against the strict json.loads parsing it replaced.
+
+No model is called. Run it from the demo folder:
+
+    python -m benchmarks.tool_call_parsing --samples 2000 --large-objects 20000
+
+For each kind of defect open models produce, it reports how many calls the strict parser and the extractor
+recover, and how many calls the extractor returns that the model didn't make in full (a truncated call cut off in
+its knowledge is saved as far as it got). It checks that streaming the same output in random pieces gives the same
+result, and that a repeated call is returned every time. Random mutations
+check that nothing raises. Then it measures throughput on one large output.
+"""
+
+import argparse
+import json
+import logging
+import random
+import re
+import time
+
+from tools.tool_call_parser import ToolCallExtractor, extract_tool_arguments
+
+EVAL_FILE_PATH = "./data/eval_dataset.jsonl"
+
+
+def strict_arguments(additional_kwargs):
+    # What extract_arguments did before: json.loads each arguments string, drop anything that fails
+    arguments_list = []
+    for tool_call in additional_kwargs.get("tool_calls", []):
+        try:
+            arguments_list.append(json.loads(tool_call["function"]["arguments"]))
+        except json.JSONDecodeError:
+            pass
+    return arguments_list
+
+
+def tool_calls(*arguments):
+    return {
+        "tool_calls": [
+            {"function": {"name": "Knowledge_Modifier", "arguments": text}}
+            for text in arguments
+        ]
+    }
+
+
+def python_repr(arguments):
+    return repr(arguments)
+
+
+def truncated_in_value(call, rng):
+    """The call's JSON cut off at a random point inside one of its string values, as when output hits max_tokens."""
+    text = json.dumps(call)
+    start, end = rng.choice(
+        [match.span(1) for match in re.finditer(r':\s*"((?:[^"\\]|\\.)*)"', text)]
+    )
+    return text[: rng.randint(start, end)]
+
+
+def lowercase_enums(arguments):
+    return {
+        **arguments,
+        "category": arguments["category"].lower(),
+        "action": arguments["action"].lower(),
+    }
+
+
+# Each defect turns a list of arguments dicts into (additional_kwargs, content)
+DEFECTS = {
+    "well formed": lambda calls, rng: (tool_calls(*map(json.dumps, calls)), ""),
+    "several objects in one call": lambda calls, rng: (tool_calls("".join(map(json.dumps, calls))), ""),
+    "text in content": lambda calls, rng: (
+        {},
+        "Sure, I'll save that.\n```json\n" + "\n".join(map(json.dumps, calls)) + "\n```",
+    ),
+    "python dict": lambda calls, rng: ({}, " ".join(map(python_repr, calls))),
+    "trailing comma": lambda calls, rng: (
+        tool_calls(*(json.dumps(call)[:-1] + ",}" for call in calls)),
+        "",
+    ),
+    "truncated": lambda calls, rng: (
+        tool_calls(*map(json.dumps, calls[:-1]), truncated_in_value(calls[-1], rng)),
+        "",
+    ),
+    "repeated call": lambda calls, rng: (tool_calls(*map(json.dumps, calls + calls[-1:])), ""),
+    "wrapped": lambda calls, rng: (
+        {},
+        json.dumps([{"name": "Knowledge_Modifier", "arguments": json.dumps(call)} for call in calls]),
+    ),
+    "lowercase enums": lambda calls, rng: (
+        tool_calls(*(json.dumps(lowercase_enums(call)) for call in calls)),
+        "",
+    ),
+}
+
+
+def load_calls():
+    calls = []
+    with open(EVAL_FILE_PATH, "r") as infile:
+        for line in infile:
+            if line.strip():
+                calls.extend(json.loads(line).get("desired_response") or [])
+    return calls
+
+
+def sample_calls(rng, calls, count):
+    return [
+        {**call, "knowledge": f"{call['knowledge']} ({rng.randrange(10**6)})"}
+        for call in rng.sample(calls, min(count, len(calls)))
+    ]
+
+
+def streamed(additional_kwargs, content, rng):
+    extractor = ToolCallExtractor()
+    for index, tool_call in enumerate(additional_kwargs.get("tool_calls", [])):
+        text = tool_call["function"]["arguments"]
+        position = 0
+        while position < len(text):
+            size = rng.randint(1, 12)
+            extractor.feed_arguments(index, text[position : position + size])
+            position += size
+    position = 0
+    while position < len(content):
+        size = rng.randint(1, 12)
+        extractor.feed_content(content[position : position + size])
+        position += size
+    return extractor.close()
+
+
+def mutate(text, rng):
+    characters = list(text)
+    for _ in range(rng.randint(1, 5)):
+        position = rng.randrange(len(characters) + 1)
+        operation = rng.random()
+        if operation < 0.4 and characters:
+            del characters[min(position, len(characters) - 1)]
+        elif operation < 0.8:
+            characters.insert(position, rng.choice('{}[]",:\\\' x'))
+        else:
+            characters[position:position] = characters[position : position + 8]
+    return "".join(characters)
+
+
+def main():
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument("--samples", type=int, default=2000)
+    argument_parser.add_argument("--large-objects", type=int, default=20000)
+    argument_parser.add_argument("--seed", type=int, default=0)
+    args = argument_parser.parse_args()
+    # Invalid objects are logged as warnings, which would flood the output here
+    logging.disable(logging.WARNING)
+
+    rng = random.Random(args.seed)
+    calls = load_calls()
+
+    print(f"{'Defect':<28} {'strict':>8} {'extractor':>10} {'partial':>8}")
+    for name, defect in DEFECTS.items():
+        strict_recovered = recovered = partial = expected_total = 0
+        for _ in range(args.samples):
+            expected = sample_calls(rng, calls, rng.randint(1, 3))
+            additional_kwargs, content = defect(expected, rng)
+            result = extract_tool_arguments(additional_kwargs, content)
+            assert result == streamed(additional_kwargs, content, rng), name
+            if name == "repeated call":
+                assert result.count(expected[-1]) == 2, "a repeated call was merged"
+            expected_total += len(expected)
+            recovered += sum(call in result for call in expected)
+            partial += sum(call not in expected for call in result)
+            strict_recovered += sum(call in strict_arguments(additional_kwargs) for call in expected)
+        print(
+            f"{name:<28} {strict_recovered / expected_total:>8.1%} {recovered / expected_total:>10.1%} "
+            f"{partial / expected_total:>8.1%}"
+        )
+
+    for _ in range(args.samples):
+        text = mutate(json.dumps(sample_calls(rng, calls, 3)), rng)
+        extract_tool_arguments(tool_calls(text), text)
+    print(f"{args.samples} randomly mutated outputs parsed without errors")
+
+    large_calls = [sample_calls(rng, calls, 1)[0] for _ in range(args.large_objects)]
+    content = "\n".join(f"Saving fact {i}: {json.dumps(call)}" for i, call in enumerate(large_calls))
+    megabytes = len(content) / 1e6
+
+    start = time.perf_counter()
+    result = extract_tool_arguments({}, content)
+    elapsed = time.perf_counter() - start
+    print(f"One {megabytes:.1f} MB output: {len(result)} calls in {elapsed:.2f}s ({megabytes / elapsed:.1f} MB/s)")
+
+    start = time.perf_counter()
+    extractor = ToolCallExtractor()
+    for position in range(0, len(content), 16):
+        extractor.feed_content(content[position : position + 16])
+    extractor.close()
+    elapsed = time.perf_counter() - start
+    print(f"Same output streamed in 16 character deltas: {elapsed:.2f}s ({megabytes / elapsed:.1f} MB/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,564 @@
+"""Streaming, resumable version of the steps in 01_Generate_eval_dataset.ipynb.
+
+Each row flows through every stage (input -> dedup -> memories -> expected output -> bad output) on its own,
+with a bounded number of rows in flight, and is appended to the output files as soon as it is finished.
+Re-running with the same output file only generates what each category x scenario cell is still missing.
+By default it writes to new files, so the dataset committed with this demo is left alone. Dropped and failed
+rows are logged through tools.eval_logging, and authentication or quota errors abort the run.
+
+The fine-tuning file repeats the function schema on every row, as the notebook's does. Pass
+finetune_format="shared-tools" to write it once to a separate tools file instead, like
+`python -m tools.finetune_export --format shared-tools`.
+
+    import asyncio
+    from data.eval_dataset_pipeline import run_pipeline
+
+    asyncio.run(run_pipeline(num_rows=50000, concurrency=64))
+"""
+
+import asyncio
+import json
+import os
+import random
+import re
+import zlib
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import openai
+from langchain_openai.chat_models import ChatOpenAI
+from langchain.prompts import (
+    ChatPromptTemplate,
+    SystemMessagePromptTemplate,
+    MessagesPlaceholder,
+)
+from langchain_core.messages import HumanMessage
+from langchain_core.utils.function_calling import convert_to_openai_function
+from tools.knowledge_management_tool import Action, Category
+from tools.eval_logging import get_logger
+from tools.knowledge_management_tool import tool as knowledge_modifier
+from tools.run_eval import extract_arguments
+
+logger = get_logger("eval_dataset_pipeline")
+
+EVAL_FILE_PATH = "./data/eval_dataset.jsonl"
+FINETUNE_FILE_PATH = "./data/finetune_dataset.jsonl"
+GENERATED_EVAL_FILE_PATH = "./data/eval_dataset.generated.jsonl"
+GENERATED_FINETUNE_FILE_PATH = "./data/finetune_dataset.generated.jsonl"
+
+QUESTION_1 = "Do you have any dietary restrictions?"
+QUESTION_2 = "What kind of food do you like?"
+QUESTION_3 = "What should I know about you that would make your meal plan more helpful every week?"
+
+# The question that is most likely to draw out each category
+CATEGORY_QUESTIONS = {
+    Category.Food_Allergy: QUESTION_1,
+    Category.Food_Dislike: QUESTION_1,
+    Category.Food_Like: QUESTION_2,
+    Category.Family_Attribute: QUESTION_3,
+}
+
+# How the existing memories are set up, which determines the action we expect
+# accurate: memories already contain the input, so nothing (or a duplicate Create) is expected
+# mutated: one memory is subtly changed, so an Update is expected
+# none: no memories, so a Create is expected
+# combined: memories come from other rows, so a Create is expected
+SCENARIO_WEIGHTS = {"accurate": 0.25, "mutated": 0.25, "none": 0.25, "combined": 0.25}
+
+SYSTEM_TEMPLATE_GENERATE_INPUT_TEXT = """
+You are a person who is trying to meal-plan for a week.
+
+Before responding, come up with a persona, backstory, and goal for the person you are helping:
+
+- First, come up with your persona: are you a mother, father, boyfriend, wife, single adult? Do you have kids? How many people are your family?
+- Second, come up with a backstory: are you a busy professional? A stay-at-home parent? A college student?
+- Third, come up with a goal: are you trying to eat healthier? Save money? Save time?
+
+Now that you have identified your persona, imagine you are in the middle of meal-planning and someone just asked you the following question:
+
+{question}
+
+Answer the question in a way that a person with your exact backstory might if it was in the middle of a long conversation. You might simply be answering the question, but you may also be referencing something from earlier in the conversation or even providing extra context to explain your answer.
+
+In general, your answers should be pretty short (1 or 2 sentences).
+
+Just answer the question, don't share the persona, backstory, or goal you came up with. We will use that information to help guide the AI to give you a better response.
+
+Your response should only contain 1 key piece of information. For example "I like X food" instead of "I like X and Y foods", but it should exist within a 1 or 2 sentence response. Your goal is to help train and evaluate how good an AI is at extracting this bit of information from a conversation, so don't be way too obvious about your response.
+
+Be super imaginative with your answers. Don't just provide a boring answer. This will help the AI learn to be more creative and interesting in its responses.
+
+I will reward you if you provide an answer I've never seen before.
+"""
+
+SYSTEM_PROMPT_EXPECTED_RESPONSE = """
+You are a supervisor managing a team of knowledge eperts.
+
+Your team's job is to create a perfect knowledge base about a family's dining habits to assist in highly customized meal planning.
+
+The knowledge base should ultimately consist of many discrete pieces of information that add up to a rich persona (e.g. I like pasta; I am allergic to shellfish; I don't eat mussels; I live in Austin, Texas; I have a husband and 2 children aged 5 and 7).
+
+Every time you receive a message, you will evaluate if it has any information worth recording in the knowledge base.
+
+A message may contain multiple pieces of information that should be saved separately.
+
+You are only interested in the following categories of information:
+
+1. The family's food allergies (for example: a dairy or soy allergy) - These are important to know because they can be life-threatening. Only log something as an allergy if you are certain it is an allergy and not just a dislike.
+2. Foods the family likes (for example: likes pasta) - These are important to know because they can help you plan meals, but are not life-threatening.
+3. Foods the family dislikes (for example: doesn't eat mussels or rarely eats beef) - These are important to know because they can help you plan meals, but are not life-threatening.
+4. Attributes about the family that may impact weekly meal planning (for example: lives in Austin, has a husband and 2 children, has a garden, likes big lunches, etc.)
+
+When you receive a message, you perform a sequence of steps consisting of:
+
+1. Analyze the most recent Human message for information. You will see multiple messages for context, but we are only looking for new information in the most recent message.
+2. Compare this to the knowledge you already have.
+3. Determine if this is new knowledge, an update to old knowledge that now needs to change, or should result in deleting information that is not correct. It's possible that a food you previously wrote as a dislike might now be a like, or that a family member who previously liked a food now dislikes it - those examples would require an update.
+
+Call the right tools to save the information, then respond with DONE. If you identiy multiple pieces of information, call everything at once. You only have one chance to call tools.
+
+I will tip you $20 if you are perfect, and I will fine you $40 if you miss any important information or change any incorrect information.
+
+Here are the existing bits of information that we have about the family.
+
+```
+{memories}
+```
+
+Take a deep breath, think step by step, and then analyze the following message:
+"""
+
+SYSTEM_TEMPLATE_MUTATE_MEMORY = """
+Your job is to mutate a string of text to change the meaning of it by only changing or modifying a single word.
+
+This may take a few possible paths:
+- You might make the meaning the opposite of the original meaning
+- You might change the intensity of the meaning (from like to love, or from dislike to hate)
+- You might take an allergy and just make it a dislike, or vice versa
+
+But you will not change the subject or object in the sentence, just the relationship between them.
+
+Here is the sentence to modify:
+
+```
+{memory}
+```
+
+Now return a string that contains the modified sentence and nothing else.
+"""
+
+SYSTEM_TEMPLATE_MUTATE_RESPONSE = """
+Your job is to mutate a string of text to subtly change the meaning of it by only changing or modifying a single word.
+
+This may take a few possible paths:
+- You might make the meaning the opposite of the original meaning
+- You might change the subject to be something different
+- You might modify the verb to make it stronger, weaker, or completely different
+- You might change the complement to be something different
+
+The end sentence should still make sense, it should just be a different sentence with different original meaning than the original because of the word you changed.
+
+Here is the sentence to modify:
+
+```
+{desired_response}
+```
+
+Now return a string that contains the modified sentence and nothing else.
+"""
+
+generate_input_prompt = ChatPromptTemplate.from_messages(
+    [SystemMessagePromptTemplate.from_template(SYSTEM_TEMPLATE_GENERATE_INPUT_TEXT)]
+)
+generate_input_llm = ChatOpenAI(model="gpt-3.5-turbo-0125", temperature=1.0)
+generate_input_runnable = generate_input_prompt | generate_input_llm
+
+knowledge_master_runnable = ChatPromptTemplate.from_messages(
+    [
+        SystemMessagePromptTemplate.from_template(SYSTEM_PROMPT_EXPECTED_RESPONSE),
+        MessagesPlaceholder(variable_name="messages"),
+    ]
+) | ChatOpenAI(model="gpt-3.5-turbo-0125", temperature=0.0).bind_tools(
+    [convert_to_openai_function(knowledge_modifier)]
+)
+
+mutate_memory_runnable = ChatPromptTemplate.from_messages(
+    [SystemMessagePromptTemplate.from_template(SYSTEM_TEMPLATE_MUTATE_MEMORY)]
+) | ChatOpenAI(model="gpt-3.5-turbo-0125", temperature=1.0)
+
+mutate_response_runnable = ChatPromptTemplate.from_messages(
+    [SystemMessagePromptTemplate.from_template(SYSTEM_TEMPLATE_MUTATE_RESPONSE)]
+) | ChatOpenAI(model="gpt-3.5-turbo-0125", temperature=0.4)
+
+
+class MinHashIndex:
+    """Near-duplicate detection with MinHash signatures over character shingles, bucketed with LSH bands."""
+
+    def __init__(self, num_perm=64, bands=16, threshold=0.8, shingle_size=5, seed=1):
+        assert num_perm % bands == 0
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        rng = random.Random(seed)
+        self._prime = (1 << 61) - 1
+        self._params = [
+            (rng.randrange(1, self._prime), rng.randrange(0, self._prime))
+            for _ in range(num_perm)
+        ]
+        self._buckets: List[Dict[tuple, List[int]]] = [{} for _ in range(bands)]
+        self._signatures: List[List[int]] = []
+
+    def shingles(self, text):
+        text = re.sub(r"\W+", " ", text.lower()).strip()
+        if len(text) <= self.shingle_size:
+            return {text}
+        return {
+            text[i : i + self.shingle_size]
+            for i in range(len(text) - self.shingle_size + 1)
+        }
+
+    def signature(self, text):
+        hashes = [zlib.crc32(shingle.encode()) for shingle in self.shingles(text)]
+        prime = self._prime
+        return [min((a * h + b) % prime for h in hashes) for a, b in self._params]
+
+    def similarity(self, first, second):
+        return sum(a == b for a, b in zip(first, second)) / self.num_perm
+
+    def _band_keys(self, signature):
+        for band in range(self.bands):
+            yield band, tuple(signature[band * self.rows : (band + 1) * self.rows])
+
+    def find_duplicate(self, text):
+        """Return the index of a near-duplicate that was already added, or None."""
+        signature = self.signature(text)
+        for band, key in self._band_keys(signature):
+            for candidate in self._buckets[band].get(key, ()):
+                if self.similarity(signature, self._signatures[candidate]) >= self.threshold:
+                    return candidate
+        return None
+
+    def add(self, text):
+        signature = self.signature(text)
+        index = len(self._signatures)
+        self._signatures.append(signature)
+        for band, key in self._band_keys(signature):
+            self._buckets[band].setdefault(key, []).append(index)
+        return index
+
+
+@dataclass
+class RowPlan:
+    row_id: int
+    category: Category
+    scenario: str
+
+    @property
+    def cell(self):
+        return (self.category.value, self.scenario)
+
+
+def allocate(num_rows, weights):
+    """Split num_rows across the weights with the largest remainder method, so quotas are exact."""
+    total = sum(weights.values())
+    exact = {key: num_rows * weight / total for key, weight in weights.items()}
+    counts = {key: int(value) for key, value in exact.items()}
+    leftover = num_rows - sum(counts.values())
+    for key in sorted(exact, key=lambda k: exact[k] - counts[k], reverse=True)[
+        :leftover
+    ]:
+        counts[key] += 1
+    return counts
+
+
+def plan_rows(num_rows, category_weights=None, scenario_weights=None, seed=0):
+    """Stratify rows across every category x scenario pair, then shuffle them deterministically."""
+    category_weights = category_weights or {category: 1 for category in Category}
+    scenario_weights = scenario_weights or SCENARIO_WEIGHTS
+
+    strata = {}
+    for category, category_count in allocate(num_rows, category_weights).items():
+        for scenario, count in allocate(category_count, scenario_weights).items():
+            strata[(category, scenario)] = count
+
+    cells = [key for key, count in strata.items() for _ in range(count)]
+    random.Random(seed).shuffle(cells)
+    return [
+        RowPlan(row_id=row_id, category=category, scenario=scenario)
+        for row_id, (category, scenario) in enumerate(cells)
+    ]
+
+
+FUNCTIONS = [convert_to_openai_function(knowledge_modifier)]
+
+
+def build_finetune_record(row, format="openai"):
+    record = {
+        "messages": [
+            {"role": "user", "content": row["input"]},
+            row["desired_assistant_message"],
+        ]
+    }
+    if format == "openai":
+        record["functions"] = FUNCTIONS
+    return record
+
+
+def tools_file_path(finetune_file):
+    return f"{os.path.splitext(finetune_file)[0]}.tools.json"
+
+
+def is_fatal(error):
+    """Errors that every other row would hit too, so the run should stop instead of counting them as failures."""
+    if isinstance(error, (openai.AuthenticationError, openai.PermissionDeniedError)):
+        return True
+    return isinstance(error, openai.RateLimitError) and getattr(error, "code", None) == "insufficient_quota"
+
+
+class EvalDatasetPipeline:
+    def __init__(
+        self,
+        eval_file=GENERATED_EVAL_FILE_PATH,
+        finetune_file: Optional[str] = GENERATED_FINETUNE_FILE_PATH,
+        finetune_format="openai",
+        concurrency=16,
+        dedup_threshold=0.8,
+        max_input_attempts=6,
+        seed=0,
+    ):
+        self.eval_file = eval_file
+        self.finetune_file = finetune_file
+        self.finetune_format = finetune_format
+        self.concurrency = concurrency
+        self.max_input_attempts = max_input_attempts
+        self.seed = seed
+        self.dedup_index = MinHashIndex(threshold=dedup_threshold)
+        self.completed_inputs: List[str] = []
+        self.stats = {"written": 0, "skipped": 0, "duplicates": 0, "failed": 0}
+        # Rows each category x scenario cell ended up short of its quota, because no new input was found or a
+        # stage failed
+        self.shortfall = Counter()
+        self._write_lock = asyncio.Lock()
+
+    def load_completed(self):
+        """Read rows from a previous run so they count towards their cell's quota and towards deduplication.
+
+        Rows are matched to the plan by the category and scenario stored in them, not by row_id, since which
+        row_id gets which cell depends on num_rows and seed.
+        """
+        completed, row_ids = Counter(), set()
+        if not os.path.exists(self.eval_file):
+            return completed, row_ids
+        with open(self.eval_file, "r") as infile:
+            for line in infile:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                if "row_id" in row:
+                    row_ids.add(row["row_id"])
+                if row.get("target_category") and row.get("scenario"):
+                    completed[(row["target_category"], row["scenario"])] += 1
+                self.dedup_index.add(row["input"])
+                self.completed_inputs.append(row["input"])
+        return completed, row_ids
+
+    async def generate_input(self, plan):
+        question = CATEGORY_QUESTIONS[plan.category]
+        for attempt in range(self.max_input_attempts):
+            # A new seed on every attempt, so a retry isn't drawn from the same distribution that just repeated
+            llm = generate_input_llm.bind(
+                seed=(self.seed * 1_000_003 + plan.row_id) * self.max_input_attempts + attempt
+            )
+            response = await (generate_input_prompt | llm).ainvoke({"question": question})
+            text = response.content.strip()
+            # Drop near-duplicates before paying for any of the downstream stages
+            if self.dedup_index.find_duplicate(text) is None:
+                self.dedup_index.add(text)
+                return text
+            self.stats["duplicates"] += 1
+        return None
+
+    async def extract_knowledge(self, text, memories):
+        response = await knowledge_master_runnable.ainvoke(
+            {"messages": [HumanMessage(content=text)], "memories": memories}
+        )
+        return response.additional_kwargs
+
+    async def generate_memories(self, plan, text, rng):
+        if plan.scenario == "none":
+            return []
+
+        if plan.scenario == "combined" and self.completed_inputs:
+            others = rng.sample(
+                self.completed_inputs, min(len(self.completed_inputs), rng.randint(1, 2))
+            )
+            source = " ".join(others)
+        else:
+            source = text
+
+        memories = [
+            arguments["knowledge"]
+            for arguments in extract_arguments(await self.extract_knowledge(source, []))
+            if arguments.get("knowledge")
+        ]
+
+        if plan.scenario == "mutated" and memories:
+            index = rng.randrange(len(memories))
+            mutated = await mutate_memory_runnable.ainvoke({"memory": memories[index]})
+            memories[index] = mutated.content
+        return memories
+
+    async def generate_expected_output(self, text, memories):
+        tool_calls = await self.extract_knowledge(text, memories)
+        desired_response = extract_arguments(tool_calls)
+        desired_assistant_message = ""
+        if tool_calls.get("tool_calls"):
+            function_call = tool_calls["tool_calls"][0]["function"]
+            desired_assistant_message = {
+                "role": "assistant",
+                "function_call": {
+                    "name": function_call["name"],
+                    "arguments": function_call["arguments"],
+                },
+            }
+        return desired_response, desired_assistant_message
+
+    async def generate_bad_output(self, desired_response, rng):
+        bad_responses = json.loads(json.dumps(desired_response))
+        for response in bad_responses:
+            choice = rng.randint(1, 4)
+            if choice == 1 and response.get("category") in Category._value2member_map_:
+                current = Category(response["category"])
+                response["category"] = rng.choice(
+                    [c for c in Category if c != current]
+                ).value
+            elif choice == 2 and response.get("action") in Action._value2member_map_:
+                current = Action(response["action"])
+                response["action"] = rng.choice([a for a in Action if a != current]).value
+            else:
+                inference = await mutate_response_runnable.ainvoke(
+                    {"desired_response": response.get("knowledge", "")}
+                )
+                response["knowledge"] = inference.content
+        return bad_responses
+
+    async def process_row(self, plan):
+        # Seed per row so a resumed run makes the same choices for the rows it has left
+        rng = random.Random(self.seed * 1_000_003 + plan.row_id)
+
+        text = await self.generate_input(plan)
+        if text is None:
+            logger.warning(
+                "Row %s dropped: %s inputs for %s/%s were all near-duplicates",
+                plan.row_id,
+                self.max_input_attempts,
+                plan.category.value,
+                plan.scenario,
+            )
+            return None
+        memories = await self.generate_memories(plan, text, rng)
+        desired_response, desired_assistant_message = await self.generate_expected_output(
+            text, memories
+        )
+        bad_response = await self.generate_bad_output(desired_response, rng)
+
+        return {
+            "row_id": plan.row_id,
+            "input": text,
+            "memories": memories,
+            "desired_response": desired_response,
+            "bad_response": bad_response,
+            "desired_assistant_message": desired_assistant_message,
+            "target_category": plan.category.value,
+            "scenario": plan.scenario,
+        }
+
+    async def write_row(self, row):
+        async with self._write_lock:
+            with open(self.eval_file, "a") as outfile:
+                outfile.write(json.dumps(row) + "\n")
+            if self.finetune_file and row["desired_assistant_message"]:
+                with open(self.finetune_file, "a") as outfile:
+                    outfile.write(
+                        json.dumps(build_finetune_record(row, self.finetune_format)) + "\n"
+                    )
+            self.completed_inputs.append(row["input"])
+            self.stats["written"] += 1
+
+    def pending_plans(self, plans, completed, row_ids):
+        """The plans each cell still needs, with row_ids that no row in the file has used."""
+        remaining = Counter(completed)
+        next_row_id = max(row_ids | {plan.row_id for plan in plans}, default=-1) + 1
+        pending = []
+        for plan in plans:
+            if remaining[plan.cell] > 0:
+                remaining[plan.cell] -= 1
+                continue
+            if plan.row_id in row_ids:
+                plan = RowPlan(next_row_id, plan.category, plan.scenario)
+                next_row_id += 1
+            pending.append(plan)
+        return pending
+
+    async def run(self, plans):
+        completed, row_ids = self.load_completed()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        if self.finetune_file and self.finetune_format == "shared-tools":
+            with open(tools_file_path(self.finetune_file), "w") as outfile:
+                json.dump(FUNCTIONS, outfile)
+
+        async def worker(plan):
+            async with semaphore:
+                try:
+                    row = await self.process_row(plan)
+                except Exception as e:
+                    if is_fatal(e):
+                        raise
+                    logger.warning("Row %s failed: %s", plan.row_id, e)
+                    self.stats["failed"] += 1
+                    row = None
+                if row is None:
+                    self.shortfall[plan.cell] += 1
+                else:
+                    await self.write_row(row)
+
+        pending = self.pending_plans(plans, completed, row_ids)
+        self.stats["skipped"] = len(plans) - len(pending)
+        tasks = [asyncio.ensure_future(worker(plan)) for plan in pending]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # Stop the rows still in flight, rather than letting them run on after the error
+            for task in tasks:
+                task.cancel()
+            raise
+        self.stats["shortfall"] = sum(self.shortfall.values())
+        return self.stats
+
+
+async def run_pipeline(
+    num_rows=10,
+    eval_file=GENERATED_EVAL_FILE_PATH,
+    finetune_file=GENERATED_FINETUNE_FILE_PATH,
+    finetune_format="openai",
+    concurrency=16,
+    category_weights=None,
+    scenario_weights=None,
+    seed=0,
+):
+    plans = plan_rows(num_rows, category_weights, scenario_weights, seed=seed)
+    pipeline = EvalDatasetPipeline(
+        eval_file=eval_file,
+        finetune_file=finetune_file,
+        finetune_format=finetune_format,
+        concurrency=concurrency,
+        seed=seed,
+    )
+    stats = await pipeline.run(plans)
+    print(f"Eval dataset pipeline finished: {stats}")
+    for (category, scenario), missing in sorted(pipeline.shortfall.items()):
+        print(f"  {category}/{scenario}: {missing} rows short, re-run to fill them")
+    return stats
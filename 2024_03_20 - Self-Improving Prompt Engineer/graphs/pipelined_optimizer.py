@@ -0,0 +1,162 @@
+"""Pipelined optimizer: write the next candidate prompt while the current one is still being tested.
+
+The prompt writer only needs the latest failures to propose its next change. So once the candidate under test has
+`speculation_depth` inaccurate responses, the next change is written speculatively, on the assumption that the
+candidate will be rejected and the incumbent prompt stays. If the candidate is rejected after all, the speculative
+change is tested next without waiting for the writer. If it is accepted, the speculative change was written for a
+prompt that no longer exists, so it is discarded and a new one is written from the accepted prompt.
+
+The prompt controller LLM is skipped, since it only ever asks for another change until the accuracy target or
+the iteration limit is reached, which is enforced here directly. Every change still goes through the graph's
+novelty gate, and a budget is enforced the same way as in run_with_budget when the config has a BudgetTracker:
+
+    import asyncio
+    from graphs.pipelined_optimizer import optimize
+    from tools.budget import Budget, BudgetTracker, with_budget
+
+    tracker = BudgetTracker(Budget(max_cost=2.0))
+    final_state = asyncio.run(optimize(prompt, config=with_budget(None, tracker)))
+"""
+
+import asyncio
+import copy
+
+from graphs.prompt_writer_graph import (
+    EVAL_FILE_PATH,
+    MAX_REGENERATIONS,
+    USE_ANTHROPIC,
+    budget_stop,
+    budgeted_tester_update,
+    gate_candidate,
+    novelty_gate_update,
+    prompt_change,
+    prompt_writer_input,
+    tester_input,
+)
+from tools.budget import budget_tracker
+from tools.eval_logging import get_logger
+from tools.prompt_modification import agenerate_prompt_modification
+from tools.run_eval import aprocess_eval_dataset
+
+# Start writing the next candidate once the current one has this many inaccurate responses
+SPECULATION_DEPTH = 2
+MAX_ITERATIONS = 10
+TARGET_ACCURACY = 0.98
+
+logger = get_logger("pipelined_optimizer")
+
+
+async def write_change(state, config=None):
+    what_changed, new_value = await agenerate_prompt_modification(
+        prompt_writer_input(state, state["prompt_change_log"]),
+        use_anthropic=USE_ANTHROPIC,
+        config=config,
+    )
+    return prompt_change(state, what_changed, new_value)
+
+
+async def next_candidate(task, state, config=None):
+    """The change the task wrote, or a fresh one from the current state if writing it failed."""
+    try:
+        return await task
+    except Exception as e:
+        logger.warning("Writing the next candidate failed, writing it again: %r", e)
+        return await write_change(state, config)
+
+
+async def gated_change(state, change, config=None):
+    """Run a change through the novelty gate, rewriting near duplicates like the graph's novelty_gate node does."""
+    prompt_change_log = state["prompt_change_log"] + [change]
+    outcome, novelty = gate_candidate(state, prompt_change_log)
+    for _ in range(MAX_REGENERATIONS):
+        if outcome != "duplicate" or budget_stop(state, config):
+            break
+        prompt_change_log.append(
+            await write_change({**state, "prompt_change_log": prompt_change_log}, config)
+        )
+        outcome, novelty = gate_candidate(state, prompt_change_log)
+    return outcome, novelty_gate_update(state, prompt_change_log, outcome, novelty)
+
+
+def rejected_state(state, failures):
+    """The state the writer would see if the candidate under test is rejected with these failures."""
+    prompt_change_log = copy.deepcopy(state["prompt_change_log"])
+    prompt_change_log[-1]["results"] = list(failures)
+    return {**state, "prompt_change_log": prompt_change_log}
+
+
+async def optimize(
+    prompt,
+    max_iterations=MAX_ITERATIONS,
+    target_accuracy=TARGET_ACCURACY,
+    speculation_depth=SPECULATION_DEPTH,
+    config=None,
+):
+    state = {
+        "messages": [],
+        "prompt": prompt,
+        "prompt_change_log": [],
+        "highest_accuracy": 0.0,
+        "best_run_id": None,
+    }
+    stats = {"iterations": 0, "speculations_used": 0, "speculations_discarded": 0}
+    tracker = budget_tracker(config)
+    next_change = asyncio.create_task(write_change(state, config))
+
+    for _ in range(max_iterations):
+        change = await next_candidate(next_change, state, config)
+        stats["iterations"] += 1
+
+        outcome, update = await gated_change(state, change, config)
+        state.update(update)
+        if outcome != "test":
+            # A cached result was reused or no new enough change was found, so there is nothing to test
+            if state["highest_accuracy"] >= target_accuracy:
+                break
+            if reason := budget_stop(state, config):
+                state["budget_stop"] = reason
+                break
+            next_change = asyncio.create_task(write_change(state, config))
+            continue
+
+        if reason := budget_stop(state, config, before_test=True):
+            state["budget_stop"] = reason
+            break
+
+        speculative = None
+
+        def on_failures(failures):
+            nonlocal speculative
+            if speculative is None and len(failures) >= speculation_depth:
+                logger.debug("Writing the next candidate speculatively")
+                speculative = asyncio.create_task(
+                    write_change(rejected_state(state, failures), config)
+                )
+
+        input, eval_kwargs = tester_input(state)
+        if tracker is not None:
+            tracker.start_test()
+        results = await aprocess_eval_dataset(
+            EVAL_FILE_PATH, input, config, on_failures=on_failures, **eval_kwargs
+        )
+        state.update(budgeted_tester_update(state, config, eval_kwargs["run_id"], results))
+        accepted = state["prompt_change_log"][-1]["decision"] == "Accepted change"
+
+        if state["highest_accuracy"] >= target_accuracy or state.get("budget_stop"):
+            if speculative is not None:
+                speculative.cancel()
+            break
+
+        if speculative is not None and not accepted:
+            stats["speculations_used"] += 1
+            next_change = speculative
+        else:
+            if speculative is not None:
+                speculative.cancel()
+                stats["speculations_discarded"] += 1
+            next_change = asyncio.create_task(write_change(state, config))
+    if not next_change.done():
+        next_change.cancel()
+
+    logger.info("Pipelined optimization complete", extra={"fields": stats})
+    return state
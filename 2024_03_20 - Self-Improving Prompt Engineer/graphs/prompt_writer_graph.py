@@ -1,14 +1,48 @@
 import json
 import copy
+import uuid
 from langchain_core.messages import ToolMessage, FunctionMessage
 from langgraph.prebuilt import ToolInvocation
 from typing import TypedDict, Sequence, List
 from langchain_core.messages import BaseMessage
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph, END
-from tools.write_prompt_openai import prompt_engineer_runnable
-from tools.write_prompt_anthropic import prompt_engineer_anthropic_runnable
+from tools.prompt_modification import (
+    agenerate_prompt_modification,
+    generate_prompt_modification,
+)
 from agents.prompt_engineer_manager import prompt_controller_runnable, tool_executor
-from tools.run_eval import process_eval_dataset
+from tools.run_eval import aprocess_eval_dataset, process_eval_dataset
+from tools.eval_analysis import is_significant_improvement
+from tools.prompt_objectives import is_better
+from tools.budget import BudgetTracker, budget_tracker, with_budget
+from tools.prompt_novelty import (
+    NOVELTY_THRESHOLD,
+    candidate_prompt,
+    check_novelty,
+    prompt_key,
+)
+from tools.eval_logging import get_logger
+
+EVAL_FILE_PATH = "./data/eval_dataset.jsonl"
+# Row-level results from every test, render them with `python -m tools.eval_report`
+EVAL_RESULTS_FILE_PATH = "./data/eval_results.jsonl"
+# "accuracy" accepts any change that beats the highest accuracy so far. "significant" also requires the
+# candidate to beat the best run on the same eval lines under a paired permutation test, so a single
+# lucky row on a small eval set is not enough to change the prompt. "pareto" accepts a change that is at least as
+# good on accuracy, prompt tokens, latency and output tokens, and "weighted" trades accuracy against them using
+# OBJECTIVE_WEIGHTS in tools/prompt_objectives.py. Under every rule, an accuracy tie goes to the cheaper prompt
+ACCEPTANCE_RULE = "accuracy"
+SIGNIFICANCE_ALPHA = 0.05
+# Write prompt modifications with Claude instead of OpenAI
+USE_ANTHROPIC = False
+# How many of the latest changes the prompt writer sees
+PROMPT_HISTORY_LENGTH = 4
+# How many times a near-duplicate change is rewritten before going back to the controller
+MAX_REGENERATIONS = 2
+SKIPPED_DECISION = "Skipped near duplicate"
+
+logger = get_logger("prompt_writer_graph")
 
 
 class PromptParts(TypedDict):
@@ -25,6 +59,8 @@ class PromptModification(TypedDict):
     results: str
     decision: str
     accuracy: float
+    # Prompt tokens, mean and p95 generation latency and mean output tokens of the test
+    metrics: dict
 
 
 class AgentState(TypedDict):
@@ -34,12 +70,22 @@ class AgentState(TypedDict):
     prompt: PromptParts
     # Change log
     prompt_change_log: List[PromptModification]
-    # Highest accuracy
+    # Accuracy of the accepted prompt, the highest so far unless ACCEPTANCE_RULE is "weighted"
     highest_accuracy: float
+    # Eval run that produced the highest accuracy
+    best_run_id: str
+    # Cost and latency metrics of that run
+    best_metrics: dict
+    # Why the run was stopped early, when it was started with a budget
+    budget_stop: str
+    # What the novelty gate made of the latest change: "test", "cached" or "duplicate"
+    novelty: str
 
 
 # Define the function that determines whether to continue or not
 def should_continue(state):
+    if state.get("budget_stop"):
+        return "end"
     last_message = state["messages"][-1]
     # If there are no tool calls, then we finish
     if "tool_calls" not in last_message.additional_kwargs:
@@ -51,95 +97,113 @@ def should_continue(state):
 
 # Define the function that determines whether the test is complete or not
 def should_run_another_test(state):
+    if state.get("budget_stop"):
+        return "end"
     if state["highest_accuracy"] < 0.98:
         return "continue"
     else:
         return "end"
 
 
+def budget_stop(state, config, before_test=False):
+    """Why the run's budget doesn't allow another node, or None. Runs without a budget are never stopped."""
+    if state.get("budget_stop"):
+        return state["budget_stop"]
+    tracker = budget_tracker(config)
+    if tracker is None:
+        return None
+    reason = tracker.check(
+        state.get("prompt_change_log"), state.get("highest_accuracy"), before_test
+    )
+    if reason:
+        logger.info("Stopping: %s", reason)
+    return reason
+
+
 # Define the function that calls the prompt controller
-def call_prompt_controller(state):
+def call_prompt_controller(state, config):
+    if reason := budget_stop(state, config):
+        return {"budget_stop": reason}
     messages = state["messages"]
-    response = prompt_controller_runnable.invoke({"messages": messages})
+    response = prompt_controller_runnable.invoke({"messages": messages}, config)
     return {"messages": messages + [response]}
 
 
-# Define the function to execute tools
-def call_tool(state):
+async def acall_prompt_controller(state, config):
+    if reason := budget_stop(state, config):
+        return {"budget_stop": reason}
     messages = state["messages"]
-    temp_prompt_change_log = (
-        copy.deepcopy(state["prompt_change_log"])
-        if state["prompt_change_log"] is not None
-        else []
-    )
-    # We know the last message involves at least one tool call
-    last_message = messages[-1]
+    response = await prompt_controller_runnable.ainvoke({"messages": messages}, config)
+    return {"messages": messages + [response]}
 
-    # We loop through all tool calls and append the message to our message log
-    for tool_call in last_message.additional_kwargs["tool_calls"]:
-        action = ToolInvocation(
+
+def tool_invocations(state):
+    # We know the last message involves at least one tool call
+    last_message = state["messages"][-1]
+    return [
+        ToolInvocation(
             tool=tool_call["function"]["name"],
             tool_input=json.loads(tool_call["function"]["arguments"]),
             id=tool_call["id"],
         )
+        for tool_call in last_message.additional_kwargs["tool_calls"]
+    ]
+
+
+def prompt_writer_input(state, temp_prompt_change_log):
+    input = copy.deepcopy(state["prompt"])
+    # Only the fields the writer can use, not the bookkeeping the graph adds to each entry
+    input["prompt_history"] = [
+        {key: entry[key] for key in PromptModification.__annotations__ if key in entry}
+        for entry in temp_prompt_change_log[-PROMPT_HISTORY_LENGTH:]
+    ]
+    return input
+
+
+def prompt_change(state, what_changed, new_value):
+    return {
+        "what_changed": what_changed,
+        "previous_value": state["prompt"][what_changed],
+        "new_value": new_value,
+        "results": "",
+        "decision": "Discarded change",
+        "accuracy": 0.0,
+        "metrics": {},
+    }
+
+
+def copy_prompt_change_log(state):
+    return (
+        copy.deepcopy(state["prompt_change_log"])
+        if state["prompt_change_log"] is not None
+        else []
+    )
 
-        # We call the tool_executor and get back a response
-        if action.tool == "Prompt_Writer":
-            input = copy.deepcopy(state["prompt"])
-            input["prompt_history"] = temp_prompt_change_log[-4:]
-
-            use_anthropic = False
-
-            if use_anthropic:
-                for _ in range(3):
-                    try:
-                        prompt_modification = prompt_engineer_anthropic_runnable.invoke(
-                            input
-                        )
-                        break  # If the code runs successfully, exit the loop
-                    except Exception as e:
-                        print(f"Attempt failed with error: {e}")
-                        continue
-
-                what_changed = None
-                new_value = None
-
-                for item in prompt_modification["response"]:
-                    if "prompt_part" in item:
-                        what_changed = item["prompt_part"]
-                    elif "new_value" in item:
-                        new_value = item["new_value"]
-            else:
-                for _ in range(3):
-                    try:
-                        prompt_modification = prompt_engineer_runnable.invoke(input)
-                        what_changed = prompt_modification["prompt_part"]
-                        new_value = prompt_modification["new_value"]
-                        break  # If the code runs successfully, exit the loop
-                    except Exception as e:
-                        print(f"Attempt failed with error: {e}")
-                        continue
-
-            what_changed = what_changed.strip().lower()
-
-            change = {
-                "what_changed": what_changed,
-                "previous_value": state["prompt"][what_changed],
-                "new_value": new_value,
-                "results": "",
-                "decision": "Discarded change",
-                "accuracy": 0.0,
-            }
 
-            temp_prompt_change_log.append(change)
+# Define the function to execute tools
+def call_tool(state, config):
+    if reason := budget_stop(state, config):
+        return {"budget_stop": reason}
+    messages = state["messages"]
+    temp_prompt_change_log = copy_prompt_change_log(state)
 
+    # We loop through all tool calls and append the message to our message log
+    for action in tool_invocations(state):
+        # We call the tool_executor and get back a response
+        if action.tool == "Prompt_Writer":
+            what_changed, new_value = generate_prompt_modification(
+                prompt_writer_input(state, temp_prompt_change_log),
+                use_anthropic=USE_ANTHROPIC,
+                config=config,
+            )
+            temp_prompt_change_log.append(prompt_change(state, what_changed, new_value))
             response = "New prompt written."
         else:
-            response = tool_executor.invoke(action)
+            response = tool_executor.invoke(action, config)
 
         # We use the response to create a FunctionMessage
         function_message = ToolMessage(
-            content=str(response), name=action.tool, tool_call_id=tool_call["id"]
+            content=str(response), name=action.tool, tool_call_id=action.id
         )
 
         # Add the function message to the list
@@ -147,62 +211,274 @@ def call_tool(state):
     return {"messages": messages, "prompt_change_log": temp_prompt_change_log}
 
 
-def call_tester(state):
+async def acall_tool(state, config):
+    if reason := budget_stop(state, config):
+        return {"budget_stop": reason}
     messages = state["messages"]
-    prompt = copy.deepcopy(state["prompt"])
-    temp_prompt_change_log = copy.deepcopy(state.get("prompt_change_log", []))
+    temp_prompt_change_log = copy_prompt_change_log(state)
+
+    for action in tool_invocations(state):
+        if action.tool == "Prompt_Writer":
+            what_changed, new_value = await agenerate_prompt_modification(
+                prompt_writer_input(state, temp_prompt_change_log),
+                use_anthropic=USE_ANTHROPIC,
+                config=config,
+            )
+            temp_prompt_change_log.append(prompt_change(state, what_changed, new_value))
+            response = "New prompt written."
+        else:
+            response = await tool_executor.ainvoke(action, config)
+
+        messages.append(
+            ToolMessage(content=str(response), name=action.tool, tool_call_id=action.id)
+        )
+    return {"messages": messages, "prompt_change_log": temp_prompt_change_log}
+
+
+def gate_candidate(state, temp_prompt_change_log):
+    """Decide whether the latest change needs testing, marking it in the log if it is a near duplicate."""
+    novelty = check_novelty(state["prompt"], temp_prompt_change_log)
+    if novelty.cached is not None:
+        return "cached", novelty
+    if novelty.similarity >= NOVELTY_THRESHOLD:
+        logger.info(
+            "Skipping a near duplicate of %s (similarity %.2f)",
+            novelty.similar_to,
+            novelty.similarity,
+        )
+        temp_prompt_change_log[-1]["decision"] = SKIPPED_DECISION
+        return "duplicate", novelty
+    return "test", novelty
+
+
+def novelty_gate_update(state, temp_prompt_change_log, outcome, novelty):
+    if outcome == "cached":
+        # The exact same prompt was tested before, so its accuracy stands without another eval pass
+        cached = novelty.cached
+        logger.info("Reusing the result of an identical prompt from run %s", cached.get("run_id"))
+        update = tester_update(
+            {**state, "prompt_change_log": temp_prompt_change_log},
+            cached.get("run_id"),
+            None,
+            cached["accuracy"],
+            cached["results"],
+            cached.get("metrics"),
+        )
+        return {**update, "novelty": outcome}
+
+    messages = state["messages"]
+    if outcome == "duplicate":
+        messages.append(
+            FunctionMessage(
+                content=f"The new prompt was too similar to {novelty.similar_to} to be worth testing. "
+                "Try a different change.",
+                name="Tester",
+            )
+        )
+    return {
+        "messages": messages,
+        "prompt_change_log": temp_prompt_change_log,
+        "novelty": outcome,
+    }
+
+
+def untested_change(state):
+    prompt_change_log = state.get("prompt_change_log")
+    return bool(prompt_change_log) and prompt_change_log[-1]["results"] == ""
+
+
+# Define the function that keeps changes that aren't new from being tested
+def call_novelty_gate(state, config):
+    if reason := budget_stop(state, config):
+        return {"budget_stop": reason}
+    if not untested_change(state):
+        return {"novelty": "test"}
+    temp_prompt_change_log = copy_prompt_change_log(state)
+    outcome, novelty = gate_candidate(state, temp_prompt_change_log)
+
+    # Writing another change is far cheaper than an eval pass
+    for _ in range(MAX_REGENERATIONS):
+        if outcome != "duplicate" or budget_stop(state, config):
+            break
+        what_changed, new_value = generate_prompt_modification(
+            prompt_writer_input(state, temp_prompt_change_log),
+            use_anthropic=USE_ANTHROPIC,
+            config=config,
+        )
+        temp_prompt_change_log.append(prompt_change(state, what_changed, new_value))
+        outcome, novelty = gate_candidate(state, temp_prompt_change_log)
+    return novelty_gate_update(state, temp_prompt_change_log, outcome, novelty)
+
+
+async def acall_novelty_gate(state, config):
+    if reason := budget_stop(state, config):
+        return {"budget_stop": reason}
+    if not untested_change(state):
+        return {"novelty": "test"}
+    temp_prompt_change_log = copy_prompt_change_log(state)
+    outcome, novelty = gate_candidate(state, temp_prompt_change_log)
+
+    for _ in range(MAX_REGENERATIONS):
+        if outcome != "duplicate" or budget_stop(state, config):
+            break
+        what_changed, new_value = await agenerate_prompt_modification(
+            prompt_writer_input(state, temp_prompt_change_log),
+            use_anthropic=USE_ANTHROPIC,
+            config=config,
+        )
+        temp_prompt_change_log.append(prompt_change(state, what_changed, new_value))
+        outcome, novelty = gate_candidate(state, temp_prompt_change_log)
+    return novelty_gate_update(state, temp_prompt_change_log, outcome, novelty)
+
+
+# Define the function that determines whether the latest change needs testing
+def should_test(state):
+    if state.get("budget_stop"):
+        return "end"
+    if state.get("novelty") == "duplicate":
+        return "continue"
+    if state.get("novelty") == "cached":
+        return should_run_another_test(state)
+    return "test"
+
 
+def tester_input(state):
     # Set the prompt input to the current prompt with the new change to test
-    input = copy.deepcopy(prompt)
+    input = copy.deepcopy(state["prompt"])
     change = state["prompt_change_log"][-1]
     what_changed = change["what_changed"].strip().lower()
     input[what_changed] = change["new_value"]
 
-    print("----------------")
-    print("----------------")
-    print(f"Testing the prompt with the following revision:")
-    print(f"Section changed: {what_changed}")
-    print(f"New value:")
-    print(f"{change['new_value']}")
-    print("----------------")
+    logger.info("Testing a revision of the %s", what_changed)
+    logger.debug("New value: %s", change["new_value"])
 
+    eval_kwargs = {
+        "results_file": EVAL_RESULTS_FILE_PATH,
+        "run_id": uuid.uuid4().hex,
+        "candidate": len(state.get("prompt_change_log", [])),
+        "what_changed": what_changed,
+    }
+    return input, eval_kwargs
+
+
+def call_tester(state, config):
+    if reason := budget_stop(state, config, before_test=True):
+        return {"budget_stop": reason}
+    input, eval_kwargs = tester_input(state)
+    tracker = budget_tracker(config)
+    if tracker is not None:
+        tracker.start_test()
     # Run the test
-    confusion_matrix, accuracy, inaccurate_responses = process_eval_dataset(
-        "./data/eval_dataset.jsonl", input
+    results = process_eval_dataset(EVAL_FILE_PATH, input, config, **eval_kwargs)
+    return budgeted_tester_update(state, config, eval_kwargs["run_id"], results)
+
+
+async def acall_tester(state, config):
+    if reason := budget_stop(state, config, before_test=True):
+        return {"budget_stop": reason}
+    input, eval_kwargs = tester_input(state)
+    tracker = budget_tracker(config)
+    if tracker is not None:
+        tracker.start_test()
+    results = await aprocess_eval_dataset(EVAL_FILE_PATH, input, config, **eval_kwargs)
+    return budgeted_tester_update(state, config, eval_kwargs["run_id"], results)
+
+
+def budgeted_tester_update(state, config, run_id, results):
+    tracker = budget_tracker(config)
+    if tracker is not None:
+        tracker.end_test()
+        if tracker.stop_reason is not None:
+            # The budget ran out partway through the test, which is too few rows to judge the change on
+            logger.info("Test stopped early, leaving the change untested: %s", tracker.stop_reason)
+            return {"budget_stop": tracker.stop_reason}
+    update = tester_update(state, run_id, *results)
+    if tracker is not None:
+        # The iteration limit and plateau depend on this test's accuracy, so check them before another round
+        if reason := budget_stop({**state, **update}, config):
+            update["budget_stop"] = reason
+    return update
+
+
+def tester_update(
+    state, run_id, confusion_matrix, accuracy, inaccurate_responses, metrics=None
+):
+    messages = state["messages"]
+    temp_prompt_change_log = copy.deepcopy(state.get("prompt_change_log", []))
+    change = state["prompt_change_log"][-1]
+    what_changed = change["what_changed"].strip().lower()
+
+    logger.info(
+        "Test complete",
+        extra={
+            "fields": {
+                "accuracy": accuracy,
+                "confusion_matrix": confusion_matrix,
+                "metrics": metrics,
+            }
+        },
     )
-    print(f"Test complete. Accuracy: {accuracy}")
-    print(confusion_matrix)
 
     # Create a message to report the accuracy
-    new_message = FunctionMessage(
-        content=f"Tested the new prompt. It had an accuracy of {accuracy}",
-        name="Tester",
-    )
+    content = f"Tested the new prompt. It had an accuracy of {accuracy}"
+    if metrics:
+        content += (
+            f", {metrics['prompt_tokens']} prompt tokens and a p95 latency of {metrics['p95_latency']:.2f}s"
+        )
+    new_message = FunctionMessage(content=content, name="Tester")
     messages.append(new_message)
 
     if temp_prompt_change_log:
         # Update the most recent entry with the inaccurate responses
         temp_prompt_change_log[-1]["results"] = inaccurate_responses
         temp_prompt_change_log[-1]["accuracy"] = accuracy
+        temp_prompt_change_log[-1]["metrics"] = metrics or {}
+        # So the novelty gate can reuse this result if the same prompt comes up again
+        temp_prompt_change_log[-1]["run_id"] = run_id
+        temp_prompt_change_log[-1]["prompt_key"] = prompt_key(
+            candidate_prompt(state["prompt"], change)
+        )
     else:
         # Handle the case where there is no prompt history
-        print("No prompt history to update with inaccurate responses.")
+        logger.warning("No prompt history to update with inaccurate responses.")
+
+    # Older changes are never shown to the prompt writer again, so they only keep a count of their failures
+    # (the full rows are in the eval results file). This keeps the state small as it is copied between nodes
+    for entry in temp_prompt_change_log[:-PROMPT_HISTORY_LENGTH]:
+        if isinstance(entry["results"], list):
+            entry["results"] = f"{len(entry['results'])} inaccurate responses"
 
     # Update the highest accuracy if necessary
     highest_accuracy = (
         state["highest_accuracy"] if state.get("highest_accuracy") is not None else 0.0
     )
+    best_run_id = state.get("best_run_id")
+    best_metrics = state.get("best_metrics")
     temp_prompt = copy.deepcopy(state["prompt"])
-    if accuracy > highest_accuracy:
+    accepted = is_better(
+        ACCEPTANCE_RULE, accuracy, metrics, highest_accuracy, best_metrics
+    )
+    # Only an increase in accuracy needs testing, a tie that goes to the cheaper prompt doesn't
+    if (
+        accepted
+        and ACCEPTANCE_RULE == "significant"
+        and best_run_id
+        and accuracy > highest_accuracy
+    ):
+        accepted, comparison = is_significant_improvement(
+            EVAL_RESULTS_FILE_PATH, run_id, best_run_id, SIGNIFICANCE_ALPHA
+        )
+        logger.info("Compared against the best run", extra={"fields": comparison})
+    if accepted:
         highest_accuracy = accuracy
+        best_run_id = run_id
+        best_metrics = metrics
         temp_prompt[what_changed] = change["new_value"]
         temp_prompt_change_log[-1]["decision"] = "Accepted change"
-        print("Accepted change, here is the new prompt:")
-        print(temp_prompt)
-        print("\n")
+        logger.info("Accepted change")
+        logger.debug("New prompt: %s", temp_prompt)
     else:
-        print("Rejected change")
-        print("\n")
+        logger.info("Rejected change")
 
     # Return the updated state with the modified prompt history
     return {
@@ -210,16 +486,25 @@ def call_tester(state):
         "prompt": temp_prompt,
         "prompt_change_log": temp_prompt_change_log,
         "highest_accuracy": highest_accuracy,
+        "best_run_id": best_run_id,
+        "best_metrics": best_metrics,
     }
 
 
 # Initialize a new graph
 graph = StateGraph(AgentState)
 
-# Define the two "Nodes"" we will cycle between
-graph.add_node("prompt_controller", call_prompt_controller)
-graph.add_node("action", call_tool)
-graph.add_node("test", call_tester)
+# Define the two "Nodes"" we will cycle between. Each node has a sync and an async implementation, so the
+# compiled graph runs natively under both `invoke` and `ainvoke`
+graph.add_node(
+    "prompt_controller",
+    RunnableLambda(call_prompt_controller, afunc=acall_prompt_controller),
+)
+graph.add_node("action", RunnableLambda(call_tool, afunc=acall_tool))
+graph.add_node(
+    "novelty_gate", RunnableLambda(call_novelty_gate, afunc=acall_novelty_gate)
+)
+graph.add_node("test", RunnableLambda(call_tester, afunc=acall_tester))
 
 # Define all our Edges
 
@@ -236,6 +521,16 @@ graph.add_conditional_edges(
     },
 )
 
+graph.add_conditional_edges(
+    "novelty_gate",
+    should_test,
+    {
+        "test": "test",
+        "continue": "prompt_controller",
+        "end": END,
+    },
+)
+
 graph.add_conditional_edges(
     "test",
     should_run_another_test,
@@ -246,7 +541,23 @@ graph.add_conditional_edges(
 )
 
 # We now add Normal Edges that should always be called after another
-graph.add_edge("action", "test")
+graph.add_edge("action", "novelty_gate")
 
 # We compile the entire workflow as a runnable
 app = graph.compile()
+
+
+def run_with_budget(input, budget=None, config=None):
+    """Run the optimizer until it finishes or hits a limit of the Budget.
+
+    Returns the final state, whose prompt is the best one accepted so far, and a report of what was spent.
+    """
+    tracker = BudgetTracker(budget)
+    final_state = app.invoke(input, with_budget(config, tracker))
+    return final_state, tracker.report(final_state)
+
+
+async def arun_with_budget(input, budget=None, config=None):
+    tracker = BudgetTracker(budget)
+    final_state = await app.ainvoke(input, with_budget(config, tracker))
+    return final_state, tracker.report(final_state)
@@ -0,0 +1,258 @@
+"""Hard limits on what an optimizer run may spend.
+
+A `BudgetTracker` is a callback handler, like `GraphInstrumentation`, that adds up the tokens and cost of every LLM
+call from its usage metadata as the run goes. The graph nodes check it before doing any more work and stop the
+run cleanly once a limit is hit, keeping the best prompt found so far:
+
+    from graphs.prompt_writer_graph import run_with_budget
+    from tools.budget import Budget, print_budget_report
+
+    final_state, report = run_with_budget(input, Budget(max_cost=2.0, max_seconds=1800))
+    print(final_state["prompt"])
+    print_budget_report(report)
+"""
+
+import json
+import sys
+import threading
+import time
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from tools.instrumentation import _tokens_from_usage, _usage_from_response
+
+# USD per million tokens (input, output). Calls to models missing here are counted in tokens but not cost
+MODEL_PRICES = {
+    "gpt-3.5-turbo-0125": (0.50, 1.50),
+    "gpt-4-0125-preview": (10.00, 30.00),
+    "claude-3-sonnet-20240229": (3.00, 15.00),
+}
+# Calls that come back without usage have their tokens estimated from the text
+CHARACTERS_PER_TOKEN = 4
+RECURSION_LIMIT = 1000
+
+
+@dataclass
+class Budget:
+    max_tokens: Optional[int] = None
+    max_cost: Optional[float] = None
+    max_seconds: Optional[float] = None
+    # Tested changes, which is the limit the controller prompt asks for but can't enforce
+    max_iterations: Optional[int] = 10
+    # Stop when this many tested changes in a row haven't beaten the best accuracy by at least plateau_min_gain
+    plateau_window: Optional[int] = 4
+    plateau_min_gain: float = 0.01
+
+
+def price_for(model):
+    # Longest matching prefix, so dated model names fall back to their family's price
+    matches = [name for name in MODEL_PRICES if model.startswith(name)]
+    return MODEL_PRICES[max(matches, key=len)] if matches else None
+
+
+def _prompt_characters(messages, invocation_params):
+    # The bound tool schemas are sent with every call, so they count towards its prompt too
+    tools = invocation_params.get("tools") or invocation_params.get("functions")
+    return sum(
+        len(str(getattr(message, "content", "") or ""))
+        for batch in messages
+        for message in batch
+    ) + (len(json.dumps(tools, default=str)) if tools else 0)
+
+
+def tested_accuracies(prompt_change_log):
+    # A change's results stay "" until the tester fills them in, with a list or a count of failures
+    return [
+        entry["accuracy"]
+        for entry in prompt_change_log or []
+        if entry.get("results") != ""
+    ]
+
+
+def plateaued(accuracies, window, min_gain):
+    """Whether the last `window` tested changes all failed to beat the best accuracy before them."""
+    if not window or len(accuracies) <= window:
+        return False
+    return max(accuracies[-window:]) < max(accuracies[:-window]) + min_gain
+
+
+class BudgetTracker(BaseCallbackHandler):
+    """Live token and cost accounting for one run, checked against a Budget."""
+
+    def __init__(self, budget=None):
+        self.budget = budget or Budget()
+        self.started = time.time()
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.cost = 0.0
+        self.calls = 0
+        self.estimated_calls = 0
+        self.unpriced_tokens = 0
+        self.by_model = defaultdict(lambda: {"calls": 0, "tokens_in": 0, "tokens_out": 0, "cost": 0.0})
+        self.stop_reason = None
+        # What the last eval run cost, to tell whether the next one still fits
+        self.last_test = None
+        self._test_started = None
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    @property
+    def elapsed(self):
+        return time.time() - self.started
+
+    @property
+    def tokens(self):
+        return self.tokens_in + self.tokens_out
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        invocation_params = kwargs.get("invocation_params") or {}
+        model = invocation_params.get("model") or invocation_params.get(
+            "model_name", (serialized or {}).get("name", "llm")
+        )
+        with self._lock:
+            self._pending[run_id] = (model, _prompt_characters(messages, invocation_params))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        tokens_in, tokens_out, _ = _tokens_from_usage(_usage_from_response(response))
+        with self._lock:
+            model, prompt_characters = self._pending.pop(run_id, ("llm", 0))
+            if not tokens_in and not tokens_out:
+                self.estimated_calls += 1
+                output_characters = sum(
+                    len(generation.text or "")
+                    + len(str(getattr(getattr(generation, "message", None), "additional_kwargs", "") or ""))
+                    for generations in response.generations
+                    for generation in generations
+                )
+                tokens_in = prompt_characters // CHARACTERS_PER_TOKEN
+                tokens_out = output_characters // CHARACTERS_PER_TOKEN
+
+            price = price_for(model)
+            cost = (
+                (tokens_in * price[0] + tokens_out * price[1]) / 1e6 if price else 0.0
+            )
+            if price is None:
+                self.unpriced_tokens += tokens_in + tokens_out
+
+            self.calls += 1
+            self.tokens_in += tokens_in
+            self.tokens_out += tokens_out
+            self.cost += cost
+            row = self.by_model[model]
+            row["calls"] += 1
+            row["tokens_in"] += tokens_in
+            row["tokens_out"] += tokens_out
+            row["cost"] += cost
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            self._pending.pop(run_id, None)
+
+    def start_test(self):
+        self._test_started = (self.tokens, self.cost, time.time())
+
+    def end_test(self):
+        tokens, cost, started = self._test_started
+        self.last_test = (self.tokens - tokens, self.cost - cost, time.time() - started)
+
+    def check(self, prompt_change_log=None, highest_accuracy=None, before_test=False):
+        """The reason the run must stop, or None. Once a limit is hit it stays hit.
+
+        Limits are checked between nodes, and after every row of an eval run, which stops the run early once a
+        limit is hit. With `before_test`, a test that would cross a limit if it costs as much as the last one is not
+        started.
+        """
+        if self.stop_reason is not None:
+            return self.stop_reason
+
+        budget = self.budget
+        accuracies = tested_accuracies(prompt_change_log)
+        tokens, cost, elapsed = self.tokens, self.cost, self.elapsed
+        if before_test and self.last_test is not None:
+            tokens, cost, elapsed = (
+                tokens + self.last_test[0],
+                cost + self.last_test[1],
+                elapsed + self.last_test[2],
+            )
+        if budget.max_tokens is not None and tokens >= budget.max_tokens:
+            self.stop_reason = f"Token budget of {budget.max_tokens} reached"
+        elif budget.max_cost is not None and cost >= budget.max_cost:
+            self.stop_reason = f"Cost budget of ${budget.max_cost:.2f} reached"
+        elif budget.max_seconds is not None and elapsed >= budget.max_seconds:
+            self.stop_reason = f"Time budget of {budget.max_seconds:.0f}s reached"
+        elif budget.max_iterations is not None and len(accuracies) >= budget.max_iterations:
+            self.stop_reason = f"Iteration limit of {budget.max_iterations} reached"
+        elif plateaued(accuracies, budget.plateau_window, budget.plateau_min_gain):
+            self.stop_reason = (
+                f"Accuracy plateaued at {highest_accuracy if highest_accuracy is not None else max(accuracies)} "
+                f"for {budget.plateau_window} changes"
+            )
+        return self.stop_reason
+
+    def report(self, state=None):
+        state = state or {}
+        return {
+            "stop_reason": self.stop_reason or "Finished within budget",
+            "limits": asdict(self.budget),
+            "elapsed_seconds": self.elapsed,
+            "llm_calls": self.calls,
+            "estimated_calls": self.estimated_calls,
+            "tokens_in": self.tokens_in,
+            "tokens_out": self.tokens_out,
+            "cost": self.cost,
+            "unpriced_tokens": self.unpriced_tokens,
+            "by_model": {model: dict(row) for model, row in self.by_model.items()},
+            "last_test": dict(zip(("tokens", "cost", "seconds"), self.last_test or ())),
+            "iterations": len(tested_accuracies(state.get("prompt_change_log"))),
+            "highest_accuracy": state.get("highest_accuracy"),
+            "best_run_id": state.get("best_run_id"),
+        }
+
+
+def budget_tracker(config):
+    """The BudgetTracker a run was started with, if any."""
+    return ((config or {}).get("configurable") or {}).get("budget_tracker")
+
+
+def with_budget(config, tracker):
+    """A copy of the run config that reports LLM usage to the tracker and lets the nodes find it."""
+    config = dict(config or {})
+    callbacks = config.get("callbacks")
+    if callbacks is None:
+        callbacks = [tracker]
+    elif isinstance(callbacks, list):
+        callbacks = callbacks + [tracker]
+    else:
+        # A callback manager
+        callbacks = callbacks.copy()
+        callbacks.add_handler(tracker, inherit=True)
+    config["callbacks"] = callbacks
+    config["configurable"] = {**(config.get("configurable") or {}), "budget_tracker": tracker}
+    # The budget ends the run, not LangGraph's default limit of 25 steps
+    config.setdefault("recursion_limit", RECURSION_LIMIT)
+    return config
+
+
+def print_budget_report(report, file=sys.stdout):
+    print(f"Stopped: {report['stop_reason']}", file=file)
+    print(
+        f"Spent: ${report['cost']:.4f}, {report['tokens_in']} tokens in, {report['tokens_out']} tokens out, "
+        f"{report['llm_calls']} LLM calls, {report['elapsed_seconds']:.0f}s",
+        file=file,
+    )
+    if report["estimated_calls"]:
+        print(f"  {report['estimated_calls']} calls had no usage metadata, their tokens are estimated", file=file)
+    if report["unpriced_tokens"]:
+        print(f"  {report['unpriced_tokens']} tokens from models without a price in MODEL_PRICES", file=file)
+    for model, row in sorted(report["by_model"].items(), key=lambda item: -item[1]["cost"]):
+        print(
+            f"  {model}: {row['calls']} calls, {row['tokens_in']} in, {row['tokens_out']} out, ${row['cost']:.4f}",
+            file=file,
+        )
+    print(
+        f"Best accuracy {report['highest_accuracy']} after {report['iterations']} tested changes "
+        f"(run {report['best_run_id']})",
+        file=file,
+    )
@@ -0,0 +1,270 @@
+"""Vectorized statistics over the row-level eval results written by process_eval_dataset.
+
+Results are loaded once into flat NumPy columns, after which every statistic is a handful of array operations,
+so comparing runs stays fast even over millions of rows.
+
+    python -m tools.eval_analysis ./data/eval_results.jsonl
+    python -m tools.eval_analysis ./data/eval_results.jsonl --compare <run_id_a> <run_id_b>
+"""
+
+import argparse
+import json
+from dataclasses import dataclass
+
+import numpy as np
+from tools.knowledge_management_tool import Action, Category
+
+CATEGORIES = [category.value for category in Category]
+ACTIONS = [action.value for action in Action]
+
+
+@dataclass
+class EvalResults:
+    run_ids: np.ndarray  # unique run ids, indexed by the codes in `run`
+    run: np.ndarray  # run code per row
+    line: np.ndarray  # eval dataset line per row
+    expected_correct: np.ndarray  # the output matched the desired response (TP, otherwise FN)
+    bad_correct: np.ndarray  # the output was told apart from the bad response (TN, otherwise FP)
+    # One entry per desired response, so a row with several memories counts towards each of their labels
+    label_row: np.ndarray
+    category: np.ndarray  # index into CATEGORIES, -1 if unknown
+    action: np.ndarray  # index into ACTIONS, -1 if unknown
+    # The same, for each call in the model's actual output
+    predicted_row: np.ndarray
+    predicted_category: np.ndarray
+    predicted_action: np.ndarray
+
+    @property
+    def scores(self):
+        # Each row contributes two checks to the confusion matrix, so its accuracy is 0, 0.5 or 1
+        return (self.expected_correct.astype(np.float64) + self.bad_correct) / 2
+
+    def run_index(self, run_id):
+        matches = np.flatnonzero(self.run_ids == run_id)
+        if not len(matches):
+            raise KeyError(f"Unknown run id: {run_id}")
+        return int(matches[0])
+
+    def save(self, file_name):
+        np.savez_compressed(file_name, **self.__dict__)
+
+    @classmethod
+    def load(cls, file_name):
+        with np.load(file_name, allow_pickle=False) as data:
+            return cls(**{key: data[key] for key in data.files})
+
+
+def load_results(file_names, run_ids=None):
+    run_codes = {}
+    run, line, expected_correct, bad_correct = [], [], [], []
+    label_row, category, action = [], [], []
+    predicted_row, predicted_category, predicted_action = [], [], []
+    category_codes = {value: index for index, value in enumerate(CATEGORIES)}
+    action_codes = {value: index for index, value in enumerate(ACTIONS)}
+
+    for file_name in [file_names] if isinstance(file_names, str) else file_names:
+        with open(file_name, "r") as infile:
+            for text in infile:
+                if not text.strip():
+                    continue
+                row = json.loads(text)
+                if run_ids is not None and row["run_id"] not in run_ids:
+                    continue
+                row_index = len(run)
+                run.append(run_codes.setdefault(row["run_id"], len(run_codes)))
+                line.append(row["line"])
+                expected_correct.append(row["expected_correct"])
+                bad_correct.append(row["bad_correct"])
+                for response in row.get("desired_response") or []:
+                    label_row.append(row_index)
+                    category.append(category_codes.get(response.get("category"), -1))
+                    action.append(action_codes.get(response.get("action"), -1))
+                for response in row.get("actual_output") or []:
+                    if not isinstance(response, dict):
+                        continue
+                    predicted_row.append(row_index)
+                    predicted_category.append(category_codes.get(response.get("category"), -1))
+                    predicted_action.append(action_codes.get(response.get("action"), -1))
+
+    return EvalResults(
+        run_ids=np.array(list(run_codes), dtype=str),
+        run=np.array(run, dtype=np.int32),
+        line=np.array(line, dtype=np.int32),
+        expected_correct=np.array(expected_correct, dtype=bool),
+        bad_correct=np.array(bad_correct, dtype=bool),
+        label_row=np.array(label_row, dtype=np.int64),
+        category=np.array(category, dtype=np.int8),
+        action=np.array(action, dtype=np.int8),
+        predicted_row=np.array(predicted_row, dtype=np.int64),
+        predicted_category=np.array(predicted_category, dtype=np.int8),
+        predicted_action=np.array(predicted_action, dtype=np.int8),
+    )
+
+
+def run_accuracy(results):
+    num_runs = len(results.run_ids)
+    rows = np.bincount(results.run, minlength=num_runs)
+    correct = np.bincount(results.run, weights=results.scores, minlength=num_runs)
+    return np.divide(correct, rows, out=np.zeros(num_runs), where=rows > 0)
+
+
+def label_counts(rows, labels, num_rows, num_labels):
+    """How often each row has each label, as a (num_rows, num_labels) array."""
+    known = labels >= 0
+    group = rows[known] * num_labels + labels[known]
+    return np.bincount(group, minlength=num_rows * num_labels).reshape(num_rows, num_labels)
+
+
+def precision_recall_by_label(results, desired_labels, predicted_labels, num_labels):
+    """Precision and recall per run and label, as (num_runs, num_labels) arrays.
+
+    Labels are compared within each row: as many of a row's predicted labels as it has desired ones of the same
+    label are true positives, any extra predicted ones are false positives and any missing ones false negatives.
+    So precision is over what the model output and recall over what the desired response asked for.
+    """
+    num_rows = len(results.run)
+    desired = label_counts(results.label_row, desired_labels, num_rows, num_labels)
+    predicted = label_counts(results.predicted_row, predicted_labels, num_rows, num_labels)
+    matched = np.minimum(desired, predicted)
+
+    def per_run(counts):
+        totals = np.zeros((len(results.run_ids), num_labels), dtype=np.int64)
+        np.add.at(totals, results.run, counts)
+        return totals
+
+    tp = per_run(matched)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        precision = tp / per_run(predicted)
+        recall = tp / per_run(desired)
+    return precision, recall
+
+
+def category_precision_recall(results):
+    return precision_recall_by_label(
+        results, results.category, results.predicted_category, len(CATEGORIES)
+    )
+
+
+def action_precision_recall(results):
+    return precision_recall_by_label(
+        results, results.action, results.predicted_action, len(ACTIONS)
+    )
+
+
+def bootstrap_accuracy_ci(results, num_resamples=10000, confidence=0.95, seed=0):
+    """Bootstrap confidence interval of each run's accuracy.
+
+    Row scores can only be 0, 0.5 or 1, so resampling n rows is the same as drawing the counts of each score
+    from a multinomial. That makes every resample O(1) instead of O(n), whatever the number of rows.
+    """
+    rng = np.random.default_rng(seed)
+    score_codes = (results.expected_correct.astype(np.int64) + results.bad_correct)  # 0, 1 or 2
+    counts = np.zeros((len(results.run_ids), 3), dtype=np.int64)
+    np.add.at(counts, (results.run, score_codes), 1)
+
+    alpha = (1 - confidence) / 2
+    intervals = np.full((len(results.run_ids), 2), np.nan)
+    for index, run_counts in enumerate(counts):
+        n = run_counts.sum()
+        if not n:
+            continue
+        draws = rng.multinomial(n, run_counts / n, size=num_resamples)
+        accuracies = (draws[:, 1] * 0.5 + draws[:, 2]) / n
+        intervals[index] = np.quantile(accuracies, [alpha, 1 - alpha])
+    return intervals
+
+
+def paired_differences(results, run_a, run_b):
+    """Per-line score difference (a - b) for the eval lines both runs reached."""
+    scores = results.scores
+    mask_a = results.run == run_a
+    mask_b = results.run == run_b
+    _, index_a, index_b = np.intersect1d(
+        results.line[mask_a], results.line[mask_b], return_indices=True
+    )
+    return scores[mask_a][index_a] - scores[mask_b][index_b]
+
+
+def paired_permutation_test(differences, num_permutations=100000, seed=0):
+    """One-sided sign-flip permutation test that run a beats run b on the same lines.
+
+    Differences only take a few distinct magnitudes, so flipping signs at random is the same as drawing a
+    binomial per magnitude, which keeps the test O(num_permutations) regardless of the number of lines.
+    """
+    differences = np.asarray(differences, dtype=np.float64)
+    observed = differences.sum()
+    rng = np.random.default_rng(seed)
+
+    magnitudes, counts = np.unique(np.abs(differences[differences != 0]), return_counts=True)
+    permuted = np.zeros(num_permutations)
+    for magnitude, count in zip(magnitudes, counts):
+        positives = rng.binomial(count, 0.5, size=num_permutations)
+        permuted += magnitude * (2 * positives - count)
+
+    # Count the observed arrangement too, so the p-value is never exactly zero
+    p_value = (np.count_nonzero(permuted >= observed) + 1) / (num_permutations + 1)
+    return {
+        "lines": len(differences),
+        "mean_difference": float(differences.mean()) if len(differences) else 0.0,
+        "p_value": float(p_value),
+    }
+
+
+def compare_runs(results, run_id_a, run_id_b, **kwargs):
+    differences = paired_differences(
+        results, results.run_index(run_id_a), results.run_index(run_id_b)
+    )
+    return paired_permutation_test(differences, **kwargs)
+
+
+def is_significant_improvement(results_file, candidate_run_id, incumbent_run_id, alpha=0.05):
+    """Acceptance rule for the optimizer: the candidate must beat the incumbent on the same lines, significantly."""
+    results = load_results(results_file, run_ids={candidate_run_id, incumbent_run_id})
+    comparison = compare_runs(results, candidate_run_id, incumbent_run_id)
+    accepted = comparison["mean_difference"] > 0 and comparison["p_value"] < alpha
+    return accepted, comparison
+
+
+def print_report(results):
+    accuracy = run_accuracy(results)
+    intervals = bootstrap_accuracy_ci(results)
+    category_precision, category_recall = category_precision_recall(results)
+    action_precision, action_recall = action_precision_recall(results)
+    rows = np.bincount(results.run, minlength=len(results.run_ids))
+
+    def fmt(value):
+        return "  -  " if np.isnan(value) else f"{value:.2f}"
+
+    for index, run_id in enumerate(results.run_ids):
+        low, high = intervals[index]
+        print(
+            f"Run {run_id}: {rows[index]} rows, accuracy {accuracy[index]:.3f} (95% CI {low:.3f}-{high:.3f})"
+        )
+        for names, precision, recall in (
+            (CATEGORIES, category_precision, category_recall),
+            (ACTIONS, action_precision, action_recall),
+        ):
+            print(
+                "  "
+                + "  ".join(
+                    f"{name}: P {fmt(precision[index, i])} R {fmt(recall[index, i])}"
+                    for i, name in enumerate(names)
+                )
+            )
+
+
+def main():
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument("results_files", nargs="+")
+    argument_parser.add_argument("--compare", nargs=2, metavar=("RUN_A", "RUN_B"))
+    args = argument_parser.parse_args()
+
+    results = load_results(args.results_files)
+    if args.compare:
+        print(compare_runs(results, *args.compare))
+    else:
+        print_report(results)
+
+
+if __name__ == "__main__":
+    main()
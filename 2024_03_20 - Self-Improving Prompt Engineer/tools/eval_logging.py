@@ -0,0 +1,93 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+
+LOGGER_NAME = "prompt_engineer"
+
+# Logging is off until configure_logging is called, so the eval loop does no stdout work by default
+logging.getLogger(LOGGER_NAME).addHandler(logging.NullHandler())
+logging.getLogger(LOGGER_NAME).propagate = False
+
+_listener = None
+
+
+def _stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+# Registered once, and stops whichever listener is current at exit
+atexit.register(_stop_listener)
+
+
+def get_logger(name):
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        # Anything passed through `extra={"fields": {...}}` is logged as structured fields
+        entry.update(getattr(record, "fields", {}))
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level="INFO", json_format=True, stream=None):
+    """Send logs through a queue to a background thread, so logging never blocks the eval loop on I/O.
+
+    Calling it again replaces the current configuration and its thread.
+    """
+    global _listener
+    _stop_listener()
+
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(
+        JsonFormatter()
+        if json_format
+        else logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+    )
+
+    log_queue = queue.SimpleQueue()
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+    logger.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, handler)
+    _listener.start()
+
+
+class EvalResultsWriter:
+    """Append one compact JSON line per eval row. Render the file with `python -m tools.eval_report`."""
+
+    def __init__(self, file_name, run_id, **run_metadata):
+        self.run_id = run_id
+        self.run_metadata = run_metadata
+        # A large buffer keeps the per-row cost to an in-memory append
+        self._file = open(file_name, "a", buffering=1 << 16)
+
+    def write(self, **row):
+        record = {"run_id": self.run_id, "time": round(time.time(), 3)}
+        record.update(self.run_metadata)
+        record.update(row)
+        self._file.write(json.dumps(record, separators=(",", ":")))
+        self._file.write("\n")
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
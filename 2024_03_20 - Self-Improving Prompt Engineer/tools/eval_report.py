@@ -0,0 +1,75 @@
+"""Render row-level eval results written by process_eval_dataset.
+
+    python -m tools.eval_report ./data/eval_results.jsonl
+    python -m tools.eval_report ./data/eval_results.jsonl --run <run_id> --failures 20
+"""
+
+import argparse
+import json
+from collections import Counter, OrderedDict
+
+
+def load_runs(file_name):
+    runs = OrderedDict()
+    with open(file_name, "r") as infile:
+        for line in infile:
+            if line.strip():
+                row = json.loads(line)
+                runs.setdefault(row["run_id"], []).append(row)
+    return runs
+
+
+def confusion_matrix(rows):
+    matrix = {"TP": 0, "FP": 0, "TN": 0, "FN": 0}
+    for row in rows:
+        matrix["TP" if row["expected_correct"] else "FN"] += 1
+        matrix["TN" if row["bad_correct"] else "FP"] += 1
+    total = sum(matrix.values())
+    accuracy = (matrix["TP"] + matrix["TN"]) / total if total else 0
+    return matrix, accuracy
+
+
+def print_run(run_id, rows, max_failures):
+    matrix, accuracy = confusion_matrix(rows)
+    first = rows[0]
+    print(f"Run {run_id}")
+    if first.get("what_changed"):
+        print(f"  Candidate {first.get('candidate')}: changed {first['what_changed']}")
+    print(f"  Rows: {len(rows)}  Accuracy: {accuracy:.3f}")
+    print("                       Correct  Incorrect")
+    print(f"  vs desired response  {matrix['TP']:>7}  {matrix['FN']:>9}  (TP / FN)")
+    print(f"  vs bad response      {matrix['TN']:>7}  {matrix['FP']:>9}  (TN / FP)")
+
+    failures = [
+        (row, row["expected_detail"])
+        for row in rows
+        if not row["expected_correct"]
+    ] + [(row, row["bad_detail"]) for row in rows if not row["bad_correct"]]
+    if not failures:
+        return
+
+    print(f"  Failures ({len(failures)}):")
+    reasons = Counter(str(reason).split(":")[0] for _, reason in failures)
+    for reason, count in reasons.most_common():
+        print(f"    {count:>4}  {reason}")
+    for row, reason in failures[:max_failures]:
+        print(f"    line {row['line']}: {row['input']!r}")
+        print(f"      {reason}")
+
+
+def main():
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument("results_file")
+    argument_parser.add_argument("--run", help="Only show this run id")
+    argument_parser.add_argument("--failures", type=int, default=10)
+    args = argument_parser.parse_args()
+
+    for run_id, rows in load_runs(args.results_file).items():
+        if args.run and run_id != args.run:
+            continue
+        print_run(run_id, rows, args.failures)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""Export accepted eval outputs as chat fine-tuning data.
+
+Streams the row-level results written during optimizer runs (data/eval_results.jsonl), keeps the rows whose
+tool calls passed both evals, and writes them as train/validation files. The system prompt is rendered from the
+prompt in an optimizer checkpoint (a JSON file holding the graph's final state, or at least its "prompt"), so the
+fine-tuned model sees the same prompt it will be deployed with.
+
+    python -m tools.finetune_export ./data/eval_results.jsonl --checkpoint ./data/checkpoint.json
+    python -m tools.finetune_export ./data/eval_results.jsonl --format shared-tools
+"""
+
+import argparse
+import hashlib
+import json
+import os
+
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from tools.generate_prompt_output import compile_prompt
+from tools.knowledge_management_tool import tool as knowledge_modifier_tool
+
+ARGUMENT_KEYS = ("knowledge", "knowledge_old", "category", "action")
+
+
+def load_checkpoint_prompt(file_name):
+    with open(file_name, "r") as infile:
+        checkpoint = json.load(infile)
+    return checkpoint.get("prompt", checkpoint)
+
+
+def normalize_arguments(arguments):
+    # Fixed key order and no empty values, so identical tool calls serialize identically
+    return {
+        key: arguments[key] for key in ARGUMENT_KEYS if arguments.get(key) not in (None, "")
+    }
+
+
+def is_accepted(row):
+    return bool(row.get("expected_correct")) and bool(row.get("bad_correct"))
+
+
+class FinetuneExporter:
+    """Deduplicate rows and split them deterministically into train and validation files.
+
+    In the "openai" format every row carries the tool schema, because the fine-tuning API requires it.
+    In the "shared-tools" format the schema is written once to a separate tools file instead.
+    """
+
+    def __init__(
+        self,
+        output_prefix,
+        prompt,
+        validation_fraction=0.1,
+        format="openai",
+    ):
+        self.prompt = prompt
+        self.validation_fraction = validation_fraction
+        self.format = format
+        self.tools = [convert_to_openai_tool(knowledge_modifier_tool)]
+        self.tool_name = self.tools[0]["function"]["name"]
+        self._seen = set()
+        self.stats = {"train": 0, "validation": 0, "duplicates": 0, "rejected": 0}
+
+        directory = os.path.dirname(output_prefix)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._train = open(f"{output_prefix}.train.jsonl", "w")
+        self._validation = open(f"{output_prefix}.validation.jsonl", "w")
+        if format == "shared-tools":
+            with open(f"{output_prefix}.tools.json", "w") as outfile:
+                json.dump(self.tools, outfile)
+
+    def _system_prompt(self, memories):
+        return compile_prompt(self.prompt).system_prompt(memories)
+
+    def build_record(self, input, memories, tool_arguments):
+        record = {
+            "messages": [
+                {"role": "system", "content": self._system_prompt(memories)},
+                {"role": "user", "content": input},
+                {
+                    "role": "assistant",
+                    "tool_calls": [
+                        {
+                            "id": f"call_{index}",
+                            "type": "function",
+                            "function": {
+                                "name": self.tool_name,
+                                "arguments": json.dumps(
+                                    arguments, separators=(",", ":")
+                                ),
+                            },
+                        }
+                        for index, arguments in enumerate(tool_arguments)
+                    ],
+                },
+            ]
+        }
+        if self.format == "openai":
+            record["tools"] = self.tools
+        return record
+
+    def _split(self, input):
+        # Split on the input alone, so the same message never lands in both splits
+        digest = hashlib.sha1(input.encode()).digest()
+        bucket = int.from_bytes(digest[:8], "big") / 2**64
+        return "validation" if bucket < self.validation_fraction else "train"
+
+    def add(self, input, memories, tool_arguments):
+        tool_arguments = [normalize_arguments(arguments) for arguments in tool_arguments]
+        if not tool_arguments:
+            self.stats["rejected"] += 1
+            return False
+
+        key = hashlib.sha1(
+            json.dumps(
+                [input.strip().lower(), sorted(memories), tool_arguments],
+                sort_keys=True,
+            ).encode()
+        ).digest()
+        if key in self._seen:
+            self.stats["duplicates"] += 1
+            return False
+        self._seen.add(key)
+
+        split = self._split(input)
+        outfile = self._train if split == "train" else self._validation
+        outfile.write(json.dumps(self.build_record(input, memories, tool_arguments)))
+        outfile.write("\n")
+        self.stats[split] += 1
+        return True
+
+    def add_eval_result(self, row):
+        if not is_accepted(row):
+            self.stats["rejected"] += 1
+            return False
+        return self.add(row["input"], row.get("memories", []), row.get("actual_output", []))
+
+    def close(self):
+        self._train.close()
+        self._validation.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def export_eval_results(results_files, exporter, run_ids=None):
+    for file_name in results_files:
+        with open(file_name, "r") as infile:
+            for line in infile:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                if run_ids and row["run_id"] not in run_ids:
+                    continue
+                exporter.add_eval_result(row)
+    return exporter.stats
+
+
+def main():
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument("results_files", nargs="+")
+    argument_parser.add_argument(
+        "--checkpoint", help="JSON file with the optimizer state or prompt to train on"
+    )
+    argument_parser.add_argument("--output", default="./data/finetune")
+    argument_parser.add_argument("--validation-fraction", type=float, default=0.1)
+    argument_parser.add_argument(
+        "--format", choices=["openai", "shared-tools"], default="openai"
+    )
+    argument_parser.add_argument("--run", action="append", help="Only export these run ids")
+    args = argument_parser.parse_args()
+
+    prompt = (
+        load_checkpoint_prompt(args.checkpoint)
+        if args.checkpoint
+        else {"opener": "", "instructions": "", "chain_of_thought": "", "closer": ""}
+    )
+    with FinetuneExporter(
+        args.output, prompt, args.validation_fraction, args.format
+    ) as exporter:
+        stats = export_eval_results(args.results_files, exporter, args.run)
+    print(f"Exported fine-tuning data: {stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,8 @@
+from functools import cached_property, lru_cache
+
+import tiktoken
 from langchain_openai.chat_models import ChatOpenAI
+from langchain_core.messages import SystemMessage
 from langchain.prompts import (
     ChatPromptTemplate,
     SystemMessagePromptTemplate,
@@ -7,6 +11,7 @@ from langchain.prompts import (
 from langchain_core.utils.function_calling import convert_to_openai_function
 from tools.knowledge_management_tool import tool as knowledge_updater_tool
 
+# The prompt parts only change between candidate prompts, so they lead the prompt and stay cacheable across every eval row
 SYSTEM_PROMPT = """
 {opener}
 
@@ -14,15 +19,15 @@ SYSTEM_PROMPT = """
 
 {chain_of_thought}
 
+Call the right tools to save the information. If you identiy multiple pieces of information, make sure you batch all the tool calls simultaneously. You only have one chance to call tools.
+
+{closer}
+
 Here are the existing bits of information that we have about the family:
 ```
 {memories}
 ```
 
-Call the right tools to save the information. If you identiy multiple pieces of information, make sure you batch all the tool calls simultaneously. You only have one chance to call tools.
-
-{closer}
-
 Analyze the following message:
 """
 
@@ -38,6 +43,8 @@ prompt = ChatPromptTemplate.from_messages(
 llm = ChatOpenAI(
     model="gpt-3.5-turbo-0125",
     streaming=True,
+    # Streamed responses only report token usage when asked to, which the budget needs
+    stream_usage=True,
     temperature=0.0,
 )
 
@@ -45,4 +52,75 @@ llm = ChatOpenAI(
 agent_tools = [knowledge_updater_tool]
 tools = [convert_to_openai_function(t) for t in agent_tools]
 
-generate_prompt_output_runnable = prompt | llm.bind_tools(tools)
+llm_with_tools = llm.bind_tools(tools)
+
+generate_prompt_output_runnable = prompt | llm_with_tools
+
+
+@lru_cache(maxsize=1)
+def encoding():
+    # Loaded on first use, since tiktoken downloads the encoding the first time and rendering doesn't need it
+    return tiktoken.encoding_for_model(llm.model_name)
+
+
+PROMPT_PARTS = ("opener", "instructions", "chain_of_thought", "closer")
+
+
+class CompiledPrompt:
+    """SYSTEM_PROMPT rendered once for a candidate prompt, so each eval row only splices in its memories.
+
+    Produces exactly the messages `prompt` would, without running the template for every row.
+    """
+
+    def __init__(self, opener, instructions, chain_of_thought, closer):
+        head, tail = SYSTEM_PROMPT.split("{memories}")
+        self.head = head.format(
+            opener=opener,
+            instructions=instructions,
+            chain_of_thought=chain_of_thought,
+            closer=closer,
+        )
+        self.tail = tail.format()
+
+    @cached_property
+    def token_count(self):
+        """What the candidate costs on every call, before any memories or messages."""
+        return len(encoding().encode(self.head + self.tail))
+
+    def system_prompt(self, memories):
+        # Formatted the same way the template formats it, as the list's str()
+        return f"{self.head}{memories}{self.tail}"
+
+    def messages(self, memories, messages):
+        return [SystemMessage(content=self.system_prompt(memories)), *messages]
+
+    def invoke(self, memories, messages, config=None):
+        return llm_with_tools.invoke(self.messages(memories, messages), config)
+
+    async def ainvoke(self, memories, messages, config=None):
+        return await llm_with_tools.ainvoke(self.messages(memories, messages), config)
+
+
+@lru_cache(maxsize=32)
+def _compile_prompt(parts):
+    return CompiledPrompt(*parts)
+
+
+def compile_prompt(prompt_inputs):
+    """The cached CompiledPrompt for a candidate's prompt parts."""
+    return _compile_prompt(tuple(prompt_inputs[part] for part in PROMPT_PARTS))
+
+
+def output_tokens(response):
+    """Tokens the model generated for a response, counted locally when it came without usage (streamed)."""
+    usage = getattr(response, "usage_metadata", None) or {}
+    if usage.get("output_tokens"):
+        return usage["output_tokens"]
+    usage = (response.response_metadata or {}).get("token_usage") or {}
+    if usage.get("completion_tokens"):
+        return usage["completion_tokens"]
+    tool_calls = response.additional_kwargs.get("tool_calls") or []
+    text = str(response.content or "") + "".join(
+        (tool_call.get("function") or {}).get("arguments") or "" for tool_call in tool_calls
+    )
+    return len(encoding().encode(text))
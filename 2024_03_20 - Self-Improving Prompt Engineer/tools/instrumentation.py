@@ -0,0 +1,441 @@
+"""Local tracing for graph runs, for when LangSmith is not an option.
+
+Attach a GraphInstrumentation handler to a run and it records one span per graph node and per LLM call:
+
+    instrumentation = GraphInstrumentation(node_names=app.nodes.keys())
+    app.with_config({"callbacks": [instrumentation]}).invoke(input)
+    instrumentation.print_summary()
+    instrumentation.write_otel_json("./traces/run.json")
+
+A saved trace can be summarized later with:
+
+    python -m tools.instrumentation ./traces/run.json
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.callbacks.manager import (
+    adispatch_custom_event,
+    dispatch_custom_event,
+)
+
+# Custom callback event for an application-level retry, such as a repair call after a bad response
+RETRY_EVENT = "retry"
+
+
+def emit_retry(reason, config=None):
+    """Report a retry to the run's callback handlers, so it counts against the node it happened in."""
+    try:
+        dispatch_custom_event(RETRY_EVENT, {"reason": str(reason)}, config=config)
+    except RuntimeError:
+        # Called outside of any run, so there is nothing to count it against
+        pass
+
+
+async def aemit_retry(reason, config=None):
+    try:
+        await adispatch_custom_event(RETRY_EVENT, {"reason": str(reason)}, config=config)
+    except RuntimeError:
+        pass
+
+
+def _usage_from_response(response):
+    # Providers disagree on where usage lives, so check each place it can show up. Streamed calls only
+    # report it on the message's usage_metadata
+    for generations in response.generations:
+        for generation in generations:
+            message = getattr(generation, "message", None)
+            usage_metadata = getattr(message, "usage_metadata", None)
+            if usage_metadata:
+                return usage_metadata
+            metadata = getattr(message, "response_metadata", None) or {}
+            usage = metadata.get("usage") or metadata.get("token_usage")
+            if usage:
+                return usage
+    return (response.llm_output or {}).get("token_usage") or {}
+
+
+def _tokens_from_usage(usage):
+    tokens_in = usage.get("prompt_tokens", usage.get("input_tokens", 0)) or 0
+    tokens_out = usage.get("completion_tokens", usage.get("output_tokens", 0)) or 0
+    cached = (
+        (usage.get("input_token_details") or {}).get("cache_read")
+        or (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+        or usage.get("cache_read_input_tokens")
+        or 0
+    )
+    return tokens_in, tokens_out, cached
+
+
+class GraphInstrumentation(BaseCallbackHandler):
+    """Record wall time, queue time, tokens, cache hits and retries for each graph node and LLM call."""
+
+    def __init__(self, node_names: Optional[Iterable[str]] = None):
+        self.node_names = set(node_names or [])
+        self.spans: List[Dict[str, Any]] = []
+        self._open: Dict[UUID, Dict[str, Any]] = {}
+        self._parents: Dict[UUID, Optional[UUID]] = {}
+        self._node_of_run: Dict[UUID, str] = {}
+        self._last_node_end: Dict[UUID, float] = {}
+        self._lock = threading.Lock()
+
+    def _root(self, run_id):
+        while self._parents.get(run_id) is not None:
+            run_id = self._parents[run_id]
+        return run_id
+
+    def _enclosing_node(self, run_id):
+        while run_id is not None:
+            if run_id in self._node_of_run:
+                return self._node_of_run[run_id]
+            run_id = self._parents.get(run_id)
+        return None
+
+    def _open_span(self, run_id, parent_run_id, name, kind, **attributes):
+        trace_id = self._root(parent_run_id) if parent_run_id else run_id
+        self._open[run_id] = {
+            "name": name,
+            "kind": kind,
+            "run_id": run_id,
+            "parent_run_id": parent_run_id,
+            "trace_id": trace_id,
+            "start": time.time(),
+            "end": None,
+            "attributes": attributes,
+        }
+
+    def _forget(self, run_id):
+        """Drop a finished run from the lookup maps, and its trace's bookkeeping once the root run ends."""
+        parent_run_id = self._parents.pop(run_id, None)
+        self._node_of_run.pop(run_id, None)
+        if parent_run_id is None:
+            self._last_node_end.pop(run_id, None)
+
+    def _close_span(self, run_id, **attributes):
+        span = self._open.pop(run_id, None)
+        if span is None:
+            return None
+        span["end"] = time.time()
+        span["attributes"].update(attributes)
+        self.spans.append(span)
+        return span
+
+    # Graph nodes
+
+    def on_chain_start(
+        self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, **kwargs
+    ):
+        with self._lock:
+            self._parents[run_id] = parent_run_id
+            name = (metadata or {}).get("langgraph_node") or kwargs.get("name")
+            if name not in self.node_names or self._enclosing_node(parent_run_id):
+                return
+            self._node_of_run[run_id] = name
+            trace_id = self._root(parent_run_id) if parent_run_id else run_id
+            # Queue time is the gap between the previous node finishing and this one starting
+            previous_end = self._last_node_end.get(trace_id)
+            queue_time = time.time() - previous_end if previous_end else 0.0
+            self._open_span(
+                run_id,
+                parent_run_id,
+                name,
+                "node",
+                queue_time=queue_time,
+                retries=0,
+            )
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        with self._lock:
+            span = self._close_span(run_id, status="ok")
+            if span is not None:
+                self._last_node_end[span["trace_id"]] = span["end"]
+            self._forget(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            span = self._close_span(run_id, status="error", error=repr(error))
+            if span is not None:
+                self._last_node_end[span["trace_id"]] = span["end"]
+            self._forget(run_id)
+
+    # LLM calls
+
+    def on_llm_start(
+        self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs
+    ):
+        self._start_llm(serialized, run_id, parent_run_id, kwargs)
+
+    def on_chat_model_start(
+        self, serialized, messages, *, run_id, parent_run_id=None, **kwargs
+    ):
+        self._start_llm(serialized, run_id, parent_run_id, kwargs)
+
+    def _start_llm(self, serialized, run_id, parent_run_id, kwargs):
+        with self._lock:
+            self._parents[run_id] = parent_run_id
+            invocation_params = kwargs.get("invocation_params") or {}
+            model = invocation_params.get("model") or invocation_params.get(
+                "model_name", (serialized or {}).get("name", "llm")
+            )
+            self._open_span(
+                run_id,
+                parent_run_id,
+                f"llm:{model}",
+                "llm",
+                model=model,
+                node=self._enclosing_node(parent_run_id) or "",
+                time_to_first_token=None,
+                retries=0,
+            )
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        with self._lock:
+            span = self._open.get(run_id)
+            if span is not None and span["attributes"]["time_to_first_token"] is None:
+                span["attributes"]["time_to_first_token"] = time.time() - span["start"]
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        tokens_in, tokens_out, cached = _tokens_from_usage(
+            _usage_from_response(response)
+        )
+        with self._lock:
+            self._close_span(
+                run_id,
+                status="ok",
+                tokens_in=tokens_in,
+                tokens_out=tokens_out,
+                cached_tokens=cached,
+                cache_hit=bool(cached),
+            )
+            self._forget(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            self._close_span(run_id, status="error", error=repr(error))
+            self._forget(run_id)
+
+    def on_retry(self, retry_state, *, run_id, **kwargs):
+        with self._lock:
+            span = self._open.get(run_id)
+            if span is not None:
+                span["attributes"]["retries"] += 1
+
+    def on_custom_event(self, name, data, *, run_id, **kwargs):
+        if name == RETRY_EVENT:
+            self.record_retry(run_id=run_id)
+
+    def record_retry(self, node=None, run_id=None):
+        """Count an application-level retry (e.g. a repair call) against a node, by name or by a run inside it."""
+        with self._lock:
+            # The innermost open node span the run belongs to
+            while run_id is not None:
+                span = self._open.get(run_id)
+                if span is not None and span["kind"] == "node":
+                    span["attributes"]["retries"] += 1
+                    return
+                run_id = self._parents.get(run_id)
+            for span in self._open.values():
+                if span["kind"] == "node" and span["name"] == node:
+                    span["attributes"]["retries"] += 1
+                    return
+
+    # Aggregation and export
+
+    def summarize(self):
+        return summarize_spans(self.spans)
+
+    def print_summary(self, file=sys.stdout):
+        print_summary_table(self.summarize(), file=file)
+
+    def to_prometheus(self):
+        lines = [
+            "# TYPE graph_node_duration_seconds summary",
+            "# TYPE graph_node_queue_seconds summary",
+            "# TYPE graph_llm_duration_seconds summary",
+            "# TYPE graph_llm_tokens_total counter",
+            "# TYPE graph_llm_cache_hits_total counter",
+            "# TYPE graph_retries_total counter",
+        ]
+        for row in self.summarize():
+            node = row["node"].replace('"', '\\"')
+            labels = f'node="{node}"'
+            lines += [
+                f"graph_node_duration_seconds_sum{{{labels}}} {row['node_seconds']:.6f}",
+                f"graph_node_duration_seconds_count{{{labels}}} {row['runs']}",
+                f"graph_node_queue_seconds_sum{{{labels}}} {row['queue_seconds']:.6f}",
+                f"graph_node_queue_seconds_count{{{labels}}} {row['runs']}",
+                f"graph_llm_duration_seconds_sum{{{labels}}} {row['llm_seconds']:.6f}",
+                f"graph_llm_duration_seconds_count{{{labels}}} {row['llm_calls']}",
+                f'graph_llm_tokens_total{{{labels},direction="in"}} {row["tokens_in"]}',
+                f'graph_llm_tokens_total{{{labels},direction="out"}} {row["tokens_out"]}',
+                f"graph_llm_cache_hits_total{{{labels}}} {row['cache_hits']}",
+                f"graph_retries_total{{{labels}}} {row['retries']}",
+            ]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, file_name):
+        with open(file_name, "w") as outfile:
+            outfile.write(self.to_prometheus())
+
+    def to_otel_json(self, service_name="prompt-writer-graph"):
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [_otel_attribute("service.name", service_name)]
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": "tools.instrumentation"},
+                            "spans": [_otel_span(span) for span in self.spans],
+                        }
+                    ],
+                }
+            ]
+        }
+
+    def write_otel_json(self, file_name, service_name="prompt-writer-graph"):
+        directory = os.path.dirname(file_name)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(file_name, "w") as outfile:
+            json.dump(self.to_otel_json(service_name), outfile)
+
+
+def _otel_attribute(key, value):
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def _otel_span(span):
+    attributes = {"graph.span_kind": span["kind"], **span["attributes"]}
+    return {
+        "traceId": span["trace_id"].hex,
+        "spanId": span["run_id"].hex[:16],
+        "parentSpanId": span["parent_run_id"].hex[:16] if span["parent_run_id"] else "",
+        "name": span["name"],
+        "startTimeUnixNano": str(int(span["start"] * 1e9)),
+        "endTimeUnixNano": str(int(span["end"] * 1e9)),
+        "attributes": [
+            _otel_attribute(key, value)
+            for key, value in attributes.items()
+            if value is not None
+        ],
+    }
+
+
+def summarize_spans(spans):
+    rows = defaultdict(
+        lambda: {
+            "runs": 0,
+            "node_seconds": 0.0,
+            "queue_seconds": 0.0,
+            "llm_calls": 0,
+            "llm_seconds": 0.0,
+            "tokens_in": 0,
+            "tokens_out": 0,
+            "cache_hits": 0,
+            "retries": 0,
+            "errors": 0,
+        }
+    )
+    for span in spans:
+        attributes = span["attributes"]
+        duration = span["end"] - span["start"]
+        if span["kind"] == "node":
+            row = rows[span["name"]]
+            row["runs"] += 1
+            row["node_seconds"] += duration
+            row["queue_seconds"] += attributes.get("queue_time") or 0.0
+        else:
+            row = rows[attributes.get("node") or "(outside graph)"]
+            row["llm_calls"] += 1
+            row["llm_seconds"] += duration
+            row["tokens_in"] += attributes.get("tokens_in") or 0
+            row["tokens_out"] += attributes.get("tokens_out") or 0
+            row["cache_hits"] += int(bool(attributes.get("cache_hit")))
+        row["retries"] += attributes.get("retries") or 0
+        row["errors"] += int(attributes.get("status") == "error")
+
+    # Hottest nodes first
+    return sorted(
+        ({"node": node, **row} for node, row in rows.items()),
+        key=lambda row: row["node_seconds"] or row["llm_seconds"],
+        reverse=True,
+    )
+
+
+def print_summary_table(rows, file=sys.stdout):
+    columns = [
+        ("node", "Node", "{}"),
+        ("runs", "Runs", "{}"),
+        ("node_seconds", "Wall s", "{:.2f}"),
+        ("queue_seconds", "Queue s", "{:.2f}"),
+        ("llm_calls", "LLM calls", "{}"),
+        ("llm_seconds", "LLM s", "{:.2f}"),
+        ("tokens_in", "Tokens in", "{}"),
+        ("tokens_out", "Tokens out", "{}"),
+        ("cache_hits", "Cache hits", "{}"),
+        ("retries", "Retries", "{}"),
+        ("errors", "Errors", "{}"),
+    ]
+    table = [[header for _, header, _ in columns]] + [
+        [fmt.format(row[key]) for key, _, fmt in columns] for row in rows
+    ]
+    widths = [max(len(line[i]) for line in table) for i in range(len(columns))]
+    for index, line in enumerate(table):
+        print(
+            "  ".join(
+                cell.ljust(width) if i == 0 else cell.rjust(width)
+                for i, (cell, width) in enumerate(zip(line, widths))
+            ),
+            file=file,
+        )
+        if index == 0:
+            print("  ".join("-" * width for width in widths), file=file)
+
+
+def load_otel_spans(file_name):
+    """Read spans back from a file written by write_otel_json."""
+    with open(file_name, "r") as infile:
+        data = json.load(infile)
+
+    spans = []
+    for resource_spans in data["resourceSpans"]:
+        for scope_spans in resource_spans["scopeSpans"]:
+            for span in scope_spans["spans"]:
+                attributes = {}
+                for attribute in span["attributes"]:
+                    value = next(iter(attribute["value"].values()))
+                    if "intValue" in attribute["value"]:
+                        value = int(value)
+                    attributes[attribute["key"]] = value
+                spans.append(
+                    {
+                        "name": span["name"],
+                        "kind": attributes.pop("graph.span_kind"),
+                        "start": int(span["startTimeUnixNano"]) / 1e9,
+                        "end": int(span["endTimeUnixNano"]) / 1e9,
+                        "attributes": attributes,
+                    }
+                )
+    return spans
+
+
+if __name__ == "__main__":
+    for file_name in sys.argv[1:]:
+        print(f"\n{file_name}")
+        print_summary_table(summarize_spans(load_otel_spans(file_name)))
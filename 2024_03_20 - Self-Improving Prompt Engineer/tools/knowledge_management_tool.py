@@ -2,6 +2,9 @@ from langchain.pydantic_v1 import BaseModel, Field
 from langchain.tools import StructuredTool
 from enum import Enum
 from typing import Optional
+from tools.eval_logging import get_logger
+
+logger = get_logger("knowledge_management_tool")
 
 
 class Category(str, Enum):
@@ -42,7 +45,9 @@ def handle_action(
     action: str,
     knowledge_old: str = "",
 ) -> dict:
-    print("Handling Knowledge: ", knowledge, knowledge_old, category, action)
+    logger.debug(
+        "Handling knowledge: %s %s %s %s", knowledge, knowledge_old, category, action
+    )
 
 
 tool_name = "Knowledge_Modifier"
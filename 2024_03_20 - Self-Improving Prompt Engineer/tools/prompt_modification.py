@@ -0,0 +1,119 @@
+from langchain_openai.chat_models import ChatOpenAI
+from langchain.prompts import PromptTemplate
+from langchain_core.exceptions import OutputParserException
+from langchain_core.pydantic_v1 import ValidationError
+from tools.eval_logging import get_logger
+from tools.instrumentation import aemit_retry, emit_retry
+from tools.write_prompt_openai import (
+    Modification,
+    parser as json_parser,
+    prompt_engineer_llm_runnable,
+)
+from tools.write_prompt_anthropic import (
+    parser as xml_parser,
+    prompt_engineer_anthropic_llm_runnable,
+)
+
+logger = get_logger("prompt_modification")
+
+REPAIR_PROMPT = """
+The response below was supposed to propose a change to one part of a prompt, but it could not be used:
+
+```
+{raw_output}
+```
+
+It had the following problems:
+
+{errors}
+
+Fix only those problems. Do not rewrite the proposed prompt text unless it is one of the problems listed above.
+
+{format_instructions}
+"""
+
+repair_prompt = PromptTemplate(
+    template=REPAIR_PROMPT,
+    input_variables=["raw_output", "errors"],
+    partial_variables={"format_instructions": json_parser.get_format_instructions()},
+)
+
+# Repairs should be deterministic, unlike the creative writer
+llm = ChatOpenAI(
+    model="gpt-3.5-turbo-0125",
+    temperature=0.0,
+    model_kwargs={"response_format": {"type": "json_object"}},
+)
+
+prompt_modification_repair_runnable = repair_prompt | llm | json_parser
+
+
+def from_anthropic_response(parsed):
+    modification = {}
+    for item in parsed.get("response", []):
+        modification.update(item)
+    return modification
+
+
+def validate_modification(modification):
+    if isinstance(modification.get("prompt_part"), str):
+        modification["prompt_part"] = modification["prompt_part"].strip().lower()
+    validated = Modification.parse_obj(modification)
+    return validated.prompt_part.value, validated.new_value
+
+
+def prompt_writer(use_anthropic):
+    """Return the runnable that writes a modification and the parser for its output."""
+    if use_anthropic:
+        parse = lambda text: from_anthropic_response(xml_parser.parse(text))
+        return prompt_engineer_anthropic_llm_runnable, parse
+    return prompt_engineer_llm_runnable, json_parser.parse
+
+
+def generate_prompt_modification(input, use_anthropic=False, max_repairs=2, config=None):
+    """Generate a prompt modification once, then send any failure to a targeted repair call instead of regenerating from scratch."""
+    runnable, parse = prompt_writer(use_anthropic)
+    raw_output = runnable.invoke(input, config).content
+
+    try:
+        return validate_modification(parse(raw_output))
+    except (OutputParserException, ValidationError) as e:
+        error = e
+
+    for _ in range(max_repairs):
+        logger.info("Repairing prompt modification: %s", error)
+        emit_retry(error, config)
+        try:
+            repaired = prompt_modification_repair_runnable.invoke(
+                {"raw_output": raw_output, "errors": str(error)}, config
+            )
+            return validate_modification(repaired)
+        except (OutputParserException, ValidationError) as e:
+            error = e
+
+    raise error
+
+
+async def agenerate_prompt_modification(
+    input, use_anthropic=False, max_repairs=2, config=None
+):
+    runnable, parse = prompt_writer(use_anthropic)
+    raw_output = (await runnable.ainvoke(input, config)).content
+
+    try:
+        return validate_modification(parse(raw_output))
+    except (OutputParserException, ValidationError) as e:
+        error = e
+
+    for _ in range(max_repairs):
+        logger.info("Repairing prompt modification: %s", error)
+        await aemit_retry(error, config)
+        try:
+            repaired = await prompt_modification_repair_runnable.ainvoke(
+                {"raw_output": raw_output, "errors": str(error)}, config
+            )
+            return validate_modification(repaired)
+        except (OutputParserException, ValidationError) as e:
+            error = e
+
+    raise error
@@ -0,0 +1,91 @@
+"""Catch candidate prompts that aren't worth a full eval pass.
+
+The prompt writer runs at a high temperature, so it often proposes a value it already proposed, or one that only
+restates the current prompt in other words. Comparing the candidate with what came before costs microseconds,
+testing it costs a pass over the whole eval dataset:
+
+    novelty = check_novelty(state["prompt"], state["prompt_change_log"])
+    if novelty.cached is not None:
+        ...  # the exact same prompt was tested before, reuse its accuracy
+    elif novelty.similarity >= NOVELTY_THRESHOLD:
+        ...  # a near duplicate, write another change instead
+"""
+
+import hashlib
+import json
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+# Candidates at least this similar to the current value or an earlier one of the same part are not tested
+NOVELTY_THRESHOLD = 0.9
+# Character shingles, so rewordings that only change punctuation, case or a word here and there still match
+SHINGLE_SIZE = 5
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+
+def normalize_text(text):
+    return _NON_WORD.sub(" ", str(text).lower()).strip()
+
+
+@lru_cache(maxsize=4096)
+def shingles(text):
+    normalized = normalize_text(text)
+    if len(normalized) <= SHINGLE_SIZE:
+        return frozenset([normalized])
+    return frozenset(
+        normalized[i : i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)
+    )
+
+
+def similarity(a, b):
+    """Jaccard similarity of the two texts' shingles, from 0.0 to 1.0."""
+    a, b = shingles(a), shingles(b)
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def prompt_key(prompt):
+    """Identifies a whole prompt, ignoring differences in whitespace."""
+    parts = {part: " ".join(str(value).split()) for part, value in prompt.items()}
+    return hashlib.sha1(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+
+def candidate_prompt(prompt, change):
+    candidate = dict(prompt)
+    candidate[change["what_changed"].strip().lower()] = change["new_value"]
+    return candidate
+
+
+@dataclass
+class Novelty:
+    prompt_key: str
+    # The change log entry that tested this exact prompt before
+    cached: Optional[dict] = None
+    # How close the candidate is to the current value or an earlier one of the same part
+    similarity: float = 0.0
+    similar_to: Optional[str] = None
+
+
+def check_novelty(prompt, prompt_change_log):
+    """Compare the last, untested change in the log with the current prompt and every earlier change."""
+    change = prompt_change_log[-1]
+    what_changed = change["what_changed"].strip().lower()
+    novelty = Novelty(prompt_key(candidate_prompt(prompt, change)))
+
+    for entry in reversed(prompt_change_log[:-1]):
+        if entry.get("prompt_key") == novelty.prompt_key and entry.get("results") != "":
+            novelty.cached = entry
+            return novelty
+
+    earlier = [("the current prompt", prompt[what_changed])] + [
+        (f"change {position}", entry["new_value"])
+        for position, entry in enumerate(prompt_change_log[:-1], 1)
+        if entry["what_changed"].strip().lower() == what_changed
+    ]
+    for source, value in earlier:
+        score = similarity(change["new_value"], value)
+        if score > novelty.similarity:
+            novelty.similarity, novelty.similar_to = score, source
+    return novelty
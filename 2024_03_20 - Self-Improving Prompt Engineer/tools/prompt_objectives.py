@@ -0,0 +1,113 @@
+"""Compare candidate prompts on cost and speed as well as accuracy.
+
+Each eval run measures the rendered prompt's token count, the mean and p95 latency of generating each row's
+output, and the mean output tokens per row. With these, a change can be accepted by Pareto dominance or by a
+weighted score instead of accuracy alone, and a run's change log gives the accuracy/latency frontier to pick a
+deployment point from:
+
+    for entry in pareto_front(final_state["prompt_change_log"]):
+        print(entry["accuracy"], entry["metrics"])
+"""
+
+import math
+
+# Lower is better for all of these, accuracy is the only objective to maximize
+COST_OBJECTIVES = ("prompt_tokens", "mean_latency", "p95_latency", "output_tokens")
+# Latencies vary from run to run, so they only count as better or worse when they differ by more than this fraction
+LATENCY_OBJECTIVES = ("mean_latency", "p95_latency")
+LATENCY_MARGIN = 0.1
+# Accuracy given up per unit of each objective by the "weighted" acceptance rule. With these, 1,000 more prompt
+# tokens are worth 0.02 accuracy, as is a second of p95 latency
+OBJECTIVE_WEIGHTS = {
+    "prompt_tokens": 0.00002,
+    "p95_latency": 0.02,
+    "output_tokens": 0.0002,
+}
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile, so it is always one of the measured values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+def eval_metrics(prompt_tokens, latencies, output_tokens):
+    return {
+        "prompt_tokens": prompt_tokens,
+        "mean_latency": sum(latencies) / len(latencies) if latencies else 0.0,
+        "p95_latency": percentile(latencies, 0.95),
+        "output_tokens": sum(output_tokens) / len(output_tokens) if output_tokens else 0.0,
+        "rows": len(latencies),
+    }
+
+
+def compare(name, value, other):
+    """-1 if `value` is better (lower) on the objective, 1 if it is worse, 0 if they are even."""
+    margin = LATENCY_MARGIN * max(value, other) if name in LATENCY_OBJECTIVES else 0
+    if value < other - margin:
+        return -1
+    if value > other + margin:
+        return 1
+    return 0
+
+
+def cheaper(metrics, other):
+    """Whether `metrics` is no worse than `other` on every cost objective and better on at least one."""
+    comparisons = [compare(name, metrics[name], other[name]) for name in COST_OBJECTIVES]
+    return all(c <= 0 for c in comparisons) and any(c < 0 for c in comparisons)
+
+
+def dominates(accuracy, metrics, other_accuracy, other_metrics):
+    if accuracy < other_accuracy:
+        return False
+    if accuracy > other_accuracy:
+        return all(
+            compare(name, metrics[name], other_metrics[name]) <= 0 for name in COST_OBJECTIVES
+        )
+    return cheaper(metrics, other_metrics)
+
+
+def weighted_score(accuracy, metrics, weights=OBJECTIVE_WEIGHTS):
+    return accuracy - sum(weight * metrics[name] for name, weight in weights.items())
+
+
+def is_better(rule, accuracy, metrics, best_accuracy, best_metrics):
+    """Whether a candidate should replace the best prompt so far under an acceptance rule.
+
+    "accuracy" (and "significant", which tests the increase separately) only looks at accuracy, "pareto" needs
+    the candidate to be at least as good on everything, "weighted" trades accuracy against cost. Otherwise, a tie
+    on accuracy goes to the prompt with fewer tokens, which unlike latency doesn't vary from run to run. Without
+    metrics for both, only accuracy counts.
+    """
+    if not metrics or not best_metrics:
+        return accuracy > best_accuracy
+    if rule == "pareto":
+        return dominates(accuracy, metrics, best_accuracy, best_metrics)
+    if rule == "weighted":
+        score, best_score = weighted_score(accuracy, metrics), weighted_score(best_accuracy, best_metrics)
+        if score != best_score:
+            return score > best_score
+    if accuracy != best_accuracy:
+        return accuracy > best_accuracy
+    return metrics["prompt_tokens"] < best_metrics["prompt_tokens"]
+
+
+def pareto_front(prompt_change_log):
+    """The tested changes no other tested change dominates, from the most to the least accurate."""
+    tested = {}
+    for entry in prompt_change_log or []:
+        if entry.get("results") != "" and entry.get("metrics"):
+            # A prompt the novelty gate found again has the same result, so it is listed once
+            tested.setdefault(entry.get("prompt_key") or id(entry), entry)
+    tested = list(tested.values())
+    front = [
+        entry
+        for entry in tested
+        if not any(
+            dominates(other["accuracy"], other["metrics"], entry["accuracy"], entry["metrics"])
+            for other in tested
+        )
+    ]
+    return sorted(front, key=lambda entry: (-entry["accuracy"], entry["metrics"]["p95_latency"]))
@@ -1,18 +1,40 @@
+import asyncio
 import json
+import time
+import uuid
 from langchain_core.messages import HumanMessage
+from tools.budget import budget_tracker
+from tools.eval_logging import EvalResultsWriter, get_logger
 from tools.evaluate_prompt_output import (
     evaluate_expected_output_runnable,
     evaluate_bad_output_runnable,
 )
-from tools.generate_prompt_output import generate_prompt_output_runnable
+from tools.generate_prompt_output import compile_prompt, output_tokens
+from tools.prompt_objectives import eval_metrics
+from tools.tool_call_parser import extract_tool_arguments
 
+logger = get_logger("run_eval")
 
-def evaluate_against_expected_output(expected_output, actual_output):
+
+def evaluate_against_expected_output(expected_output, actual_output, config=None):
     evaluation_result = evaluate_expected_output_runnable.invoke(
-        {"expected_output": expected_output, "actual_output": actual_output}
+        {"expected_output": expected_output, "actual_output": actual_output}, config
+    )
+    return expected_evaluation_result(evaluation_result)
+
+
+async def aevaluate_against_expected_output(
+    expected_output, actual_output, config=None
+):
+    evaluation_result = await evaluate_expected_output_runnable.ainvoke(
+        {"expected_output": expected_output, "actual_output": actual_output}, config
     )
-    print(
-        "Expected Positive Output Result: ",
+    return expected_evaluation_result(evaluation_result)
+
+
+def expected_evaluation_result(evaluation_result):
+    logger.debug(
+        "Expected positive output result: %s %s",
         evaluation_result.get("eval"),
         evaluation_result.get("failure_reason"),
     )
@@ -20,11 +42,22 @@ def evaluate_against_expected_output(expected_output, actual_output):
     return evaluation_result.get("eval"), evaluation_result.get("failure_reason", "NA")
 
 
-def evaluate_against_bad_output(expected_output, actual_output):
+def evaluate_against_bad_output(expected_output, actual_output, config=None):
     evaluation_result = evaluate_bad_output_runnable.invoke(
-        {"expected_output": expected_output, "actual_output": actual_output}
+        {"expected_output": expected_output, "actual_output": actual_output}, config
+    )
+    return bad_evaluation_result(evaluation_result)
+
+
+async def aevaluate_against_bad_output(expected_output, actual_output, config=None):
+    evaluation_result = await evaluate_bad_output_runnable.ainvoke(
+        {"expected_output": expected_output, "actual_output": actual_output}, config
     )
-    print("Expected Negative Output Result: ", evaluation_result.content)
+    return bad_evaluation_result(evaluation_result)
+
+
+def bad_evaluation_result(evaluation_result):
+    logger.debug("Expected negative output result: %s", evaluation_result.content)
 
     if evaluation_result.content == "DIFFERENT":
         return True, evaluation_result.content
@@ -67,94 +100,203 @@ def update_confusion_matrix(
         )
 
 
-def extract_arguments(data):
-    arguments_list = []
+def extract_arguments(data, content=""):
+    """Knowledge_Modifier arguments from a message's tool calls, or from calls written in its content.
+
+    Malformed and partial calls are repaired where possible instead of dropped, see tool_call_parser. Repeated
+    calls are all returned, so a duplicate save is graded as one.
+    """
+    return extract_tool_arguments(data if isinstance(data, dict) else None, content)
 
-    # Check if data is a dictionary and contains the key 'tool_calls'
-    if isinstance(data, dict) and "tool_calls" in data:
-        for tool_call in data["tool_calls"]:
-            # Extracting the 'arguments' from the tool_call
-            function_info = tool_call.get("function", {})
-            arguments = function_info.get("arguments", "")
 
-            # If arguments is a string, attempt to parse it as JSON
-            if isinstance(arguments, str):
-                try:
-                    arguments_json = json.loads(arguments)
-                    arguments_list.append(arguments_json)
-                except json.JSONDecodeError:
-                    print("Error decoding JSON from arguments:", arguments)
+class EvalRun:
+    """Confusion matrix, early stopping and results file bookkeeping shared by the sync and async eval loops."""
+
+    def __init__(
+        self, results_file=None, run_id=None, on_failures=None, tracker=None, **run_metadata
+    ):
+        self.run_id = run_id or uuid.uuid4().hex
+        # Called with the inaccurate responses so far whenever a row adds to them
+        self.on_failures = on_failures
+        # The run's BudgetTracker, checked after every row so a test can't run past the budget
+        self.tracker = tracker
+        self.results_writer = (
+            EvalResultsWriter(results_file, self.run_id, **run_metadata)
+            if results_file
+            else None
+        )
+        # Initialize the confusion matrix counters
+        self.confusion_matrix = {"TP": 0, "FP": 0, "TN": 0, "FN": 0}
+        # Initialize the list to store inaccurate responses
+        self.inaccurate_responses = []
+        self.bad_responses = 0
+        # Per row, of generating the output only, not of evaluating it
+        self.latencies = []
+        self.output_tokens = []
 
-    return arguments_list
+    def record_generation(self, started, response):
+        self.latencies.append(time.perf_counter() - started)
+        self.output_tokens.append(output_tokens(response))
 
+    def rows(self, file_name):
+        """Yield each eval row with its memories and messages to generate its output from."""
+        with open(file_name, "r") as infile:
+            for line_number, line in enumerate(infile, start=1):
+                logger.debug("Running line %d", line_number)
+                data = json.loads(line.strip())
+                messages = [HumanMessage(content=data.get("input"))]
+                yield line_number, data, data.get("memories", []), messages
 
-def process_eval_dataset(file_name, prompt_inputs):
-    # Initialize the confusion matrix counters
-    confusion_matrix = {"TP": 0, "FP": 0, "TN": 0, "FN": 0}
+    def record(self, line_number, data, actual_output, expected, bad):
+        """Record one row's evaluations, and return True if the eval should stop early."""
+        is_expected_correct, expected_detail = expected
+        is_bad_correct, bad_detail = bad
+        if not is_expected_correct:
+            self.bad_responses += 1
+        if not is_bad_correct:
+            self.bad_responses += 1
 
-    # Initialize the list to store inaccurate responses
-    inaccurate_responses = []
+        update_confusion_matrix(
+            is_expected_correct,
+            is_bad_correct,
+            data,
+            actual_output,
+            expected_detail,
+            bad_detail,
+            self.confusion_matrix,
+            self.inaccurate_responses,
+        )
+
+        if self.on_failures is not None and not (is_expected_correct and is_bad_correct):
+            self.on_failures(self.inaccurate_responses)
+
+        if self.results_writer is not None:
+            self.results_writer.write(
+                line=line_number,
+                input=data.get("input"),
+                memories=data.get("memories", []),
+                desired_response=data.get("desired_response"),
+                actual_output=actual_output,
+                expected_correct=bool(is_expected_correct),
+                bad_correct=bool(is_bad_correct),
+                expected_detail=expected_detail,
+                bad_detail=bad_detail,
+            )
 
-    bad_responses = 0
-    with open(file_name, "r") as infile:
-        for line_number, line in enumerate(infile, start=1):
-            print("\n")
-            print(f"Running line {line_number}")
-            print("---------------")
-            # line = next(infile)
-            data = json.loads(line.strip())
-            messages = [HumanMessage(content=data.get("input"))]
-            memories = data.get("memories", [])
+        if self.bad_responses >= 3:
+            logger.info("Encountered 3 bad responses. Ending process.")
+            return True
+        if self.tracker is not None and (reason := self.tracker.check()):
+            logger.info("Stopping the eval: %s", reason)
+            return True
+        return False
 
-            prompt_inputs["messages"] = messages
-            prompt_inputs["memories"] = memories
+    def close(self):
+        if self.results_writer is not None:
+            self.results_writer.close()
 
-            response = generate_prompt_output_runnable.invoke(prompt_inputs)
-            actual_output = extract_arguments(response.additional_kwargs)
+    def finish(self, prompt_tokens=0):
+        """The confusion matrix, accuracy, inaccurate responses and cost and latency metrics of the run."""
+        self.close()
+
+        total_cases = sum(self.confusion_matrix.values())
+        accuracy = (
+            (self.confusion_matrix["TP"] + self.confusion_matrix["TN"]) / total_cases
+            if total_cases
+            else 0
+        )
+        metrics = eval_metrics(prompt_tokens, self.latencies, self.output_tokens)
+
+        logger.info(
+            "Eval complete",
+            extra={
+                "fields": {
+                    "run_id": self.run_id,
+                    "confusion_matrix": self.confusion_matrix,
+                    "accuracy": accuracy,
+                    "metrics": metrics,
+                }
+            },
+        )
+
+        return self.confusion_matrix, accuracy, self.inaccurate_responses, metrics
+
+
+def process_eval_dataset(
+    file_name,
+    prompt_inputs,
+    config=None,
+    results_file=None,
+    run_id=None,
+    on_failures=None,
+    **run_metadata,
+):
+    eval_run = EvalRun(
+        results_file, run_id, on_failures, budget_tracker(config), **run_metadata
+    )
+    # The candidate prompt is the same for every row, so it is rendered once up front
+    compiled_prompt = compile_prompt(prompt_inputs)
+
+    # The rows written so far are flushed even if a row fails
+    try:
+        for line_number, data, memories, messages in eval_run.rows(file_name):
+            started = time.perf_counter()
+            response = compiled_prompt.invoke(memories, messages, config)
+            eval_run.record_generation(started, response)
+            actual_output = extract_arguments(response.additional_kwargs, response.content)
 
             # Just test the expected output as a control
             # actual_output = data.get("desired_response")
 
-            is_expected_correct, expected_detail = evaluate_against_expected_output(
-                data.get("desired_response"), actual_output
-            )
-            if not is_expected_correct:
-                bad_responses += 1
-
-            is_bad_correct, bad_detail = evaluate_against_bad_output(
-                data.get("bad_response"), actual_output
+            expected = evaluate_against_expected_output(
+                data.get("desired_response"), actual_output, config
             )
-            if not is_bad_correct:
-                bad_responses += 1
-
-            update_confusion_matrix(
-                is_expected_correct,
-                is_bad_correct,
-                data,
-                actual_output,
-                expected_detail,
-                bad_detail,
-                confusion_matrix,
-                inaccurate_responses,
+            bad = evaluate_against_bad_output(
+                data.get("bad_response"), actual_output, config
             )
 
-            if bad_responses >= 3:
-                print("Encountered 3 bad responses. Ending process.")
+            if eval_run.record(line_number, data, actual_output, expected, bad):
                 break
+    finally:
+        eval_run.close()
 
-    print("\n")
-    print("Eval Results:")
-    print("Confusion Matrix:")
-    print(confusion_matrix)
+    return eval_run.finish(compiled_prompt.token_count)
 
-    total_cases = sum(confusion_matrix.values())
-    accuracy = (
-        (confusion_matrix["TP"] + confusion_matrix["TN"]) / total_cases
-        if total_cases
-        else 0
+
+async def aprocess_eval_dataset(
+    file_name,
+    prompt_inputs,
+    config=None,
+    results_file=None,
+    run_id=None,
+    on_failures=None,
+    **run_metadata,
+):
+    """Async version of process_eval_dataset. The two evaluations of each row run concurrently."""
+    eval_run = EvalRun(
+        results_file, run_id, on_failures, budget_tracker(config), **run_metadata
     )
+    compiled_prompt = compile_prompt(prompt_inputs)
 
-    print("\n")
-    print("Accuracy: ", accuracy)
+    try:
+        for line_number, data, memories, messages in eval_run.rows(file_name):
+            started = time.perf_counter()
+            response = await compiled_prompt.ainvoke(memories, messages, config)
+            eval_run.record_generation(started, response)
+            actual_output = extract_arguments(response.additional_kwargs, response.content)
+
+            expected, bad = await asyncio.gather(
+                aevaluate_against_expected_output(
+                    data.get("desired_response"), actual_output, config
+                ),
+                aevaluate_against_bad_output(
+                    data.get("bad_response"), actual_output, config
+                ),
+            )
+
+            if eval_run.record(line_number, data, actual_output, expected, bad):
+                break
+    finally:
+        eval_run.close()
 
-    return confusion_matrix, accuracy, inaccurate_responses
+    return eval_run.finish(compiled_prompt.token_count)
@@ -0,0 +1,324 @@
+"""Recover Knowledge_Modifier calls from model output that isn't well-formed JSON.
+
+Open models without native function calling write their tool calls as text, wrap them in prose or code fences,
+cut them off, or put several objects in one arguments string. Instead of dropping those (and counting the row as a
+failure), `ToolCallExtractor` pulls every JSON object out of the content and arguments streams as they arrive,
+repairs the usual defects (single quotes, Python literals, trailing commas, unquoted keys, truncation, arguments
+encoded twice or wrapped in {"name": ..., "arguments": ...}), and validates each one against `AddKnowledge`.
+Well-formed arguments take the same path and come out unchanged apart from unknown keys being dropped.
+"""
+
+import ast
+import json
+import re
+import warnings
+
+from langchain.pydantic_v1 import ValidationError
+from tools.eval_logging import get_logger
+from tools.knowledge_management_tool import Action, AddKnowledge, Category
+
+logger = get_logger("tool_call_parser")
+
+# Characters that matter at each point of the scan, so everything else is skipped in C rather than per character
+_OBJECT_START = re.compile(r"\{")
+_STRUCTURE = re.compile(r'[{}\[\]"]')
+_STRING_SPECIAL = re.compile(r'["\\]')
+_CLOSERS = {"{": "}", "[": "]"}
+# A key, key and colon, or comma left at the end of a truncated object
+_DANGLING = re.compile(r'(?:([{\[])|,)\s*(?:"(?:[^"\\]|\\.)*"\s*:?\s*)?$')
+
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_UNQUOTED_KEY = re.compile(r"([{,]\s*)([A-Za-z_][A-Za-z0-9_]*)\s*:")
+_PYTHON_LITERALS = {"None": "null", "True": "true", "False": "false"}
+_PYTHON_LITERAL = re.compile(r"\b(None|True|False)\b")
+
+# Keys some models use instead of the schema's
+FIELD_ALIASES = {
+    "old_knowledge": "knowledge_old",
+    "knowledgeold": "knowledge_old",
+    "previous_knowledge": "knowledge_old",
+    "memory": "knowledge",
+    "fact": "knowledge",
+}
+# Keys a tool call's arguments are wrapped in
+WRAPPER_KEYS = ("arguments", "parameters", "args", "input")
+
+
+class JSONObjectScanner:
+    """Finds top-level JSON objects in text that arrives in pieces, skipping anything between them."""
+
+    def __init__(self):
+        self.buffer = ""
+        self.position = 0
+        self.stack = []
+        self.in_string = False
+
+    def feed(self, text):
+        """Add text, and return the objects it completed, as raw strings."""
+        buffer = self.buffer + text
+        objects = []
+        # Where the current object starts, so the buffer is only sliced once per feed
+        start = 0
+        position = self.position
+        while True:
+            if not self.stack:
+                match = _OBJECT_START.search(buffer, position)
+                if match is None:
+                    start = position = len(buffer)
+                    break
+                start = match.start()
+                self.stack.append("{")
+                position = match.end()
+                continue
+
+            if self.in_string:
+                match = _STRING_SPECIAL.search(buffer, position)
+                if match is None:
+                    position = len(buffer)
+                    break
+                if match.group() == "\\":
+                    if match.end() == len(buffer):
+                        # Wait for the escaped character
+                        position = match.start()
+                        break
+                    position = match.end() + 1
+                else:
+                    self.in_string = False
+                    position = match.end()
+                continue
+
+            match = _STRUCTURE.search(buffer, position)
+            if match is None:
+                position = len(buffer)
+                break
+            character, position = match.group(), match.end()
+            if character == '"':
+                self.in_string = True
+            elif character in _CLOSERS:
+                self.stack.append(character)
+            else:
+                self.stack.pop()
+                if not self.stack:
+                    objects.append(buffer[start:position])
+                    start = position
+
+        self.buffer = buffer[start:]
+        self.position = position - start
+        return objects
+
+    def close(self):
+        """The object that was still open when the text ended, closed off, or None."""
+        if not self.stack:
+            return None
+        text = self.buffer
+        if self.in_string:
+            text = text.removesuffix("\\") + '"'
+        text = _DANGLING.sub(lambda match: match.group(1) or "", text.rstrip())
+        text += "".join(_CLOSERS[opener] for opener in reversed(self.stack))
+        self.buffer, self.position, self.stack, self.in_string = "", 0, [], False
+        return text
+
+
+def parse_object(text):
+    """Parse a JSON object, repairing it if needed. Returns None if it can't be recovered."""
+    try:
+        return json.loads(text, strict=False)
+    except json.JSONDecodeError:
+        pass
+
+    repaired = _UNQUOTED_KEY.sub(r'\1"\2":', _TRAILING_COMMA.sub(r"\1", text))
+    for candidate in (
+        repaired,
+        _PYTHON_LITERAL.sub(lambda match: _PYTHON_LITERALS[match.group()], repaired),
+    ):
+        try:
+            return json.loads(candidate, strict=False)
+        except json.JSONDecodeError:
+            pass
+
+    # Single quotes, which is what a Python dict printed as text looks like
+    try:
+        with warnings.catch_warnings():
+            # Mangled text can look like invalid Python literals, which warn as well as fail
+            warnings.simplefilter("ignore", SyntaxWarning)
+            value = ast.literal_eval(_TRAILING_COMMA.sub(r"\1", text))
+        return value if isinstance(value, (dict, list)) else None
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        pass
+
+    # An object that was JSON-encoded as a string, seen without its surrounding quotes
+    if '\\"' in text:
+        return parse_object(text.replace('\\"', '"'))
+    return None
+
+
+def parse_objects(text):
+    """Every object that can be recovered from a complete piece of text."""
+    scanner = JSONObjectScanner()
+    raw_objects = scanner.feed(text)
+    tail = scanner.close()
+    if tail is not None:
+        raw_objects.append(tail)
+    return [value for value in map(parse_object, raw_objects) if value is not None]
+
+
+def unwrap_arguments(value):
+    """Yield the dicts that could be Knowledge_Modifier arguments, looking through tool call wrappers."""
+    if isinstance(value, list):
+        for item in value:
+            yield from unwrap_arguments(item)
+        return
+    if isinstance(value, str):
+        # Arguments encoded as a JSON string inside the JSON
+        for item in parse_objects(value):
+            yield from unwrap_arguments(item)
+        return
+    if not isinstance(value, dict):
+        return
+
+    if "knowledge" not in value:
+        if isinstance(value.get("tool_calls"), list):
+            yield from unwrap_arguments(value["tool_calls"])
+            return
+        if isinstance(value.get("function"), dict):
+            yield from unwrap_arguments(value["function"])
+            return
+        for key in WRAPPER_KEYS:
+            if key in value:
+                yield from unwrap_arguments(value[key])
+                return
+    yield value
+
+
+def _enum_key(value):
+    return re.sub(r"[^a-z]", "", str(value).lower())
+
+
+# Normalized value and name of each member -> its value
+_ENUM_LOOKUPS = {
+    enum: {
+        **{_enum_key(member.name): member.value for member in enum},
+        **{_enum_key(member.value): member.value for member in enum},
+    }
+    for enum in (Category, Action)
+}
+
+
+def coerce_enum(enum, value):
+    """Match an enum member by value or name, ignoring case, spaces, underscores and a plural s."""
+    lookup = _ENUM_LOOKUPS[enum]
+    if value is None or value in lookup.values():
+        return value
+    key = _enum_key(value)
+    for candidate in (key, key.removesuffix("s"), re.sub(r"ies$", "y", key)):
+        if candidate in lookup:
+            return lookup[candidate]
+    return value
+
+
+def validate_arguments(arguments):
+    """Knowledge_Modifier arguments checked against AddKnowledge, or None if they can't be made valid."""
+    fields = {}
+    for key, value in arguments.items():
+        key = str(key).strip().lower().replace(" ", "_")
+        fields[FIELD_ALIASES.get(key, key)] = value
+
+    # Only the syntax is repaired. A missing field is graded content, so it is never filled in
+    try:
+        model = AddKnowledge(
+            knowledge=fields.get("knowledge"),
+            knowledge_old=fields.get("knowledge_old") or None,
+            category=coerce_enum(Category, fields.get("category")),
+            action=coerce_enum(Action, fields.get("action")),
+        )
+    except ValidationError as e:
+        logger.warning("Dropping invalid tool call arguments %s: %s", arguments, e)
+        return None
+    if not model.knowledge.strip():
+        return None
+
+    validated = {"knowledge": model.knowledge}
+    if model.knowledge_old:
+        validated["knowledge_old"] = model.knowledge_old
+    validated["category"] = model.category.value
+    validated["action"] = model.action.value
+    return validated
+
+
+class ToolCallExtractor:
+    """Collects validated Knowledge_Modifier arguments from a streamed or complete model response.
+
+    Feed it content and tool call argument deltas as they arrive, then call `close` for the final list. Objects
+    found in the content only count when the model made no real tool calls.
+    """
+
+    def __init__(self):
+        self.content = JSONObjectScanner()
+        self.tool_calls = {}
+        # Tool calls whose arguments are a JSON string holding the JSON, kept whole until the end
+        self.encoded_arguments = {}
+        # A call the model repeats is kept every time, so the evaluators still see a duplicate save
+        self.from_content = []
+        self.from_tool_calls = []
+
+    def _add(self, raw_objects, found):
+        for raw_object in raw_objects:
+            value = parse_object(raw_object)
+            if value is None:
+                logger.warning("Could not recover tool call arguments: %s", raw_object)
+                continue
+            for arguments in unwrap_arguments(value):
+                validated = validate_arguments(arguments)
+                if validated is not None:
+                    found.append(validated)
+
+    def feed_content(self, text):
+        if text:
+            self._add(self.content.feed(text), self.from_content)
+
+    def feed_arguments(self, index, text):
+        if isinstance(text, dict):
+            text = json.dumps(text)
+        if not text:
+            return
+        if index not in self.tool_calls and text.lstrip().startswith('"'):
+            self.encoded_arguments[index] = ""
+        scanner = self.tool_calls.setdefault(index, JSONObjectScanner())
+        if index in self.encoded_arguments:
+            self.encoded_arguments[index] += text
+        else:
+            self._add(scanner.feed(text), self.from_tool_calls)
+
+    def feed_message(self, additional_kwargs=None, content=""):
+        """Feed a message's (or message chunk's) additional_kwargs and content."""
+        for position, tool_call in enumerate((additional_kwargs or {}).get("tool_calls") or []):
+            function_info = tool_call.get("function") or {}
+            self.feed_arguments(
+                tool_call.get("index", position), function_info.get("arguments", "")
+            )
+        if isinstance(content, str):
+            self.feed_content(content)
+
+    def close(self):
+        tail = self.content.close()
+        if tail is not None:
+            self._add([tail], self.from_content)
+        for index, encoded in self.encoded_arguments.items():
+            try:
+                decoded = json.loads(encoded, strict=False)
+            except json.JSONDecodeError:
+                # Cut off inside the string, so unescape it by hand
+                decoded = encoded.strip().strip('"').replace('\\"', '"')
+            if isinstance(decoded, str):
+                self._add(self.tool_calls[index].feed(decoded), self.from_tool_calls)
+        for scanner in self.tool_calls.values():
+            tail = scanner.close()
+            if tail is not None:
+                self._add([tail], self.from_tool_calls)
+        return self.from_tool_calls if self.tool_calls else self.from_content
+
+
+def extract_tool_arguments(additional_kwargs=None, content=""):
+    extractor = ToolCallExtractor()
+    extractor.feed_message(additional_kwargs, content)
+    return extractor.close()
@@ -90,4 +90,5 @@ llm = ChatAnthropic(
     temperature=1.0,
 )
 
-prompt_engineer_anthropic_runnable = prompt | llm | parser
+prompt_engineer_anthropic_llm_runnable = prompt | llm
+prompt_engineer_anthropic_runnable = prompt_engineer_anthropic_llm_runnable | parser
@@ -1,4 +1,5 @@
 from langchain.tools import StructuredTool
+from enum import Enum
 from typing import List
 from langchain_openai.chat_models import ChatOpenAI
 from langchain.prompts import PromptTemplate
@@ -68,9 +69,16 @@ Take a deep breath, think step, by step, and begin!
 """
 
 
+class PromptPart(str, Enum):
+    opener = "opener"
+    instructions = "instructions"
+    chain_of_thought = "chain_of_thought"
+    closer = "closer"
+
+
 # Define your desired data structure.
 class Modification(BaseModel):
-    prompt_part: str = Field(
+    prompt_part: PromptPart = Field(
         description="The prompt part being changed. Must be one of: opener, instructions, chain_of_thought, closer"
     )
     new_value: str = Field(description="The new value for the prompt part")
@@ -98,7 +106,8 @@ llm = ChatOpenAI(
     model_kwargs={"response_format": {"type": "json_object"}},
 )
 
-prompt_engineer_runnable = prompt | llm | parser
+prompt_engineer_llm_runnable = prompt | llm
+prompt_engineer_runnable = prompt_engineer_llm_runnable | parser
 
 
 def write_prompt(prompt_history: List[str]) -> str:
@@ -1,11 +1,15 @@
 from langchain_openai.chat_models import ChatOpenAI
-from langchain.prompts import (
-    ChatPromptTemplate,
-    SystemMessagePromptTemplate,
-)
+from enum import Enum
 from typing import List
 from pydantic.v1 import BaseModel, Field
 from langchain_core.output_parsers import JsonOutputParser
+from agents.prompt_assembly import build_cached_prompt, prompt_cache_metrics
+from agents.structured_output import JSON_MODE, StructuredOutput
+from agents.model_cascade import (
+    CascadeStage,
+    ModelCascade,
+    validate_memories_list,
+)
 
 system_prompt_initial = """
 Your job is to determine what to do with a list of memories extracted from a chat history.
@@ -24,17 +28,20 @@ When you receive a message, you perform a sequence of steps consisting of:
 2. Internally compare the new memories to the existing list
 3. For each piece of new knowledge, determine if this is new knowledge, an update to old knowledge that now needs to change, or should result in deleting information that is not correct. It's possible that a food you previously wrote as a dislike might now be a like, or that a family member who previously liked a food now dislikes it - those examples would require an update.
 
-Here are the existing bits of information that we have about the family.
-
-```
-{existing_memories}
-```
-
 Return the information fragments in the following format:
 
 {format_instructions}
 
 I will tip you $20 if you are perfect, and I will fine you $40 if you miss any important information or change any incorrect information.
+"""
+
+# Everything that changes per call comes after the static instructions, so the prefix can be cached
+user_prompt_memories = """
+Here are the existing bits of information that we have about the family.
+
+```
+{existing_memories}
+```
 
 Take a deep breath, think step by step, and then analyze the following memories:
 
@@ -42,9 +49,15 @@ Take a deep breath, think step by step, and then analyze the following memories:
 """
 
 
+class Action(str, Enum):
+    Create = "CREATE"
+    Update = "UPDATE"
+    Delete = "DELETE"
+
+
 class Memory(BaseModel):
     knowledge: str = Field(description="If this failed, provide your explanation")
-    action: str = Field(
+    action: Action = Field(
         description="The action to take on this memory: either CREATE, UPDATE, or DELETE"
     )
     old_memory: str = Field(
@@ -59,18 +72,60 @@ class Memories(BaseModel):
 parser = JsonOutputParser(pydantic_object=Memories)
 
 # Get the prompt to use - you can modify this!
-prompt = ChatPromptTemplate.from_messages(
-    [
-        SystemMessagePromptTemplate.from_template(system_prompt_initial),
-    ]
-).partial(format_instructions=parser.get_format_instructions())
+prompt = build_cached_prompt(
+    system_prompt_initial,
+    dynamic_suffix=user_prompt_memories,
+    format_instructions=parser.get_format_instructions(),
+)
 
-# Choose the LLM that will drive the agent
+# Choose the LLM that will drive the agent. The cascade binds the schema to it as a forced function call
 llm = ChatOpenAI(
     model="gpt-3.5-turbo-0125",
     # model="gpt-4-0125-preview",
     streaming=True,
     temperature=0.0,
+    # Streamed responses only report usage, and so cache hits, when asked to
+    stream_usage=True,
+    callbacks=[prompt_cache_metrics],
+)
+
+# The larger model is only called when the cascade rejects the smaller model's output
+llm_large = ChatOpenAI(
+    model="gpt-4-0125-preview",
+    streaming=True,
+    temperature=0.0,
+    # Streamed responses only report usage, and so cache hits, when asked to
+    stream_usage=True,
+    callbacks=[prompt_cache_metrics],
 )
 
-action_assigner_runnable = prompt | llm | parser
+action_assigner_runnable = prompt | llm.bind(response_format=JSON_MODE) | parser
+
+
+def check_old_memories_exist(input, output):
+    # Quick self-check: updates and deletes must point at a memory we actually have
+    existing_memories = str(input.get("existing_memories", ""))
+    return [
+        f"{memory.get('action')} of {memory.get('knowledge')!r} references unknown memory {memory.get('old_memory')!r}"
+        for memory in output.get("memories", [])
+        if memory.get("action") in (Action.Update.value, Action.Delete.value)
+        and (
+            not memory.get("old_memory")
+            or memory["old_memory"] not in existing_memories
+        )
+    ]
+
+
+action_assigner_cascade = ModelCascade(
+    name="action_assigner",
+    prompt=prompt,
+    stages=[
+        CascadeStage("gpt-3.5-turbo-0125", llm, cost_per_1k_tokens=0.001),
+        CascadeStage("gpt-4-0125-preview", llm_large, cost_per_1k_tokens=0.02),
+    ],
+    structured_output=StructuredOutput(Memories),
+    validators=[
+        validate_memories_list,
+        check_old_memories_exist,
+    ],
+)
@@ -1,11 +1,17 @@
+import re
 from langchain_openai.chat_models import ChatOpenAI
-from langchain.prompts import (
-    ChatPromptTemplate,
-    SystemMessagePromptTemplate,
-)
+from enum import Enum
 from typing import List
 from pydantic.v1 import BaseModel, Field
 from langchain_core.output_parsers import JsonOutputParser
+from agents.action_assigner import Action
+from agents.prompt_assembly import build_cached_prompt, prompt_cache_metrics
+from agents.structured_output import JSON_MODE, StructuredOutput
+from agents.model_cascade import (
+    CascadeStage,
+    ModelCascade,
+    validate_memories_list,
+)
 
 system_prompt_initial = """
 Your job is to assign a category to each memory in a list of new memories.
@@ -23,28 +29,38 @@ When you receive a message, you perform a sequence of steps consisting of:
 2. Internally assign a category to each memory
 3. Return the list of memories with the new categories you have determined. Do not change any of the original text of the memories, only add a category assignation.
 
-Here are the memories for you to assign categories to:
-
-```
-{memories}
-```
-
 Return the information fragments in the following format:
 
 {format_instructions}
 
 I will tip you $20 if you are perfect, and I will fine you $40 if you miss any important information or change any incorrect information.
+"""
+
+# Everything that changes per call comes after the static instructions, so the prefix can be cached
+user_prompt_memories = """
+Here are the memories for you to assign categories to:
+
+```
+{memories}
+```
 
 Take a deep breath, and think step by step.
 """
 
 
+class Category(str, Enum):
+    Allergy = "ALLERGY"
+    Like = "LIKE"
+    Dislike = "DISLIKE"
+    Attribute = "ATTRIBUTE"
+
+
 class Memory(BaseModel):
     knowledge: str = Field(description="If this failed, provide your explanation")
-    category: str = Field(
-        description="The category for this action: either ALLERGY, LIKE, DISLIE, OR ATTRIBUTE"
+    category: Category = Field(
+        description="The category for this action: either ALLERGY, LIKE, DISLIKE, OR ATTRIBUTE"
     )
-    action: str = Field(
+    action: Action = Field(
         description="The action to take on this memory: either CREATE, UPDATE, or DELETE"
     )
     old_memory: str = Field(
@@ -59,18 +75,92 @@ class Memories(BaseModel):
 parser = JsonOutputParser(pydantic_object=Memories)
 
 # Get the prompt to use - you can modify this!
-prompt = ChatPromptTemplate.from_messages(
-    [
-        SystemMessagePromptTemplate.from_template(system_prompt_initial),
-    ]
-).partial(format_instructions=parser.get_format_instructions())
+prompt = build_cached_prompt(
+    system_prompt_initial,
+    dynamic_suffix=user_prompt_memories,
+    format_instructions=parser.get_format_instructions(),
+)
 
-# Choose the LLM that will drive the agent
+# Choose the LLM that will drive the agent. The cascade binds the schema to it as a forced function call
 llm = ChatOpenAI(
     model="gpt-3.5-turbo-0125",
     # model="gpt-4-0125-preview",
     streaming=True,
     temperature=0.0,
+    # Streamed responses only report usage, and so cache hits, when asked to
+    stream_usage=True,
+    callbacks=[prompt_cache_metrics],
+)
+
+# The larger model is only called when the cascade rejects the smaller model's output
+llm_large = ChatOpenAI(
+    model="gpt-4-0125-preview",
+    streaming=True,
+    temperature=0.0,
+    # Streamed responses only report usage, and so cache hits, when asked to
+    stream_usage=True,
+    callbacks=[prompt_cache_metrics],
+)
+
+category_assigner_runnable = prompt | llm.bind(response_format=JSON_MODE) | parser
+
+
+# A stated allergy, but not "allergy-friendly snacks" or "allergy free", which describe the food
+_ALLERGY_TERM = re.compile(
+    r"\b(?:allergic|allergy|allergies|anaphyla\w*|epipen)\b(?![- ](?:friendly|free)\b)", re.I
 )
+# Negations a few words before the term in the same clause, as in "is not allergic" or "no longer has a nut allergy"
+_NEGATED = re.compile(
+    r"\b(?:not|no|never|isn't|aren't|doesn't|don't|without|outgrew|grew out of)(?:\s+[\w'-]+){0,4}\s*$",
+    re.I,
+)
+# Reactions the prompt says are not allergies
+_MILD_REACTION = re.compile(r"\b(?:sensitiv\w*|intoleran\w*)\b", re.I)
+
 
-category_assigner_runnable = prompt | llm | parser
+def states_allergy(knowledge):
+    return any(
+        not _NEGATED.search(knowledge[: match.start()])
+        for match in _ALLERGY_TERM.finditer(knowledge)
+    )
+
+
+def check_category_agreement(input, output):
+    # Quick self-check: the text must be unchanged, and each memory's own category must not contradict what it
+    # plainly says. Wording that is neither clearly an allergy nor clearly not one is left to the model
+    original_knowledge = {
+        memory.get("knowledge") if isinstance(memory, dict) else str(memory)
+        for memory in input.get("memories", [])
+    }
+    problems = []
+    for memory in output.get("memories", []):
+        knowledge = memory.get("knowledge", "")
+        if knowledge not in original_knowledge:
+            problems.append(f"Memory text was changed: {knowledge!r}")
+        is_allergy = memory.get("category") == Category.Allergy.value
+        if not is_allergy and states_allergy(knowledge):
+            problems.append(
+                f"Category {memory.get('category')!r} given to the allergy in {knowledge!r}"
+            )
+        elif is_allergy and not states_allergy(knowledge) and (
+            _ALLERGY_TERM.search(knowledge) or _MILD_REACTION.search(knowledge)
+        ):
+            problems.append(
+                f"Category 'ALLERGY' given to {knowledge!r}, which is not a stated allergy"
+            )
+    return problems
+
+
+category_assigner_cascade = ModelCascade(
+    name="category_assigner",
+    prompt=prompt,
+    stages=[
+        CascadeStage("gpt-3.5-turbo-0125", llm, cost_per_1k_tokens=0.001),
+        CascadeStage("gpt-4-0125-preview", llm_large, cost_per_1k_tokens=0.02),
+    ],
+    structured_output=StructuredOutput(Memories),
+    validators=[
+        validate_memories_list,
+        check_category_agreement,
+    ],
+)
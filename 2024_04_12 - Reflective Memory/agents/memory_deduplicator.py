@@ -0,0 +1,46 @@
+from store.similarity import SimilarityIndex, contradicts
+
+# Near duplicates above this similarity are treated as restating a memory we already have
+DUPLICATE_THRESHOLD = 0.9
+
+
+def memory_texts(memories):
+    """Accept existing memories as a string, a list of strings, or a list of memory dicts/models."""
+    if not memories:
+        return []
+    if isinstance(memories, str):
+        return [line.strip() for line in memories.splitlines() if line.strip()]
+    texts = []
+    for memory in memories:
+        if isinstance(memory, dict):
+            texts.append(memory.get("knowledge", ""))
+        else:
+            texts.append(getattr(memory, "knowledge", memory))
+    return [str(text) for text in texts if str(text).strip()]
+
+
+def deduplicate_memories(new_memories, existing_memories, threshold=DUPLICATE_THRESHOLD):
+    """Split new memories into the ones to forward to the action assigner and the no-op duplicates.
+
+    A memory is a duplicate when it normalizes to the same text as an existing memory (or an earlier new one), or
+    when its trigram similarity is above the threshold without contradicting it. Duplicates are returned as
+    (memory, matching memory) pairs.
+    """
+    index = SimilarityIndex(memory_texts(existing_memories))
+    forwarded, duplicates = [], []
+    for memory in new_memories:
+        match = index.exact(memory)
+        if match is None and len(index):
+            best, similarity = index.most_similar([memory])
+            if similarity[0] >= threshold and not contradicts(
+                memory, index.texts[best[0]]
+            ):
+                match = int(best[0])
+
+        if match is None:
+            forwarded.append(memory)
+            # Later memories in the same batch are also checked against this one
+            index.add([memory])
+        else:
+            duplicates.append((memory, index.texts[match]))
+    return forwarded, duplicates
@@ -1,12 +1,11 @@
 from langchain_openai.chat_models import ChatOpenAI
-from langchain.prompts import (
-    ChatPromptTemplate,
-    SystemMessagePromptTemplate,
-    MessagesPlaceholder,
-)
+from langchain.prompts import SystemMessagePromptTemplate
 from pydantic.v1 import BaseModel, Field
 from typing import List
 from langchain_core.output_parsers import JsonOutputParser
+from agents.prompt_assembly import build_cached_prompt, prompt_cache_metrics
+from agents.structured_output import JSON_MODE, StructuredOutput
+from agents.model_cascade import CascadeStage, ModelCascade, validate_memories_list
 
 system_prompt_initial = """
 Your job is to assess a brief chat history in order to determine if the conversation contains any details about a family's dining habits.
@@ -61,29 +60,59 @@ class Memories(BaseModel):
 
 parser = JsonOutputParser(pydantic_object=Memories)
 
-prompt_without_previous_analysis = ChatPromptTemplate.from_messages(
-    [
-        SystemMessagePromptTemplate.from_template(system_prompt_initial),
-        MessagesPlaceholder(variable_name="messages"),
-    ]
-).partial(format_instructions=parser.get_format_instructions())
-
+prompt_without_previous_analysis = build_cached_prompt(
+    system_prompt_initial,
+    messages_placeholder="messages",
+    format_instructions=parser.get_format_instructions(),
+)
 
-prompt_with_previous_analysis = ChatPromptTemplate.from_messages(
-    [
-        SystemMessagePromptTemplate.from_template(system_prompt_initial),
-        MessagesPlaceholder(variable_name="messages"),
-        SystemMessagePromptTemplate.from_template(system_prompt_close),
-    ]
-).partial(format_instructions=parser.get_format_instructions())
+# The feedback goes last so both prompts share the same cached prefix
+prompt_with_previous_analysis = (
+    prompt_without_previous_analysis
+    + SystemMessagePromptTemplate.from_template(system_prompt_close)
+)
 
-# Choose the LLM that will drive the agent
+# Choose the LLM that will drive the agent. The cascade binds the schema to it as a forced function call
 llm = ChatOpenAI(
     model="gpt-3.5-turbo-0125",
     # model="gpt-4-0125-preview",
     temperature=0.0,
-    model_kwargs={"response_format": {"type": "json_object"}},
+    # Streamed responses only report usage, and so cache hits, when asked to
+    stream_usage=True,
+    callbacks=[prompt_cache_metrics],
 )
 
-memory_extractor_runnable = prompt_without_previous_analysis | llm | parser
-memory_extractor_with_feedback_runnable = prompt_with_previous_analysis | llm | parser
+# The larger model is only called when the cascade rejects the smaller model's output
+llm_large = ChatOpenAI(
+    model="gpt-4-0125-preview",
+    temperature=0.0,
+    # Streamed responses only report usage, and so cache hits, when asked to
+    stream_usage=True,
+    callbacks=[prompt_cache_metrics],
+)
+
+json_llm = llm.bind(response_format=JSON_MODE)
+memory_extractor_runnable = prompt_without_previous_analysis | json_llm | parser
+memory_extractor_with_feedback_runnable = prompt_with_previous_analysis | json_llm | parser
+
+
+memory_extractor_cascade = ModelCascade(
+    name="memory_extractor",
+    prompt=prompt_without_previous_analysis,
+    stages=[
+        CascadeStage("gpt-3.5-turbo-0125", llm, cost_per_1k_tokens=0.001),
+        CascadeStage("gpt-4-0125-preview", llm_large, cost_per_1k_tokens=0.02),
+    ],
+    structured_output=StructuredOutput(Memories),
+    validators=[validate_memories_list],
+)
+memory_extractor_with_feedback_cascade = ModelCascade(
+    name="memory_extractor_with_feedback",
+    prompt=prompt_with_previous_analysis,
+    stages=[
+        CascadeStage("gpt-3.5-turbo-0125", llm, cost_per_1k_tokens=0.001),
+        CascadeStage("gpt-4-0125-preview", llm_large, cost_per_1k_tokens=0.02),
+    ],
+    structured_output=StructuredOutput(Memories),
+    validators=[validate_memories_list],
+)
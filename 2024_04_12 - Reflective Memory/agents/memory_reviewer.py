@@ -1,10 +1,6 @@
 from langchain_anthropic import ChatAnthropic
-from langchain.prompts import (
-    ChatPromptTemplate,
-    SystemMessagePromptTemplate,
-    MessagesPlaceholder,
-)
 from langchain_core.pydantic_v1 import BaseModel, Field
+from agents.prompt_assembly import build_cached_prompt, prompt_cache_metrics
 
 
 class GenerateCritique(BaseModel):
@@ -20,12 +16,6 @@ class GenerateCritique(BaseModel):
 reviewing_system_prompt = """
 Your job is to compare a set of extracted memories to the original message history. Is anything missing or incorrect? You are very thorough and detail-oriented, so I trust you to catch any mistakes.
 
-Here is the AI's analysis of the original message history that you will analyze, delimited by triple backticks below:
-
-```
-{ai_analysis}
-```
-
 You are interested in making sure the AI captured all the key data that might relate to the following categories of information:
 
 1. The family's food allergies (e.g. a dairy or soy allergy) - These are important to know because they can be life-threatening. Only log something as an allergy if you are certain it is an allergy and not just a dislike.
@@ -88,16 +78,25 @@ criticism: NA
 ```
 
 Take a deep breath, think step by step, and then share your analysis of how the AI performed in relation to the following analysis and original message history. Use the GenerateCritique tool to provide your analysis.
+"""
+
+# Everything that changes per call comes after the static instructions, so the prefix can be cached
+reviewing_user_prompt = """
+Here is the AI's analysis of the original message history that you will analyze, delimited by triple backticks below:
+
+```
+{ai_analysis}
+```
 
-Here is the AI analysis and original message history to analyze:
+The original message history to analyze is above.
 """
 
 # Get the prompt to use - you can modify this!
-reviewing_prompt = ChatPromptTemplate.from_messages(
-    [
-        SystemMessagePromptTemplate.from_template(reviewing_system_prompt),
-        MessagesPlaceholder(variable_name="messages"),
-    ]
+reviewing_prompt = build_cached_prompt(
+    reviewing_system_prompt,
+    dynamic_suffix=reviewing_user_prompt,
+    messages_placeholder="messages",
+    cache_breakpoint=True,
 )
 
 # Choose the LLM that will drive the agent
@@ -105,6 +104,8 @@ llm = ChatAnthropic(
     model="claude-3-haiku-20240307",
     # model="claude-3-sonnet-20240229",
     temperature=0.0,
+    default_headers={"anthropic-beta": "prompt-caching-2024-07-31"},
+    callbacks=[prompt_cache_metrics],
 )
 
 llm_with_tools = llm.bind_tools([GenerateCritique])
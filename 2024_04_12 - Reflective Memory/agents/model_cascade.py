@@ -0,0 +1,215 @@
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain_core.exceptions import OutputParserException
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CascadeStage:
+    name: str
+    llm: Any
+    # Blended price in USD per 1K tokens, used to estimate the spend of each call
+    cost_per_1k_tokens: float = 0.0
+
+
+@dataclass
+class StageStats:
+    calls: int = 0
+    accepted: int = 0
+    rejected: int = 0
+    total_latency: float = 0.0
+    total_tokens: int = 0
+    total_cost: float = 0.0
+
+    @property
+    def mean_latency(self):
+        return self.total_latency / self.calls if self.calls else None
+
+    @property
+    def mean_cost(self):
+        return self.total_cost / self.calls if self.calls else None
+
+
+@dataclass
+class CascadeStats:
+    invocations: int = 0
+    escalations: int = 0
+    stages: Dict[str, StageStats] = field(default_factory=dict)
+
+
+# A validator receives the cascade input and the parsed output, and returns a list of problems
+Validator = Callable[[dict, Any], List[str]]
+
+
+def estimate_tokens(text):
+    # Rough estimate, only used when the model did not report its token usage
+    return max(1, len(text) // 4)
+
+
+class ModelCascade:
+    """Run the cheapest model first, and only escalate to the next stage when the output fails validation."""
+
+    def __init__(
+        self,
+        name: str,
+        prompt: Any,
+        stages: List[CascadeStage],
+        structured_output: Any,
+        validators: Optional[List[Validator]] = None,
+    ):
+        self.name = name
+        self.prompt = prompt
+        self.stages = stages
+        self.structured_output = structured_output
+        self.validators = validators or []
+        self.stats = CascadeStats(
+            stages={stage.name: StageStats() for stage in stages}
+        )
+
+    def validate(self, input, output):
+        problems = []
+        for validator in self.validators:
+            problems.extend(validator(input, output))
+        return problems
+
+    def _record(self, stage, latency, tokens, accepted):
+        stats = self.stats.stages[stage.name]
+        stats.calls += 1
+        stats.total_latency += latency
+        stats.total_tokens += tokens
+        stats.total_cost += tokens / 1000 * stage.cost_per_1k_tokens
+        if accepted:
+            stats.accepted += 1
+        else:
+            stats.rejected += 1
+
+    def _finish_stage(self, index, prompt_value, output, text, usage, problems, latency):
+        """Record a stage's call, and return True if its output should be returned instead of escalating."""
+        stage = self.stages[index]
+        if usage:
+            tokens = usage.get("input_tokens", 0) + usage.get("output_tokens", 0)
+        else:
+            tokens = estimate_tokens(prompt_value.to_string()) + estimate_tokens(text)
+        self._record(stage, latency, tokens, not problems)
+
+        if not problems:
+            return True
+
+        if index == len(self.stages) - 1:
+            if output is None:
+                raise OutputParserException(
+                    f"{self.name}: every stage failed to produce parseable output"
+                )
+            # Nothing left to escalate to, so return the best effort from the largest model
+            return True
+
+        self.stats.escalations += 1
+        logger.info(
+            "%s: escalating from %s to %s: %s",
+            self.name,
+            stage.name,
+            self.stages[index + 1].name,
+            "; ".join(problems),
+        )
+        return False
+
+    def invoke(self, input, config=None):
+        self.stats.invocations += 1
+        # The prompt is identical for every stage, so it is only rendered once
+        prompt_value = self.prompt.invoke(input, config)
+
+        for index, stage in enumerate(self.stages):
+            start = time.perf_counter()
+            usage = {}
+            try:
+                output, text = self.structured_output.generate(
+                    stage.llm, prompt_value, config, usage
+                )
+                problems = self.validate(input, output)
+            except OutputParserException as e:
+                output, text = None, e.llm_output or ""
+                problems = [f"Could not parse output: {e}"]
+            latency = time.perf_counter() - start
+
+            if self._finish_stage(index, prompt_value, output, text, usage, problems, latency):
+                return output
+
+    async def ainvoke(self, input, config=None):
+        self.stats.invocations += 1
+        prompt_value = await self.prompt.ainvoke(input, config)
+
+        for index, stage in enumerate(self.stages):
+            start = time.perf_counter()
+            usage = {}
+            try:
+                output, text = await self.structured_output.agenerate(
+                    stage.llm, prompt_value, config, usage
+                )
+                problems = self.validate(input, output)
+            except OutputParserException as e:
+                output, text = None, e.llm_output or ""
+                problems = [f"Could not parse output: {e}"]
+            latency = time.perf_counter() - start
+
+            if self._finish_stage(index, prompt_value, output, text, usage, problems, latency):
+                return output
+
+    def report(self):
+        first, last = self.stages[0], self.stages[-1]
+        first_stats = self.stats.stages[first.name]
+        last_stats = self.stats.stages[last.name]
+        invocations = self.stats.invocations
+
+        report = {
+            "name": self.name,
+            "invocations": invocations,
+            "escalations": self.stats.escalations,
+            "escalation_rate": (
+                self.stats.escalations / invocations if invocations else 0.0
+            ),
+            "stages": {
+                name: {
+                    "calls": stats.calls,
+                    "accepted": stats.accepted,
+                    "rejected": stats.rejected,
+                    "mean_latency": stats.mean_latency,
+                    "total_cost": stats.total_cost,
+                }
+                for name, stats in self.stats.stages.items()
+            },
+            "cost_savings": None,
+            "latency_savings": None,
+        }
+
+        # Compare against sending every invocation straight to the largest model
+        total_cost = sum(stats.total_cost for stats in self.stats.stages.values())
+        total_latency = sum(
+            stats.total_latency for stats in self.stats.stages.values()
+        )
+        if first_stats.calls:
+            mean_tokens = first_stats.total_tokens / first_stats.calls
+            large_only_cost = (
+                invocations * mean_tokens / 1000 * last.cost_per_1k_tokens
+            )
+            report["cost_savings"] = large_only_cost - total_cost
+        if last_stats.mean_latency is not None:
+            report["latency_savings"] = (
+                invocations * last_stats.mean_latency - total_latency
+            )
+
+        return report
+
+
+def validate_memories_list(input, output):
+    if not isinstance(output, dict) or not isinstance(output.get("memories"), list):
+        return ["Output is missing a 'memories' list"]
+    problems = []
+    for memory in output["memories"]:
+        if not isinstance(memory, dict) or not str(memory.get("knowledge", "")).strip():
+            problems.append(f"Memory has no knowledge: {memory!r}")
+    return problems
+
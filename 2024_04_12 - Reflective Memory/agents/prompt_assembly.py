@@ -0,0 +1,107 @@
+from typing import Optional
+
+from langchain.prompts import (
+    ChatPromptTemplate,
+    HumanMessagePromptTemplate,
+    MessagesPlaceholder,
+)
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import SystemMessage
+
+
+def build_cached_prompt(
+    static_prefix: str,
+    dynamic_suffix: Optional[str] = None,
+    messages_placeholder: Optional[str] = None,
+    cache_breakpoint: bool = False,
+    **partial_variables,
+):
+    """Render the static instructions once so every call starts with an identical prefix, followed by the per-call content.
+
+    Provider prompt caching (OpenAI, Anthropic) and local KV reuse (Ollama, llama.cpp) only hit when the
+    leading tokens match exactly, so nothing that changes between calls may appear in the prefix.
+    """
+    prefix = static_prefix.format(**partial_variables)
+    if cache_breakpoint:
+        # Anthropic only caches up to blocks explicitly marked with cache_control
+        system_message = SystemMessage(
+            content=[
+                {"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}}
+            ]
+        )
+    else:
+        system_message = SystemMessage(content=prefix)
+
+    messages = [system_message]
+    if messages_placeholder:
+        messages.append(MessagesPlaceholder(variable_name=messages_placeholder))
+    if dynamic_suffix:
+        messages.append(HumanMessagePromptTemplate.from_template(dynamic_suffix))
+    return ChatPromptTemplate.from_messages(messages)
+
+
+class PromptCacheMetrics(BaseCallbackHandler):
+    """Collect prompt cache hits from the usage each provider reports."""
+
+    def __init__(self):
+        self.calls = 0
+        self.hits = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.cache_write_tokens = 0
+
+    def on_llm_end(self, response, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                metadata = getattr(message, "response_metadata", None) or {}
+                usage = (
+                    metadata.get("usage")
+                    or metadata.get("token_usage")
+                    or (response.llm_output or {}).get("token_usage")
+                    # Where streamed responses carry their usage
+                    or getattr(message, "usage_metadata", None)
+                    or {}
+                )
+                self.record(usage)
+
+    def record(self, usage):
+        self.calls += 1
+        # LangChain's own usage format, whose input tokens include the cached ones
+        if "input_token_details" in usage:
+            details = usage.get("input_token_details") or {}
+            cached = details.get("cache_read") or 0
+            written = details.get("cache_creation") or 0
+            prompt_tokens = usage.get("input_tokens", 0)
+        # Anthropic reports cache reads and writes separately from uncached input tokens
+        elif "input_tokens" in usage:
+            cached = usage.get("cache_read_input_tokens") or 0
+            written = usage.get("cache_creation_input_tokens") or 0
+            prompt_tokens = usage.get("input_tokens", 0) + cached + written
+        # OpenAI reports the cached part of the prompt tokens
+        else:
+            cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+            written = 0
+            prompt_tokens = usage.get("prompt_tokens", 0)
+
+        self.prompt_tokens += prompt_tokens
+        self.cached_tokens += cached
+        self.cache_write_tokens += written
+        if cached:
+            self.hits += 1
+
+    def report(self):
+        return {
+            "calls": self.calls,
+            "cache_hits": self.hits,
+            "hit_rate": self.hits / self.calls if self.calls else 0.0,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cache_write_tokens": self.cache_write_tokens,
+            "cached_token_ratio": (
+                self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+            ),
+        }
+
+
+prompt_cache_metrics = PromptCacheMetrics()
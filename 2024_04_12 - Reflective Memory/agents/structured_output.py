@@ -0,0 +1,225 @@
+from typing import Any, List, Type
+
+from langchain_core.callbacks.manager import (
+    adispatch_custom_event,
+    dispatch_custom_event,
+)
+from langchain_core.exceptions import OutputParserException
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.utils.json import parse_json_markdown, parse_partial_json
+from pydantic.v1 import BaseModel, ValidationError
+
+# For the plain runnables, which parse JSON from the message content
+JSON_MODE = {"type": "json_object"}
+
+# Custom callback event for each repair call, which tracing handlers count as a retry of the node it ran in
+RETRY_EVENT = "retry"
+
+REPAIR_PROMPT = """
+Your previous response did not match the required schema:
+
+{errors}
+
+Return the complete, corrected JSON object. Keep every entry that was already correct exactly as it was, and only fix the problems listed above.
+"""
+
+
+class SchemaViolation(OutputParserException):
+    def __init__(self, errors: List[str], partial_text: str):
+        super().__init__("; ".join(errors), llm_output=partial_text)
+        self.errors = errors
+        self.partial_text = partial_text
+
+
+def format_validation_errors(error: ValidationError, prefix=()):
+    return [
+        f"{'.'.join(str(part) for part in prefix + tuple(e['loc']))}: {e['msg']}"
+        for e in error.errors()
+    ]
+
+
+def chunk_text(chunk):
+    """The JSON a streamed chunk adds: its tool call arguments, or its content if the model answered in text."""
+    tool_call_chunks = getattr(chunk, "tool_call_chunks", None)
+    if tool_call_chunks:
+        return "".join(tool_call_chunk.get("args") or "" for tool_call_chunk in tool_call_chunks)
+    tool_calls = chunk.additional_kwargs.get("tool_calls")
+    if tool_calls:
+        return "".join(
+            (tool_call.get("function") or {}).get("arguments") or "" for tool_call in tool_calls
+        )
+    return chunk.content if isinstance(chunk.content, str) else ""
+
+
+def add_usage(usage, chunk):
+    """Add a streamed chunk's reported token counts to `usage`, if the caller passed a dict to collect them."""
+    usage_metadata = getattr(chunk, "usage_metadata", None)
+    if usage is None or not usage_metadata:
+        return
+    for key in ("input_tokens", "output_tokens"):
+        usage[key] = usage.get(key, 0) + (usage_metadata.get(key) or 0)
+
+
+class StructuredOutput:
+    """Stream a schema-constrained response, validating each list item as soon as it is complete, and repair violations with a targeted follow-up call.
+
+    The schema is bound as a function the model is forced to call, so the API constrains the output to its
+    fields and enum values. The models used here don't support strict schemas, so the output is still validated.
+    """
+
+    def __init__(
+        self, schema: Type[BaseModel], list_field: str = "memories", max_repairs=1
+    ):
+        self.schema = schema
+        self.list_field = list_field
+        self.item_schema = schema.__fields__[list_field].type_
+        self.max_repairs = max_repairs
+        self._bound = {}
+        self.stats = {
+            "generations": 0,
+            "aborted_streams": 0,
+            "repairs": 0,
+            "repaired": 0,
+            "wasted_chars": 0,
+        }
+
+    def bind(self, llm):
+        """The model with the schema bound as its only tool, and that tool's call forced."""
+        # Chat models are unhashable pydantic models, so they are keyed by id. The model is kept alongside its
+        # binding, so it stays alive and its id can't be reused by another model
+        entry = self._bound.get(id(llm))
+        if entry is None or entry[0] is not llm:
+            entry = (llm, llm.bind_tools([self.schema], tool_choice=self.schema.__name__))
+            self._bound[id(llm)] = entry
+        return entry[1]
+
+    def _validate_item(self, item, index):
+        try:
+            self.item_schema.parse_obj(item)
+        except ValidationError as e:
+            return format_validation_errors(e, (self.list_field, index))
+        return []
+
+    def _check_items(self, text, checked):
+        """Validate the list items completed so far, and return how many have been checked."""
+        parsed = parse_partial_json(text)
+        items = parsed.get(self.list_field) if isinstance(parsed, dict) else None
+        if not isinstance(items, list):
+            return checked
+        # Every item except the last one is complete, so a bad one aborts the stream immediately
+        while checked < len(items) - 1:
+            errors = self._validate_item(items[checked], checked)
+            if errors:
+                self.stats["aborted_streams"] += 1
+                raise SchemaViolation(errors, text)
+            checked += 1
+        return checked
+
+    def _stream(self, llm, messages, config=None, usage=None):
+        text = ""
+        checked = 0
+        for chunk in self.bind(llm).stream(messages, config):
+            add_usage(usage, chunk)
+            piece = chunk_text(chunk)
+            text += piece
+            # An item can only have been completed by a chunk that closes an object
+            if "}" in piece:
+                checked = self._check_items(text, checked)
+        return text
+
+    async def _astream(self, llm, messages, config=None, usage=None):
+        text = ""
+        checked = 0
+        async for chunk in self.bind(llm).astream(messages, config):
+            add_usage(usage, chunk)
+            piece = chunk_text(chunk)
+            text += piece
+            if "}" in piece:
+                checked = self._check_items(text, checked)
+        return text
+
+    def _parse(self, text):
+        try:
+            data = parse_json_markdown(text)
+        except Exception as e:
+            raise SchemaViolation([f"Invalid JSON: {e}"], text)
+        try:
+            validated = self.schema.parse_obj(data)
+        except ValidationError as e:
+            raise SchemaViolation(format_validation_errors(e), text)
+        # Round-trip through JSON so enums come back as plain strings for the prompts downstream
+        return parse_json_markdown(validated.json())
+
+    def _repair_messages(self, messages, violation):
+        self.stats["repairs"] += 1
+        self.stats["wasted_chars"] += len(violation.partial_text)
+        return messages + [
+            AIMessage(content=violation.partial_text),
+            HumanMessage(
+                content=REPAIR_PROMPT.format(
+                    errors="\n".join(f"- {e}" for e in violation.errors)
+                )
+            ),
+        ]
+
+    def _emit_retry(self, violation, config):
+        try:
+            dispatch_custom_event(RETRY_EVENT, {"reason": str(violation)}, config=config)
+        except RuntimeError:
+            # Not running inside a traced run
+            pass
+
+    async def _aemit_retry(self, violation, config):
+        try:
+            await adispatch_custom_event(RETRY_EVENT, {"reason": str(violation)}, config=config)
+        except RuntimeError:
+            pass
+
+    def generate(self, llm: Any, prompt_value: Any, config=None, usage=None):
+        """Returns the validated output and the raw text the model produced.
+
+        If `usage` is a dict, the token counts reported by every call, repairs included, are added to it.
+        """
+        self.stats["generations"] += 1
+        messages = prompt_value.to_messages()
+        try:
+            text = self._stream(llm, messages, config, usage)
+            return self._parse(text), text
+        except SchemaViolation as violation:
+            last_violation = violation
+
+        for _ in range(self.max_repairs):
+            repair_messages = self._repair_messages(messages, last_violation)
+            self._emit_retry(last_violation, config)
+            try:
+                text = self._stream(llm, repair_messages, config, usage)
+                output = self._parse(text)
+                self.stats["repaired"] += 1
+                return output, last_violation.partial_text + text
+            except SchemaViolation as violation:
+                last_violation = violation
+
+        raise last_violation
+
+    async def agenerate(self, llm: Any, prompt_value: Any, config=None, usage=None):
+        """Async version of generate, streaming with `astream`."""
+        self.stats["generations"] += 1
+        messages = prompt_value.to_messages()
+        try:
+            text = await self._astream(llm, messages, config, usage)
+            return self._parse(text), text
+        except SchemaViolation as violation:
+            last_violation = violation
+
+        for _ in range(self.max_repairs):
+            repair_messages = self._repair_messages(messages, last_violation)
+            await self._aemit_retry(last_violation, config)
+            try:
+                text = await self._astream(llm, repair_messages, config, usage)
+                output = self._parse(text)
+                self.stats["repaired"] += 1
+                return output, last_violation.partial_text + text
+            except SchemaViolation as violation:
+                last_violation = violation
+
+        raise last_violation
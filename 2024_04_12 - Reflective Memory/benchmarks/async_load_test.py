@@ -0,0 +1,232 @@
+"""Load test the memory reflection graph with a stub model, comparing one event loop against one thread per session.
+
+The stub answers every call after a fixed delay, so the numbers measure the graph and runtime overhead rather than
+a provider. Run each mode in its own process, since peak RSS only ever grows:
+
+    python -m benchmarks.async_load_test --mode async --sessions 1000
+    python -m benchmarks.async_load_test --mode threads --sessions 1000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional
+
+# The agents create their provider clients on import, which needs keys even though the stub replaces them
+os.environ.setdefault("OPENAI_API_KEY", "stub")
+os.environ.setdefault("ANTHROPIC_API_KEY", "stub")
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from agents.memory_reviewer import reviewing_prompt
+from graphs import memory_reflection_graph as graph_module
+from graphs.memory_reflection_service import RECURSION_LIMIT, MemoryReflectionService
+
+STUB_MEMORY = {
+    "knowledge": "I love spicy foods",
+    "action": "CREATE",
+    "category": "LIKE",
+    "old_memory": "",
+}
+STUB_REVIEW = [
+    {
+        "type": "tool_use",
+        "id": "stub",
+        "name": "GenerateCritique",
+        "input": {"is_perfect": True, "criticism": ""},
+    }
+]
+
+
+class StubChatModel(BaseChatModel):
+    """Answer every call with a fixed response after a fixed delay, streamed in small chunks.
+
+    Once tools are bound, the response is the JSON arguments of a call to the forced (or first) tool.
+    """
+
+    response: Any
+    latency: float = 0.05
+    chunk_size: int = 16
+    tool_name: Optional[str] = None
+
+    @property
+    def _llm_type(self):
+        return "stub"
+
+    def bind_tools(self, tools, tool_choice=None, **kwargs):
+        if isinstance(tool_choice, str) and tool_choice not in ("auto", "any", "required"):
+            tool_name = tool_choice
+        else:
+            tool_name = getattr(tools[0], "__name__", None) or tools[0]["name"]
+        return StubChatModel(
+            response=self.response,
+            latency=self.latency,
+            chunk_size=self.chunk_size,
+            tool_name=tool_name,
+        )
+
+    def _chunks(self):
+        return [
+            self.response[i : i + self.chunk_size]
+            for i in range(0, len(self.response), self.chunk_size)
+        ]
+
+    def _message_chunks(self):
+        if self.tool_name is None:
+            for chunk in self._chunks():
+                yield ChatGenerationChunk(message=AIMessageChunk(content=chunk))
+            return
+        for index, chunk in enumerate(self._chunks()):
+            # Like the providers, only the first chunk of a tool call carries its name and id
+            yield ChatGenerationChunk(
+                message=AIMessageChunk(
+                    content="",
+                    tool_call_chunks=[
+                        {
+                            "name": self.tool_name if index == 0 else None,
+                            "args": chunk,
+                            "id": "stub" if index == 0 else None,
+                            "index": 0,
+                        }
+                    ],
+                )
+            )
+
+    def _result(self):
+        if self.tool_name is None:
+            message = AIMessage(content=self.response)
+        else:
+            message = AIMessage(
+                content="",
+                tool_calls=[
+                    {"name": self.tool_name, "args": json.loads(self.response), "id": "stub"}
+                ],
+            )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        return self._result()
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return self._result()
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        yield from self._message_chunks()
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        for chunk in self._message_chunks():
+            yield chunk
+
+
+def install_stub_models(latency):
+    memories_model = StubChatModel(
+        response=json.dumps({"memories": [STUB_MEMORY]}), latency=latency
+    )
+    for cascade in (
+        graph_module.memory_extractor_cascade,
+        graph_module.memory_extractor_with_feedback_cascade,
+        graph_module.action_assigner_cascade,
+        graph_module.category_assigner_cascade,
+    ):
+        for stage in cascade.stages:
+            stage.llm = memories_model
+    # The nodes look the reviewer up at call time, so replacing the module global is enough
+    graph_module.memory_reviewer_runnable = reviewing_prompt | StubChatModel(
+        response=STUB_REVIEW, latency=latency
+    )
+
+
+def load_messages(file_name, sessions):
+    with open(file_name, "r") as infile:
+        rows = [json.loads(line) for line in infile if line.strip()]
+    return [
+        (rows[i % len(rows)]["input"], rows[i % len(rows)].get("memories", []))
+        for i in range(sessions)
+    ]
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def run_async(sessions):
+    service = MemoryReflectionService(max_concurrency=len(sessions))
+    latencies: List[float] = []
+
+    async def timed(message, existing_memories):
+        start = time.perf_counter()
+        await service.reflect(message, existing_memories)
+        latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(timed(*session) for session in sessions))
+    return latencies, service.stats["peak_in_flight"], threading.active_count()
+
+
+def run_threads(sessions):
+    app = graph_module.memory_reflection_graph
+    latencies: List[float] = []
+    peak_threads = 0
+
+    def timed(message, existing_memories):
+        nonlocal peak_threads
+        peak_threads = max(peak_threads, threading.active_count())
+        start = time.perf_counter()
+        app.invoke(
+            {
+                "original_conversation": [HumanMessage(content=message)],
+                "existing_memories": existing_memories,
+            },
+            {"recursion_limit": RECURSION_LIMIT},
+        )
+        latencies.append(time.perf_counter() - start)
+
+    with ThreadPoolExecutor(max_workers=len(sessions)) as executor:
+        list(executor.map(lambda session: timed(*session), sessions))
+    return latencies, len(sessions), peak_threads
+
+
+def main():
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument("--mode", choices=["async", "threads"], default="async")
+    argument_parser.add_argument("--sessions", type=int, default=1000)
+    argument_parser.add_argument("--latency", type=float, default=0.05)
+    argument_parser.add_argument("--dataset", default="./data/eval_dataset.jsonl")
+    args = argument_parser.parse_args()
+
+    install_stub_models(args.latency)
+    sessions = load_messages(args.dataset, args.sessions)
+    baseline_rss = peak_rss_mb()
+
+    start = time.perf_counter()
+    if args.mode == "async":
+        latencies, concurrency, threads = asyncio.run(run_async(sessions))
+    else:
+        latencies, concurrency, threads = run_threads(sessions)
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f"Mode: {args.mode}")
+    print(f"Sessions: {len(latencies)} ({concurrency} concurrent, {threads} threads)")
+    print(f"Throughput: {len(latencies) / elapsed:.1f} sessions/s over {elapsed:.2f}s")
+    p50 = statistics.median(latencies)
+    p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+    print(f"Latency: p50 {p50 * 1000:.0f}ms, p95 {p95 * 1000:.0f}ms")
+    print(
+        f"Peak RSS: {peak_rss_mb():.0f}MB ({peak_rss_mb() - baseline_rss:.0f}MB above the baseline)"
+    )
+
+
+if __name__ == "__main__":
+    main()
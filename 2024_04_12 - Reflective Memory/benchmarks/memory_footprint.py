@@ -0,0 +1,79 @@
+"""Measure the per-record memory cost of the representations memories can be held in.
+
+    python -m benchmarks.memory_footprint --records 100000
+"""
+
+import argparse
+import gc
+import json
+import os
+import tracemalloc
+
+# The graph module creates its provider clients on import, which needs keys even though nothing is called
+os.environ.setdefault("OPENAI_API_KEY", "stub")
+os.environ.setdefault("ANTHROPIC_API_KEY", "stub")
+
+from graphs.memory_reflection_graph import MemoryComplete
+from store.records import MemoryColumns, MemoryRecord
+
+EVAL_FILE_PATH = "./data/eval_dataset.jsonl"
+
+
+def load_memories(count):
+    with open(EVAL_FILE_PATH, "r") as infile:
+        responses = [
+            response
+            for line in infile
+            if line.strip()
+            for response in json.loads(line)["desired_response"]
+        ]
+    # Every record gets its own knowledge string, as it would in a real cache
+    return [
+        {
+            "knowledge": f"{responses[i % len(responses)]['knowledge']} #{i}",
+            "category": responses[i % len(responses)]["category"],
+            "action": responses[i % len(responses)]["action"],
+            "old_memory": "",
+        }
+        for i in range(count)
+    ]
+
+
+def measure(build, lines):
+    gc.collect()
+    tracemalloc.start()
+    container = build(map(json.loads, lines))
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del container
+    return size / len(lines)
+
+
+REPRESENTATIONS = {
+    "dicts": list,
+    "pydantic MemoryComplete": lambda memories: [
+        MemoryComplete(**memory) for memory in memories
+    ],
+    "repr strings": lambda memories: [repr(memory) for memory in memories],
+    "MemoryRecord (slots)": lambda memories: [
+        MemoryRecord.from_dict(memory) for memory in memories
+    ],
+    "MemoryColumns": MemoryColumns,
+}
+
+
+def main():
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument("--records", type=int, default=100000)
+    args = argument_parser.parse_args()
+
+    # Every representation is built from freshly parsed JSON, as if loaded from the store, so no strings are
+    # shared between them and only what each one keeps alive is counted
+    lines = [json.dumps(memory) for memory in load_memories(args.records)]
+    print(f"{'Representation':<26}{'Bytes per record':>18}")
+    for name, build in REPRESENTATIONS.items():
+        print(f"{name:<26}{measure(build, lines):>18.1f}")
+
+
+if __name__ == "__main__":
+    main()
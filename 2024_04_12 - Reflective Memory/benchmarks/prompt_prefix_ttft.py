@@ -0,0 +1,122 @@
+"""Compare time-to-first-token for cache-friendly prompts vs prompts whose prefix changes on every call.
+
+Runs against a local Ollama model through its OpenAI-compatible API, which reuses the KV cache for a
+shared prompt prefix. The baselines are the agents' prompts as they were before `build_cached_prompt`, loaded
+from git. Run it from the demo folder, inside the repository:
+
+    python -m benchmarks.prompt_prefix_ttft --model mistral --runs 20
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import time
+import types
+
+from langchain_core.messages import HumanMessage
+from langchain_openai.chat_models import ChatOpenAI
+from agents import action_assigner, memory_extractor
+
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434/v1")
+EVAL_FILE_PATH = "./data/eval_dataset.jsonl"
+
+
+def time_to_first_token(llm, prompt_value):
+    start = time.perf_counter()
+    for chunk in llm.stream(prompt_value):
+        if chunk.content:
+            return time.perf_counter() - start
+    return time.perf_counter() - start
+
+
+def load_rows():
+    with open(EVAL_FILE_PATH, "r") as infile:
+        return [json.loads(line) for line in infile if line.strip()]
+
+
+def baseline_ref():
+    """The commit before the prompts were reordered for caching."""
+    added = subprocess.check_output(
+        ["git", "rev-list", "--reverse", "HEAD", "--", "agents/prompt_assembly.py"], text=True
+    ).split()
+    return f"{added[0]}^" if added else "HEAD"
+
+
+def load_baseline(module_name, ref):
+    """Import an agent module as it was at the given commit."""
+    source = subprocess.check_output(
+        ["git", "show", f"{ref}:./agents/{module_name}.py"], text=True
+    )
+    module = types.ModuleType(f"baseline_{module_name}")
+    exec(compile(source, f"{ref}:agents/{module_name}.py", "exec"), module.__dict__)
+    return module
+
+
+def build_cases(ref):
+    extractor_baseline = load_baseline("memory_extractor", ref)
+    action_baseline = load_baseline("action_assigner", ref)
+
+    def extractor_input(row):
+        return {"messages": [HumanMessage(content=row["input"])]}
+
+    def action_input(row):
+        return {
+            "existing_memories": row.get("memories", []),
+            "new_memories": [
+                memory["knowledge"] for memory in row.get("desired_response", [])
+            ],
+        }
+
+    return {
+        "memory_extractor": (
+            memory_extractor.prompt_without_previous_analysis,
+            extractor_baseline.prompt_without_previous_analysis,
+            extractor_input,
+        ),
+        "action_assigner": (action_assigner.prompt, action_baseline.prompt, action_input),
+    }
+
+
+def main():
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument("--model", default="mistral")
+    argument_parser.add_argument("--runs", type=int, default=20)
+    argument_parser.add_argument(
+        "--baseline-ref", help="Commit to load the baseline prompts from (default: before prompt caching)"
+    )
+    args = argument_parser.parse_args()
+    ref = args.baseline_ref or baseline_ref()
+
+    llm = ChatOpenAI(
+        base_url=OLLAMA_BASE_URL,
+        api_key="ollama",
+        model=args.model,
+        temperature=0.0,
+        max_tokens=8,
+    )
+    rows = load_rows()
+
+    for name, (cached_prompt, baseline_prompt, make_input) in build_cases(ref).items():
+        results = {}
+        for layout, prompt in (("baseline", baseline_prompt), ("cached", cached_prompt)):
+            # Warm up once so the static prefix is in the KV cache before timing
+            time_to_first_token(llm, prompt.invoke(make_input(rows[0])))
+            timings = [
+                time_to_first_token(
+                    llm, prompt.invoke(make_input(rows[run % len(rows)]))
+                )
+                for run in range(args.runs)
+            ]
+            results[layout] = timings
+
+        baseline = statistics.median(results["baseline"])
+        cached = statistics.median(results["cached"])
+        print(
+            f"{name}: median TTFT baseline {baseline * 1000:.0f}ms, cached prefix {cached * 1000:.0f}ms ({baseline / cached:.2f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -39,7 +39,7 @@ Take a deep breath, and think step by step.
 class Memory(BaseModel):
     memory: str = Field(description="If this failed, provide your explanation")
     action: str = Field(description="The action to take on this memory: either CREATE, UPDATE, or DELETE")
-    category: str = Field(description="The category for this action: either ALLERGY, LIKE, DISLIE, OR ATTRIBUTE")
+    category: str = Field(description="The category for this action: either ALLERGY, LIKE, DISLIKE, OR ATTRIBUTE")
     old_memory: str = Field(description="If updating or deleting, include the original text from the old memory to update or delete")
 
 class Memories(BaseModel):
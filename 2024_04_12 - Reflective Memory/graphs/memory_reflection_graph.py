@@ -2,14 +2,16 @@ from typing import TypedDict, Annotated, Sequence
 import operator
 import random
 from langchain_core.messages import BaseMessage, HumanMessage
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph, END
 from agents.memory_extractor import (
-    memory_extractor_runnable,
-    memory_extractor_with_feedback_runnable,
+    memory_extractor_cascade,
+    memory_extractor_with_feedback_cascade,
 )
 from agents.memory_reviewer import memory_reviewer_runnable
-from agents.action_assigner import action_assigner_runnable
-from agents.category_assigner import category_assigner_runnable
+from agents.action_assigner import action_assigner_cascade
+from agents.category_assigner import category_assigner_cascade
+from agents.memory_deduplicator import deduplicate_memories
 from pydantic.v1 import BaseModel
 from typing import List, Union
 
@@ -42,6 +44,8 @@ class AgentState(TypedDict):
     memories: List[Union[Memory, MemoryWithAction, MemoryComplete]]
     # The list of existing memories
     existing_memories: List[Memory]
+    # New memories that restate an existing memory, and were resolved without the LLM
+    duplicate_memories: List[str]
 
 
 def should_retry_memory_extractor(state):
@@ -57,19 +61,31 @@ def should_retry_memory_extractor(state):
         return "retry"
 
 
-def call_memory_extractor(state):
+def memory_extractor_request(state):
     if state["memory_analysis"]:
-        # Run the memory extractor runnable
         input = {
             "messages": state["original_conversation"],
             "previous_memory_analysis": state["memory_analysis"],
         }
-        extracted_memories = memory_extractor_with_feedback_runnable.invoke(input)
-    else:
-        # Run the memory extractor runnable
-        input = {"messages": state["original_conversation"]}
-        extracted_memories = memory_extractor_runnable.invoke(input)
+        return memory_extractor_with_feedback_cascade, input
+    input = {"messages": state["original_conversation"]}
+    return memory_extractor_cascade, input
+
+
+def call_memory_extractor(state, config):
+    # Run the memory extractor runnable
+    cascade, input = memory_extractor_request(state)
+    extracted_memories = cascade.invoke(input, config)
+    return memory_extractor_update(state, extracted_memories)
+
 
+async def acall_memory_extractor(state, config):
+    cascade, input = memory_extractor_request(state)
+    extracted_memories = await cascade.ainvoke(input, config)
+    return memory_extractor_update(state, extracted_memories)
+
+
+def memory_extractor_update(state, extracted_memories):
     # Extract the memories from the output
     memories = [memory["knowledge"] for memory in extracted_memories.get("memories")]
 
@@ -89,7 +105,7 @@ def call_memory_extractor(state):
     }
 
 
-def call_memory_reviewer(state):
+def memory_reviewer_input(state):
     # Randomly reorder the memory list
     random.shuffle(state["memories"])
 
@@ -98,12 +114,26 @@ def call_memory_reviewer(state):
         f"Memory {i+1} of {len(state['memories'])}: {memory}"
         for i, memory in enumerate(state["memories"])
     )
-    inputs_to_review = {
+    return {
         "messages": state["original_conversation"],
         "ai_analysis": ai_analysis,
     }
+
+
+def call_memory_reviewer(state):
     # Run the reviewer runnable
-    review_results = memory_reviewer_runnable.invoke(inputs_to_review)
+    review_results = memory_reviewer_runnable.invoke(memory_reviewer_input(state))
+    return memory_reviewer_update(state, review_results)
+
+
+async def acall_memory_reviewer(state):
+    review_results = await memory_reviewer_runnable.ainvoke(
+        memory_reviewer_input(state)
+    )
+    return memory_reviewer_update(state, review_results)
+
+
+def memory_reviewer_update(state, review_results):
     # Convert the messages to dictionaries
     review_results_dict = [dict(message) for message in review_results.content]
     # Find the first tool call
@@ -131,35 +161,98 @@ def call_memory_reviewer(state):
     return {"messages": [new_message], "memory_analysis": [new_message]}
 
 
-def call_action_assigner(state):
-    inputs = {
+def should_assign_actions(state):
+    # When every new memory was a duplicate there is nothing left for the LLM stages to do
+    if state["memories"]:
+        return "continue"
+    return "end"
+
+
+def call_memory_deduplicator(state):
+    forwarded, duplicates = deduplicate_memories(
+        state["memories"], state.get("existing_memories")
+    )
+    new_message = f"Skipped duplicate memories: {', '.join(f'{memory!r} (matches {match!r})' for memory, match in duplicates) or 'none'}"
+    return {
+        "messages": [new_message],
+        "memories": forwarded,
+        "duplicate_memories": [memory for memory, _ in duplicates],
+    }
+
+
+async def acall_memory_deduplicator(state):
+    # Local and cheap, so it runs on the event loop rather than in an executor thread
+    return call_memory_deduplicator(state)
+
+
+def action_assigner_input(state):
+    return {
         "existing_memories": state["existing_memories"],
         "new_memories": state["memories"],
     }
 
-    memories_with_actions = action_assigner_runnable.invoke(inputs)
-    new_message = f"Added actions: {memories_with_actions}"
 
+def action_assigner_update(memories_with_actions):
+    new_message = f"Added actions: {memories_with_actions}"
     return {"messages": [new_message], "memories": memories_with_actions["memories"]}
 
 
-def call_category_assigner(state):
-    inputs = {"memories": state["memories"]}
+def call_action_assigner(state, config):
+    memories_with_actions = action_assigner_cascade.invoke(
+        action_assigner_input(state), config
+    )
+    return action_assigner_update(memories_with_actions)
+
 
-    complete_memories = category_assigner_runnable.invoke(inputs)
+async def acall_action_assigner(state, config):
+    memories_with_actions = await action_assigner_cascade.ainvoke(
+        action_assigner_input(state), config
+    )
+    return action_assigner_update(memories_with_actions)
 
+
+def category_assigner_update(complete_memories):
     new_message = f"Added categories: {complete_memories}"
     return {"messages": [new_message], "memories": complete_memories["memories"]}
 
 
+def call_category_assigner(state, config):
+    inputs = {"memories": state["memories"]}
+    complete_memories = category_assigner_cascade.invoke(inputs, config)
+    return category_assigner_update(complete_memories)
+
+
+async def acall_category_assigner(state, config):
+    inputs = {"memories": state["memories"]}
+    complete_memories = await category_assigner_cascade.ainvoke(inputs, config)
+    return category_assigner_update(complete_memories)
+
+
 # Initialize a new graph
 graph = StateGraph(AgentState)
 
-# Define the Nodes we will cycle between
-graph.add_node("memory_extractor", call_memory_extractor)
-graph.add_node("memory_reviewer", call_memory_reviewer)
-graph.add_node("action_assigner", call_action_assigner)
-graph.add_node("category_assigner", call_category_assigner)
+# Define the Nodes we will cycle between. Each node has a sync and an async implementation, so the compiled
+# graph runs natively under both `invoke` and `ainvoke`
+graph.add_node(
+    "memory_extractor",
+    RunnableLambda(call_memory_extractor, afunc=acall_memory_extractor),
+)
+graph.add_node(
+    "memory_reviewer",
+    RunnableLambda(call_memory_reviewer, afunc=acall_memory_reviewer),
+)
+graph.add_node(
+    "memory_deduplicator",
+    RunnableLambda(call_memory_deduplicator, afunc=acall_memory_deduplicator),
+)
+graph.add_node(
+    "action_assigner",
+    RunnableLambda(call_action_assigner, afunc=acall_action_assigner),
+)
+graph.add_node(
+    "category_assigner",
+    RunnableLambda(call_category_assigner, afunc=acall_category_assigner),
+)
 
 # Set the Starting Edge
 graph.set_entry_point("memory_extractor")
@@ -168,7 +261,12 @@ graph.set_entry_point("memory_extractor")
 graph.add_conditional_edges(
     "memory_reviewer",
     should_retry_memory_extractor,
-    {"retry": "memory_extractor", "continue": "action_assigner"},
+    {"retry": "memory_extractor", "continue": "memory_deduplicator"},
+)
+graph.add_conditional_edges(
+    "memory_deduplicator",
+    should_assign_actions,
+    {"continue": "action_assigner", "end": END},
 )
 
 # Define the Normal Edges that should always be called after another
@@ -178,3 +276,15 @@ graph.add_edge("category_assigner", END)
 
 # We compile the entire workflow as a runnable
 memory_reflection_graph = graph.compile()
+
+
+def cascade_report():
+    return [
+        cascade.report()
+        for cascade in (
+            memory_extractor_cascade,
+            memory_extractor_with_feedback_cascade,
+            action_assigner_cascade,
+            category_assigner_cascade,
+        )
+    ]
@@ -0,0 +1,95 @@
+"""Run many memory reflection sessions concurrently on a single event loop.
+
+Every session is a `memory_reflection_graph.ainvoke`, so an in-flight session costs a coroutine rather than an
+OS thread. Sessions are read from a JSONL file in the eval dataset format ({"input": ..., "memories": [...]}):
+
+    python -m graphs.memory_reflection_service ./data/eval_dataset.jsonl --concurrency 200
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from langchain_core.messages import HumanMessage
+from graphs.memory_reflection_graph import memory_reflection_graph
+
+RECURSION_LIMIT = 40
+
+
+class MemoryReflectionService:
+    def __init__(self, graph=memory_reflection_graph, max_concurrency=1000):
+        self.graph = graph
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.stats = {"completed": 0, "failed": 0, "in_flight": 0, "peak_in_flight": 0}
+
+    async def reflect(self, message, existing_memories=None, config=None):
+        """Run the graph for one message and return its categorized memories."""
+        input = {
+            "original_conversation": [HumanMessage(content=message)],
+            "existing_memories": existing_memories or [],
+        }
+        async with self._semaphore:
+            self.stats["in_flight"] += 1
+            self.stats["peak_in_flight"] = max(
+                self.stats["peak_in_flight"], self.stats["in_flight"]
+            )
+            try:
+                state = await self.graph.ainvoke(
+                    input, {"recursion_limit": RECURSION_LIMIT, **(config or {})}
+                )
+            except Exception:
+                self.stats["failed"] += 1
+                raise
+            finally:
+                self.stats["in_flight"] -= 1
+        self.stats["completed"] += 1
+        return state["memories"]
+
+    async def reflect_many(self, sessions, config=None):
+        """Run (message, existing_memories) pairs concurrently. Failed sessions return their exception."""
+        return await asyncio.gather(
+            *(
+                self.reflect(message, existing_memories, config)
+                for message, existing_memories in sessions
+            ),
+            return_exceptions=True,
+        )
+
+
+def load_sessions(file_name):
+    with open(file_name, "r") as infile:
+        return [
+            (row["input"], row.get("memories", []))
+            for row in map(json.loads, filter(str.strip, infile))
+        ]
+
+
+async def main(file_name, concurrency):
+    service = MemoryReflectionService(max_concurrency=concurrency)
+    sessions = load_sessions(file_name)
+
+    start = time.perf_counter()
+    results = await service.reflect_many(sessions)
+    elapsed = time.perf_counter() - start
+
+    for (message, _), memories in zip(sessions, results):
+        output = (
+            {"error": repr(memories)}
+            if isinstance(memories, Exception)
+            else {"memories": memories}
+        )
+        print(json.dumps({"input": message, **output}, default=str))
+    print(
+        f"{len(sessions)} sessions in {elapsed:.2f}s: {service.stats}",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument("sessions_file")
+    argument_parser.add_argument("--concurrency", type=int, default=100)
+    args = argument_parser.parse_args()
+    asyncio.run(main(args.sessions_file, args.concurrency))
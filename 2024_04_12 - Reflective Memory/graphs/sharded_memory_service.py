@@ -0,0 +1,172 @@
+"""Serve memory reflection for many families, sharded across worker processes.
+
+Each family is owned by one shard (by a hash of its id), and each shard is a single worker process with its own
+SQLite database and event loop. Sessions for a shard are collected into batches. A batch runs the graphs of
+different families concurrently, then writes all of their CREATE/UPDATE/DELETE actions in one transaction. Sessions
+of the same family in a batch run one after another, each against the memories the one before it wrote, so two of
+them can't both create the same memory. Writes are also versioned per family, and a write whose UPDATE or DELETE
+targets a memory that is gone is re-run against the family's new memories.
+"""
+
+import asyncio
+import os
+import zlib
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from store.memory_store import MemoryStore, VersionConflict
+
+# Worker process state, set up once per shard by init_shard
+_store = None
+_loop = None
+_service = None
+
+
+def init_shard(database):
+    global _store, _loop, _service
+    # Imported here so the parent process never loads the models
+    from graphs.memory_reflection_service import MemoryReflectionService
+
+    _store = MemoryStore(database)
+    _store.connection.execute("PRAGMA journal_mode=WAL")
+    # One loop for the life of the worker, so the model clients keep their connections between batches
+    _loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_loop)
+    _service = MemoryReflectionService()
+
+
+async def reflect_batch(sessions, max_retries):
+    results = [None] * len(sessions)
+    # The nth session of every family goes in round n, so no round has two sessions of one family
+    rounds = defaultdict(list)
+    family_sessions = defaultdict(int)
+    for i, session in enumerate(sessions):
+        rounds[family_sessions[session["family_id"]]].append(i)
+        family_sessions[session["family_id"]] += 1
+
+    for round_number in range(len(rounds)):
+        await reflect_round(sessions, rounds[round_number], results, max_retries)
+    return results
+
+
+async def reflect_round(sessions, pending, results, max_retries):
+    for _ in range(max_retries + 1):
+        snapshots = [_store.snapshot(sessions[i]["family_id"]) for i in pending]
+        outputs = await asyncio.gather(
+            *(
+                _service.reflect(sessions[i]["message"], existing_memories)
+                for i, (_, existing_memories) in zip(pending, snapshots)
+            ),
+            return_exceptions=True,
+        )
+
+        writes = []
+        for i, (version, _), output in zip(pending, snapshots, outputs):
+            if isinstance(output, Exception):
+                results[i] = {"error": repr(output)}
+            elif not output:
+                # Nothing new (e.g. every memory was a duplicate), so there is nothing to write
+                results[i] = {"memories": [], "version": version}
+            else:
+                writes.append((i, (sessions[i]["family_id"], version, output)))
+
+        applied = _store.apply_batch([write for _, write in writes])
+
+        pending = []
+        for (i, (_, _, memories)), result in zip(writes, applied):
+            if isinstance(result, VersionConflict):
+                results[i] = {"error": str(result)}
+                pending.append(i)
+            else:
+                results[i] = {"memories": memories, "version": result}
+        if not pending:
+            break
+
+
+def run_batch(sessions, max_retries):
+    return _loop.run_until_complete(reflect_batch(sessions, max_retries))
+
+
+class ShardedMemoryService:
+    def __init__(
+        self,
+        database_dir="./data/shards",
+        num_shards=4,
+        max_batch=64,
+        batch_window=0.01,
+        max_retries=2,
+    ):
+        os.makedirs(database_dir, exist_ok=True)
+        self.num_shards = num_shards
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.max_retries = max_retries
+        # A single worker per shard means one batch at a time per shard, which serializes each family's writes
+        self._executors = [
+            ProcessPoolExecutor(
+                max_workers=1,
+                initializer=init_shard,
+                initargs=(os.path.join(database_dir, f"memories-{shard}.db"),),
+            )
+            for shard in range(num_shards)
+        ]
+        self._pending = [[] for _ in range(num_shards)]
+        self._dispatchers = [None] * num_shards
+        self.stats = {"batches": 0, "sessions": 0, "max_batch_size": 0}
+
+    def shard_for(self, family_id):
+        return zlib.crc32(family_id.encode()) % self.num_shards
+
+    async def reflect(self, family_id, message):
+        """Run the graph for a family's message and store the result. Returns the memories and the new version."""
+        shard = self.shard_for(family_id)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[shard].append(
+            ({"family_id": family_id, "message": message}, future)
+        )
+        if self._dispatchers[shard] is None or self._dispatchers[shard].done():
+            self._dispatchers[shard] = asyncio.create_task(self._dispatch(shard))
+        return await future
+
+    async def _dispatch(self, shard):
+        # Wait briefly so concurrent sessions share a batch, then keep going while more arrive
+        await asyncio.sleep(self.batch_window)
+        loop = asyncio.get_running_loop()
+        while self._pending[shard]:
+            batch = self._pending[shard][: self.max_batch]
+            del self._pending[shard][: self.max_batch]
+            self.stats["batches"] += 1
+            self.stats["sessions"] += len(batch)
+            self.stats["max_batch_size"] = max(self.stats["max_batch_size"], len(batch))
+
+            try:
+                results = await loop.run_in_executor(
+                    self._executors[shard],
+                    run_batch,
+                    [session for session, _ in batch],
+                    self.max_retries,
+                )
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                # The caller may have been cancelled while its batch ran
+                if future.done():
+                    continue
+                if "error" in result:
+                    future.set_exception(RuntimeError(result["error"]))
+                else:
+                    future.set_result(result)
+
+    def close(self):
+        for executor in self._executors:
+            executor.shutdown()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
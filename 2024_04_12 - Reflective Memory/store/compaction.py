@@ -0,0 +1,158 @@
+"""Offline compaction of the memory store.
+
+For every family: merge near-duplicate memories within each category (keeping the most recently updated wording),
+purge superseded and deleted rows once they are older than the retention window, then rebuild the indexes. Merged
+rows are only marked superseded, so a bad merge can be found and undone with `MemoryStore.restore` until it is
+purged. Run it from the demo folder:
+
+    python -m store.compaction ./data/memories.db --threshold 0.8
+    python -m store.compaction ./data/memories.db --dry-run
+"""
+
+import argparse
+import time
+from itertools import groupby
+
+import numpy as np
+from store.memory_store import ACTIVE, MemoryStore
+from store.similarity import contradicts, normalize, vectorize
+
+DEFAULT_THRESHOLD = 0.8
+# Superseded and deleted rows are kept this long before they are purged
+DEFAULT_RETENTION_DAYS = 7
+# Merging two of these wrongly loses safety information, so they are only merged when they normalize to the same text
+EXACT_ONLY_CATEGORIES = {"ALLERGY"}
+
+
+def mergeable(text, other):
+    """Whether two similar memories say the same thing.
+
+    Not if they differ in negation or numbers, or if one says everything the other does and more, like
+    "allergic to shellfish and peanuts" and "allergic to shellfish".
+    """
+    words, other_words = set(normalize(text).split()), set(normalize(other).split())
+    if words == other_words:
+        return True
+    return not contradicts(text, other) and not (words < other_words or other_words < words)
+
+
+def cluster(texts, threshold=DEFAULT_THRESHOLD, exact_only=False):
+    """Greedy clustering: each text joins the first earlier text it is at least `threshold` similar to.
+
+    Returns the index of the cluster representative for every text. Texts should be ordered by priority,
+    since the first text of each cluster is the one that is kept. Similar texts that aren't `mergeable` stay
+    apart, and with `exact_only` only texts that normalize the same are merged.
+    """
+    vectors = vectorize(texts)
+    similarities = vectors @ vectors.T
+    normalized = [normalize(text) for text in texts]
+    representatives = np.arange(len(texts))
+    for i in range(len(texts)):
+        if representatives[i] != i:
+            continue
+        members = np.flatnonzero(
+            (similarities[i] >= threshold) & (representatives == np.arange(len(texts)))
+        )
+        for member in members[members > i]:
+            if normalized[member] == normalized[i] or (
+                not exact_only and mergeable(texts[i], texts[member])
+            ):
+                representatives[member] = i
+    return representatives
+
+
+def compact_family(store, family_id, threshold=DEFAULT_THRESHOLD):
+    """Merge near-duplicate active memories of one family, returning the number of merged rows."""
+    rows = sorted(
+        store.active_memories(family_id),
+        key=lambda row: (row["category"], -row["updated_at"], -row["id"]),
+    )
+    merged = 0
+    for _, group in groupby(rows, key=lambda row: row["category"]):
+        group = list(group)
+        if len(group) < 2:
+            continue
+        representatives = cluster(
+            [row["knowledge"] for row in group],
+            threshold,
+            exact_only=group[0]["category"] in EXACT_ONLY_CATEGORIES,
+        )
+        for index, representative in enumerate(representatives):
+            if representative != index:
+                store.supersede([group[index]["id"]], group[representative]["id"])
+                merged += 1
+    if merged:
+        # Writes based on the family's memories before compaction have to be checked again
+        store.bump_version(family_id)
+    return merged
+
+
+def compact(
+    store, threshold=DEFAULT_THRESHOLD, dry_run=False, retention_days=DEFAULT_RETENTION_DAYS
+):
+    """Compact every family, and return their sizes before and after."""
+    before = store.family_sizes()
+    merged = {}
+    with store.connection:
+        for family_id in store.families():
+            merged[family_id] = compact_family(store, family_id, threshold)
+        # History, including this run's merges, is kept for the retention window so it can be checked and restored
+        store.connection.execute(
+            "DELETE FROM memories WHERE status != ? AND updated_at < ?",
+            (ACTIVE, time.time() - retention_days * 86400),
+        )
+        after = store.family_sizes()
+        if dry_run:
+            store.connection.rollback()
+    if not dry_run:
+        store.rebuild_indexes()
+
+    return {
+        family_id: {
+            "before": before[family_id],
+            "after": after.get(family_id, {"rows": 0, "active": 0, "active_chars": 0}),
+            "merged": merged.get(family_id, 0),
+        }
+        for family_id in before
+    }
+
+
+def print_report(report, dry_run=False):
+    print(
+        f"{'Family':<24}{'Rows':>14}{'Active':>14}{'Prompt chars':>18}{'Merged':>8}"
+        + ("  (dry run)" if dry_run else "")
+    )
+    for family_id, sizes in report.items():
+        before, after = sizes["before"], sizes["after"]
+        print(
+            f"{family_id:<24}"
+            f"{before['rows']:>6} -> {after['rows']:<5}"
+            f"{before['active']:>6} -> {after['active']:<5}"
+            f"{before['active_chars']:>8} -> {after['active_chars']:<7}"
+            f"{sizes['merged']:>8}"
+        )
+
+
+def main():
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument("database")
+    argument_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    argument_parser.add_argument(
+        "--retention-days",
+        type=float,
+        default=DEFAULT_RETENTION_DAYS,
+        help="Purge superseded and deleted rows older than this",
+    )
+    argument_parser.add_argument(
+        "--dry-run", action="store_true", help="Report what would change without writing"
+    )
+    args = argument_parser.parse_args()
+
+    store = MemoryStore(args.database)
+    report = compact(store, args.threshold, args.dry_run, args.retention_days)
+    print_report(report, args.dry_run)
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+import sqlite3
+import time
+
+from store.records import MemoryColumns
+
+ACTIVE = "active"
+SUPERSEDED = "superseded"
+DELETED = "deleted"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS memories (
+    id INTEGER PRIMARY KEY,
+    family_id TEXT NOT NULL,
+    knowledge TEXT NOT NULL,
+    category TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'active',
+    superseded_by INTEGER,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS memories_family_status ON memories (family_id, status, category);
+CREATE TABLE IF NOT EXISTS families (
+    family_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS memories_fts USING fts5 (
+    knowledge, content='memories', content_rowid='id'
+);
+"""
+
+
+class VersionConflict(Exception):
+    """A write was based on a stale version of the family, and an UPDATE or DELETE targets a memory that is gone."""
+
+    def __init__(self, family_id, expected_version, version, stale_memories):
+        super().__init__(
+            f"Family {family_id!r} is at version {version}, not {expected_version}, and these memories no longer exist: {stale_memories}"
+        )
+        self.family_id = family_id
+        self.expected_version = expected_version
+        self.version = version
+        self.stale_memories = stale_memories
+
+
+class MemoryStore:
+    """SQLite store for the memories of each family.
+
+    Updates and deletes keep the old row, marked superseded or deleted, so history survives until compaction purges
+    it after its retention window.
+    The full-text index is maintained by `rebuild_indexes` rather than on every write.
+    """
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def add(self, family_id, knowledge, category):
+        now = time.time()
+        cursor = self.connection.execute(
+            "INSERT INTO memories (family_id, knowledge, category, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (family_id, knowledge, category, now, now),
+        )
+        return cursor.lastrowid
+
+    def find_active(self, family_id, knowledge):
+        row = self.connection.execute(
+            "SELECT id FROM memories WHERE family_id = ? AND status = ? AND knowledge = ? ORDER BY updated_at DESC LIMIT 1",
+            (family_id, ACTIVE, knowledge),
+        ).fetchone()
+        return row["id"] if row else None
+
+    def supersede(self, memory_ids, superseded_by):
+        self.connection.executemany(
+            "UPDATE memories SET status = ?, superseded_by = ?, updated_at = ? WHERE id = ?",
+            [(SUPERSEDED, superseded_by, time.time(), memory_id) for memory_id in memory_ids],
+        )
+
+    def delete(self, memory_ids):
+        self.connection.executemany(
+            "UPDATE memories SET status = ?, updated_at = ? WHERE id = ?",
+            [(DELETED, time.time(), memory_id) for memory_id in memory_ids],
+        )
+
+    def restore(self, memory_ids):
+        """Make superseded or deleted memories active again, e.g. to undo a merge made by compaction."""
+        with self.connection:
+            rows = self.connection.execute(
+                f"SELECT DISTINCT family_id FROM memories WHERE id IN ({','.join('?' * len(memory_ids))})",
+                list(memory_ids),
+            ).fetchall()
+            self.connection.executemany(
+                "UPDATE memories SET status = ?, superseded_by = NULL, updated_at = ? WHERE id = ?",
+                [(ACTIVE, time.time(), memory_id) for memory_id in memory_ids],
+            )
+            for row in rows:
+                self.bump_version(row["family_id"])
+
+    def family_version(self, family_id):
+        row = self.connection.execute(
+            "SELECT version FROM families WHERE family_id = ?", (family_id,)
+        ).fetchone()
+        return row["version"] if row else 0
+
+    def snapshot(self, family_id):
+        """The family's version and existing memories, to run the graph against and write back with."""
+        return self.family_version(family_id), self.existing_memories(family_id)
+
+    def bump_version(self, family_id):
+        self.connection.execute(
+            "INSERT INTO families (family_id, version) VALUES (?, 1) "
+            "ON CONFLICT (family_id) DO UPDATE SET version = version + 1",
+            (family_id,),
+        )
+        return self.family_version(family_id)
+
+    def _apply_memories(self, family_id, memories):
+        for memory in memories:
+            action = memory["action"]
+            old_id = (
+                self.find_active(family_id, memory.get("old_memory"))
+                if memory.get("old_memory")
+                else None
+            )
+            if action == "DELETE":
+                if old_id is not None:
+                    self.delete([old_id])
+                continue
+            new_id = self.add(family_id, memory["knowledge"], memory["category"])
+            if action == "UPDATE" and old_id is not None:
+                self.supersede([old_id], new_id)
+
+    def stale_memories(self, family_id, memories):
+        """The memories that UPDATE or DELETE actions target but that are no longer active."""
+        return [
+            memory["old_memory"]
+            for memory in memories
+            if memory["action"] in ("UPDATE", "DELETE")
+            and memory.get("old_memory")
+            and self.find_active(family_id, memory["old_memory"]) is None
+        ]
+
+    def apply_batch(self, writes):
+        """Apply (family_id, expected_version, memories) writes in a single transaction, in order.
+
+        Writes are optimistic: one based on an older version is still applied if every memory it updates or
+        deletes is still active, since it then cannot overwrite a concurrent change. Otherwise its result is a
+        VersionConflict and nothing of it is written. Successful writes return the family's new version.
+        """
+        results = []
+        with self.connection:
+            for family_id, expected_version, memories in writes:
+                version = self.family_version(family_id)
+                if expected_version is not None and version != expected_version:
+                    stale = self.stale_memories(family_id, memories)
+                    if stale:
+                        results.append(
+                            VersionConflict(family_id, expected_version, version, stale)
+                        )
+                        continue
+                self._apply_memories(family_id, memories)
+                results.append(self.bump_version(family_id))
+        return results
+
+    def apply(self, family_id, memories, expected_version=None):
+        """Apply the categorized memories returned by memory_reflection_graph in one transaction."""
+        result = self.apply_batch([(family_id, expected_version, memories)])[0]
+        if isinstance(result, VersionConflict):
+            raise result
+        return result
+
+    def active_memories(self, family_id):
+        return self.connection.execute(
+            "SELECT id, knowledge, category, updated_at FROM memories WHERE family_id = ? AND status = ? ORDER BY id",
+            (family_id, ACTIVE),
+        ).fetchall()
+
+    def existing_memories(self, family_id):
+        """The family's active memories, in the form memory_reflection_graph takes as `existing_memories`."""
+        return [row["knowledge"] for row in self.active_memories(family_id)]
+
+    def load_columns(self, family_id=None):
+        """Active memories (of one family, or all of them) as MemoryColumns, for large in-process caches."""
+        query = "SELECT knowledge, category FROM memories WHERE status = ?"
+        parameters = [ACTIVE]
+        if family_id is not None:
+            query += " AND family_id = ?"
+            parameters.append(family_id)
+        return MemoryColumns(map(dict, self.connection.execute(query + " ORDER BY id", parameters)))
+
+    def search(self, family_id, query, limit=10):
+        return self.connection.execute(
+            "SELECT memories.id, memories.knowledge, memories.category FROM memories_fts "
+            "JOIN memories ON memories.id = memories_fts.rowid "
+            "WHERE memories_fts MATCH ? AND memories.family_id = ? AND memories.status = ? "
+            "ORDER BY rank LIMIT ?",
+            (query, family_id, ACTIVE, limit),
+        ).fetchall()
+
+    def families(self):
+        return [
+            row["family_id"]
+            for row in self.connection.execute(
+                "SELECT DISTINCT family_id FROM memories ORDER BY family_id"
+            )
+        ]
+
+    def family_sizes(self):
+        """Total rows, active rows and active characters per family."""
+        return {
+            row["family_id"]: {
+                "rows": row["rows"],
+                "active": row["active"],
+                "active_chars": row["active_chars"] or 0,
+            }
+            for row in self.connection.execute(
+                "SELECT family_id, COUNT(*) AS rows, "
+                "SUM(status = 'active') AS active, "
+                "SUM(CASE WHEN status = 'active' THEN LENGTH(knowledge) END) AS active_chars "
+                "FROM memories GROUP BY family_id"
+            )
+        }
+
+    def rebuild_indexes(self):
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO memories_fts (memories_fts) VALUES ('rebuild')"
+            )
+            self.connection.execute("REINDEX memories")
+            self.connection.execute("ANALYZE")
+        if self.path != ":memory:":
+            self.connection.execute("VACUUM")
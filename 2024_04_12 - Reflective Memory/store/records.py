@@ -0,0 +1,127 @@
+"""Compact in-process representations of memories.
+
+`MemoryRecord` is a slotted record for memories handled one at a time. `MemoryColumns` stores bulk sets as a few
+flat arrays, which is what to use for large in-process caches. Both convert to and from the plain dicts the agents
+exchange with the LLM (knowledge, category, action, old_memory).
+"""
+
+import sys
+from array import array
+from dataclasses import dataclass
+
+# Same values as the Category and Action enums in agents/, stored as small integer codes
+CATEGORIES = ("ALLERGY", "LIKE", "DISLIKE", "ATTRIBUTE")
+ACTIONS = ("CREATE", "UPDATE", "DELETE")
+CATEGORY_CODES = {value: code for code, value in enumerate(CATEGORIES)}
+ACTION_CODES = {value: code for code, value in enumerate(ACTIONS)}
+NO_CODE = -1
+
+
+def _value(value):
+    # Accept enum members as well as their values
+    return getattr(value, "value", value)
+
+
+@dataclass
+class MemoryRecord:
+    __slots__ = ("knowledge", "category", "action", "old_memory")
+
+    knowledge: str
+    category: str
+    action: str
+    old_memory: str
+
+    @classmethod
+    def from_dict(cls, memory):
+        # Interned, so every record shares the same few category and action strings
+        return cls(
+            memory.get("knowledge", ""),
+            sys.intern(_value(memory.get("category")) or ""),
+            sys.intern(_value(memory.get("action")) or ""),
+            memory.get("old_memory") or "",
+        )
+
+    @classmethod
+    def from_model(cls, model):
+        return cls.from_dict(model.dict())
+
+    def to_dict(self):
+        return {
+            "knowledge": self.knowledge,
+            "category": self.category,
+            "action": self.action,
+            "old_memory": self.old_memory,
+        }
+
+
+class _StringColumn:
+    """Strings stored as one UTF-8 buffer plus end offsets, instead of one Python object each."""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.ends = array("Q")
+
+    def append(self, text):
+        self.data += text.encode()
+        self.ends.append(len(self.data))
+
+    def __getitem__(self, index):
+        start = self.ends[index - 1] if index else 0
+        return self.data[start : self.ends[index]].decode()
+
+    @property
+    def nbytes(self):
+        return len(self.data) + self.ends.itemsize * len(self.ends)
+
+
+class MemoryColumns:
+    def __init__(self, memories=()):
+        self.knowledge = _StringColumn()
+        self.old_memory = _StringColumn()
+        self.category = array("b")
+        self.action = array("b")
+        self.extend(memories)
+
+    def __len__(self):
+        return len(self.category)
+
+    def append(self, memory):
+        """Append a memory dict, pydantic model or MemoryRecord."""
+        if isinstance(memory, MemoryRecord):
+            memory = memory.to_dict()
+        elif not isinstance(memory, dict):
+            memory = memory.dict()
+        self.knowledge.append(memory.get("knowledge", ""))
+        self.old_memory.append(memory.get("old_memory") or "")
+        self.category.append(CATEGORY_CODES.get(_value(memory.get("category")), NO_CODE))
+        self.action.append(ACTION_CODES.get(_value(memory.get("action")), NO_CODE))
+
+    def extend(self, memories):
+        for memory in memories:
+            self.append(memory)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        category, action = self.category[index], self.action[index]
+        return MemoryRecord(
+            self.knowledge[index],
+            CATEGORIES[category] if category != NO_CODE else "",
+            ACTIONS[action] if action != NO_CODE else "",
+            self.old_memory[index],
+        )
+
+    def __iter__(self):
+        return (self[index] for index in range(len(self)))
+
+    def to_dicts(self):
+        return [record.to_dict() for record in self]
+
+    @property
+    def nbytes(self):
+        return (
+            self.knowledge.nbytes
+            + self.old_memory.nbytes
+            + self.category.itemsize * len(self.category)
+            + self.action.itemsize * len(self.action)
+        )
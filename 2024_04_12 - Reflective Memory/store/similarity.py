@@ -0,0 +1,106 @@
+import hashlib
+import re
+import zlib
+
+import numpy as np
+
+DIMENSIONS = 4096
+
+# Words that carry no meaning for a stored preference, and verbs that say the same thing in different ways
+FILLER_WORDS = {
+    "i", "im", "i'm", "me", "my", "a", "an", "the", "really", "very", "so", "absolutely",
+    "just", "always", "to", "am", "is", "are", "user", "users",
+}
+SYNONYMS = {
+    "love": "like",
+    "loves": "like",
+    "adore": "like",
+    "enjoy": "like",
+    "enjoys": "like",
+    "likes": "like",
+    "prefer": "like",
+    "prefers": "like",
+    "hate": "dislike",
+    "hates": "dislike",
+    "detest": "dislike",
+    "dislikes": "dislike",
+    "allergic": "allergy",
+}
+# A memory that only differs from another by negation contradicts it, so the two are never duplicates
+NEGATIONS = {"dislike", "not", "no", "never", "dont", "don't", "doesnt", "doesn't", "anymore"}
+
+
+def normalize(text):
+    """Lowercase, drop punctuation and filler words, and fold synonyms and plurals, so paraphrases compare equal."""
+    words = []
+    for word in re.findall(r"[a-z0-9']+", str(text).lower()):
+        word = SYNONYMS.get(word, word)
+        if word in FILLER_WORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.append(word)
+    return " ".join(words)
+
+
+def contradicts(memory, existing_memory):
+    """Similar wording with a different negation or different numbers is a change, not a restatement."""
+    words = set(normalize(memory).split())
+    existing_words = set(normalize(existing_memory).split())
+    if bool(words & NEGATIONS) != bool(existing_words & NEGATIONS):
+        return True
+    numbers = {word for word in words if word.isdigit()}
+    return numbers != {word for word in existing_words if word.isdigit()}
+
+
+def text_hash(text):
+    return hashlib.sha1(normalize(text).encode()).hexdigest()[:16]
+
+
+def vectorize(texts, dimensions=DIMENSIONS):
+    """Hashed character trigram counts of the normalized texts, L2 normalized so a dot product is the cosine."""
+    rows, columns = [], []
+    for row, text in enumerate(texts):
+        padded = f" {normalize(text)} "
+        for i in range(len(padded) - 2):
+            rows.append(row)
+            columns.append(zlib.crc32(padded[i : i + 3].encode()) % dimensions)
+
+    vectors = np.zeros((len(texts), dimensions), dtype=np.float32)
+    np.add.at(vectors, (rows, columns), 1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class SimilarityIndex:
+    """Exact lookups by normalized hash, and cosine similarity over trigram vectors for near duplicates."""
+
+    def __init__(self, texts=(), dimensions=DIMENSIONS):
+        self.dimensions = dimensions
+        self.texts = []
+        self.hashes = {}
+        self.vectors = np.zeros((0, dimensions), dtype=np.float32)
+        self.add(texts)
+
+    def __len__(self):
+        return len(self.texts)
+
+    def add(self, texts):
+        texts = list(texts)
+        for text in texts:
+            self.hashes.setdefault(text_hash(text), len(self.texts))
+            self.texts.append(text)
+        if texts:
+            self.vectors = np.vstack([self.vectors, vectorize(texts, self.dimensions)])
+
+    def exact(self, text):
+        """Index of a stored text that normalizes to the same string, or None."""
+        return self.hashes.get(text_hash(text))
+
+    def most_similar(self, texts):
+        """Index and cosine similarity of the closest stored text for each query, -1 and 0.0 when empty."""
+        if not len(self.texts):
+            return np.full(len(texts), -1), np.zeros(len(texts), dtype=np.float32)
+        similarities = vectorize(texts, self.dimensions) @ self.vectors.T
+        best = similarities.argmax(axis=1)
+        return best, similarities[np.arange(len(texts)), best]
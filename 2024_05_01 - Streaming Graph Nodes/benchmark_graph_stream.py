@@ -0,0 +1,74 @@
+"""Compare the raw event stream of a simulated graph run with the coalesced frames sent to useGraphStream.
+
+The graph is simulated, so no model is needed. A node streams `--tokens` tokens at `--rate` tokens per second,
+with each event carrying the kind of payload astream_events does:
+
+    python benchmark_graph_stream.py --tokens 1000 --rate 500
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from graph_stream import coalesce_events, encode_frame
+
+OBSERVED_NODES = {"Product Vision Graph", "extraction_classifier", "vision_rewriter"}
+
+
+async def simulated_events(tokens, rate):
+    def event(kind, name, run_id, data=None):
+        return {
+            "event": kind,
+            "name": name,
+            "run_id": run_id,
+            "tags": ["graph:step:1"],
+            "metadata": {"langgraph_step": 1},
+            "data": data or {},
+        }
+
+    yield event("on_chain_start", "Product Vision Graph", "graph", {"input": {"message": "..."}})
+    for node in ["extraction_classifier", "vision_rewriter"]:
+        yield event("on_chain_start", node, node)
+        yield event("on_chat_model_start", "ChatGroq", f"{node}-model")
+        for i in range(tokens):
+            await asyncio.sleep(1 / rate)
+            chunk = {
+                "lc": 1,
+                "type": "constructor",
+                "id": ["langchain", "schema", "messages", "AIMessageChunk"],
+                "kwargs": {"content": f" token{i}", "additional_kwargs": {}},
+            }
+            yield event("on_chat_model_stream", "ChatGroq", f"{node}-model", {"chunk": chunk})
+        yield event("on_chat_model_end", "ChatGroq", f"{node}-model", {"output": "..." * tokens})
+        yield event("on_chain_end", node, node, {"output": "..." * tokens})
+    yield event("on_chain_end", "Product Vision Graph", "graph", {"output": "..." * tokens})
+
+
+async def main():
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument("--tokens", type=int, default=1000)
+    argument_parser.add_argument("--rate", type=float, default=500)
+    args = argument_parser.parse_args()
+
+    raw_events, raw_bytes = 0, 0
+    start = time.perf_counter()
+    async for event in simulated_events(args.tokens, args.rate):
+        raw_events += 1
+        raw_bytes += len(json.dumps(event))
+    raw_seconds = time.perf_counter() - start
+
+    stats, frame_bytes = {}, 0
+    start = time.perf_counter()
+    async for frame in coalesce_events(
+        simulated_events(args.tokens, args.rate), OBSERVED_NODES, stats=stats
+    ):
+        frame_bytes += len(encode_frame(frame))
+    coalesced_seconds = time.perf_counter() - start
+
+    print(f"Raw:       {raw_events} events, {raw_bytes / 1024:.1f} KiB, {raw_seconds:.2f}s")
+    print(f"Coalesced: {stats['frames']} frames, {frame_bytes / 1024:.1f} KiB, {coalesced_seconds:.2f}s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
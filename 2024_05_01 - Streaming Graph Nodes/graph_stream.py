@@ -0,0 +1,159 @@
+"""Server side of the graph stream consumed by `useGraphStream`.
+
+`app.astream_events` emits one event per LLM token, and the client runs a React state update for each of them.
+`coalesce_events` merges the token deltas of the node that is streaming into a single `on_chat_model_stream` event,
+flushed every `max_delay` seconds or `max_chars` characters, whichever comes first, and as soon as an observed
+node starts or ends so that the order of node changes is kept. Events the client ignores are dropped, and the ones
+it uses are cut down to the fields it reads. Each frame is a list of events in the same shape as before, so the
+client applies a whole frame in one state update.
+
+    from fastapi.responses import StreamingResponse
+
+    @app.post("/product-vision")
+    async def product_vision(request: Request):
+        return StreamingResponse(
+            stream_graph(product_vision_graph, {"message": await request.body()}, OBSERVED_NODES),
+            media_type="text/plain",
+        )
+"""
+
+import asyncio
+import json
+
+MAX_DELAY = 0.05
+MAX_CHARS = 256
+# The only events useGraphStream reacts to
+NODE_EVENTS = ("on_chain_start", "on_chain_end")
+TOKEN_EVENT = "on_chat_model_stream"
+
+_DONE = object()
+
+
+def chunk_content(event):
+    chunk = (event.get("data") or {}).get("chunk")
+    if isinstance(chunk, dict):
+        return (chunk.get("kwargs") or chunk).get("content") or ""
+    return getattr(chunk, "content", "") or ""
+
+
+def token_event(run_id, name, content):
+    return {
+        "event": TOKEN_EVENT,
+        "run_id": run_id,
+        "name": name,
+        "data": {"chunk": {"kwargs": {"content": content}}},
+    }
+
+
+class FrameBuilder:
+    """Collects the events of one frame, merging token deltas per observed node."""
+
+    def __init__(self, observed_nodes):
+        self.observed_nodes = observed_nodes
+        self.current_node = None
+        self.events = []
+        # Observed node -> [run_id, model name, content parts], in the order the nodes started streaming
+        self.pending = {}
+        self.pending_chars = 0
+
+    def __bool__(self):
+        return bool(self.events or self.pending)
+
+    def add(self, event):
+        """Add a raw graph event. Returns True if the frame should be flushed now."""
+        if event["event"] == TOKEN_EVENT:
+            content = chunk_content(event)
+            if not content:
+                return False
+            # Deltas are attributed to the node that is running, as the client does
+            key = self.current_node or event["name"]
+            if key not in self.pending:
+                self.pending[key] = [event["run_id"], event["name"], []]
+            self.pending[key][2].append(content)
+            self.pending_chars += len(content)
+            return False
+
+        if event["event"] in NODE_EVENTS and event["name"] in self.observed_nodes:
+            self._merge_pending()
+            if event["event"] == "on_chain_start":
+                self.current_node = event["name"]
+            self.events.append(
+                {"event": event["event"], "run_id": event["run_id"], "name": event["name"]}
+            )
+            # Node changes go out right away
+            return True
+        return False
+
+    def _merge_pending(self):
+        for run_id, name, parts in self.pending.values():
+            self.events.append(token_event(run_id, name, "".join(parts)))
+        self.pending = {}
+        self.pending_chars = 0
+
+    def take(self):
+        self._merge_pending()
+        events, self.events = self.events, []
+        return events
+
+
+async def coalesce_events(
+    events, observed_nodes, max_delay=MAX_DELAY, max_chars=MAX_CHARS, stats=None
+):
+    """Turn a stream of graph events into frames, each a list of events to apply in one state update."""
+    queue = asyncio.Queue()
+
+    async def produce():
+        try:
+            async for event in events:
+                await queue.put(event)
+        finally:
+            await queue.put(_DONE)
+
+    producer = asyncio.create_task(produce())
+    loop = asyncio.get_running_loop()
+    frame = FrameBuilder(observed_nodes)
+    deadline = None
+    try:
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - loop.time())
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                event = None
+
+            if event is _DONE:
+                break
+            flush = event is None
+            if event is not None:
+                if stats is not None:
+                    stats["events"] = stats.get("events", 0) + 1
+                flush = frame.add(event) or frame.pending_chars >= max_chars
+                if frame and deadline is None:
+                    deadline = loop.time() + max_delay
+
+            if flush and frame:
+                if stats is not None:
+                    stats["frames"] = stats.get("frames", 0) + 1
+                yield frame.take()
+                deadline = None
+
+        if frame:
+            if stats is not None:
+                stats["frames"] = stats.get("frames", 0) + 1
+            yield frame.take()
+        # Re-raise anything the graph raised
+        await producer
+    finally:
+        producer.cancel()
+
+
+def encode_frame(frame):
+    # Back-to-back JSON objects, which is what handleJsonResponse parses
+    return "".join(json.dumps(event) for event in frame)
+
+
+async def stream_graph(app, input, observed_nodes, config=None, **kwargs):
+    """Run a compiled graph and yield its coalesced frames, encoded for the response body."""
+    events = app.astream_events(input, config, version="v1")
+    async for frame in coalesce_events(events, observed_nodes, **kwargs):
+        yield encode_frame(frame)
@@ -0,0 +1,200 @@
+"""Resumable, multiplexed streaming sessions for graph runs.
+
+A run is started once and keeps running in the background whatever happens to the clients watching it. Its
+coalesced frames (see graph_stream.py) are numbered and kept in a bounded ring buffer, so a client that drops its
+connection reconnects with the last offset it saw and only gets what it missed, instead of rerunning the graph.
+One connection can follow several runs at once: each message says which run and offset it belongs to.
+
+    sessions = StreamSessionManager()
+
+    @app.post("/runs")
+    async def start_run(request: Request):
+        return {"run_id": sessions.start(product_vision_graph, await request.json(), OBSERVED_NODES)}
+
+    # GET /stream?run=abc:12&run=def  (resume abc after offset 12, follow def from the start)
+    @app.get("/stream")
+    async def stream(run: List[str] = Query()):
+        return StreamingResponse(
+            (encode_message(message) async for message in sessions.multiplex(parse_cursors(run))),
+            media_type="application/x-ndjson",
+        )
+
+Messages are newline-delimited JSON:
+
+    {"run_id": "abc", "offset": 13, "events": [...]}   a frame, in the same event shape useGraphStream applies
+    {"run_id": "abc", "done": true, "error": null}     the run has finished, no more frames will follow
+    {"run_id": "abc", "expired": true, "first_offset": 40}   frames after the given offset have been dropped
+"""
+
+import asyncio
+import json
+import uuid
+from collections import deque
+from itertools import islice
+
+from graph_stream import coalesce_events
+
+# Frames kept per run. At the default frame bounds, this covers about 50 seconds of continuous token streaming
+MAX_EVENTS = 1024
+# How long a finished run stays available to resume, in seconds
+RETENTION = 300
+
+
+class EventsExpired(Exception):
+    """The frames after the requested offset have already been dropped from the run's buffer."""
+
+    def __init__(self, run_id, first_offset):
+        super().__init__(f"Run {run_id} only has frames from offset {first_offset}")
+        self.run_id = run_id
+        self.first_offset = first_offset
+
+
+class RingBuffer:
+    def __init__(self, capacity=MAX_EVENTS):
+        self.items = deque(maxlen=capacity)
+        self.next_offset = 0
+
+    @property
+    def first_offset(self):
+        return self.next_offset - len(self.items)
+
+    def append(self, item):
+        self.items.append(item)
+        self.next_offset += 1
+        return self.next_offset - 1
+
+    def since(self, after):
+        """The (offset, item) pairs after the given offset."""
+        start = max(after + 1, 0)
+        if start < self.first_offset:
+            raise EventsExpired(None, self.first_offset)
+        return list(
+            enumerate(islice(self.items, start - self.first_offset, None), start)
+        )
+
+
+class StreamRun:
+    def __init__(self, run_id, max_events=MAX_EVENTS):
+        self.run_id = run_id
+        self.buffer = RingBuffer(max_events)
+        self.done = False
+        self.error = None
+        self.task = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def publish(self, frame):
+        self.buffer.append(frame)
+        self._notify()
+
+    def finish(self, error=None):
+        self.done = True
+        self.error = error
+        self._notify()
+
+    async def frames(self, after=-1):
+        """Yield (offset, frame) for every frame after the given offset, waiting for new ones until the run ends."""
+        while True:
+            # Taken before reading the buffer, so a frame published while we yield is never missed
+            changed = self._changed
+            try:
+                new_frames = self.buffer.since(after)
+            except EventsExpired as e:
+                raise EventsExpired(self.run_id, e.first_offset)
+            for after, frame in new_frames:
+                yield after, frame
+            if self.done and after >= self.buffer.next_offset - 1:
+                return
+            await changed.wait()
+
+
+class StreamSessionManager:
+    def __init__(self, max_events=MAX_EVENTS, retention=RETENTION, **coalesce_kwargs):
+        self.max_events = max_events
+        self.retention = retention
+        self.coalesce_kwargs = coalesce_kwargs
+        self.runs = {}
+
+    def start(self, app, input, observed_nodes, config=None, run_id=None):
+        """Start a graph run in the background and return its id."""
+        run = StreamRun(run_id or uuid.uuid4().hex, self.max_events)
+        self.runs[run.run_id] = run
+        events = app.astream_events(input, config, version="v1")
+        run.task = asyncio.create_task(self._run(run, events, observed_nodes))
+        return run.run_id
+
+    async def _run(self, run, events, observed_nodes):
+        error = None
+        try:
+            async for frame in coalesce_events(events, observed_nodes, **self.coalesce_kwargs):
+                run.publish(frame)
+        except asyncio.CancelledError:
+            error = "Cancelled"
+        except Exception as e:
+            error = repr(e)
+        finally:
+            run.finish(error)
+            asyncio.get_running_loop().call_later(
+                self.retention, self.runs.pop, run.run_id, None
+            )
+
+    def cancel(self, run_id):
+        run = self.runs.get(run_id)
+        if run is not None and run.task is not None:
+            run.task.cancel()
+
+    def subscribe(self, run_id, after=-1):
+        """The frames of one run after the given offset. Raises KeyError for unknown or expired runs."""
+        return self.runs[run_id].frames(after)
+
+    async def multiplex(self, cursors):
+        """Follow several runs over one connection.
+
+        `cursors` maps each run id to the last offset the client saw (-1 for none). Leaving stops the following,
+        never the runs themselves.
+        """
+        queue = asyncio.Queue()
+
+        async def follow(run_id, after):
+            run = self.runs.get(run_id)
+            if run is None:
+                await queue.put({"run_id": run_id, "done": True, "error": "Unknown run"})
+                return
+            try:
+                async for offset, frame in run.frames(after):
+                    await queue.put({"run_id": run_id, "offset": offset, "events": frame})
+                await queue.put({"run_id": run_id, "done": True, "error": run.error})
+            except EventsExpired as e:
+                await queue.put(
+                    {"run_id": run_id, "expired": True, "first_offset": e.first_offset}
+                )
+
+        followers = [
+            asyncio.create_task(follow(run_id, after)) for run_id, after in cursors.items()
+        ]
+        try:
+            remaining = len(followers)
+            while remaining:
+                message = await queue.get()
+                if "offset" not in message:
+                    remaining -= 1
+                yield message
+        finally:
+            for follower in followers:
+                follower.cancel()
+
+
+def parse_cursors(values):
+    """Turn ["abc:12", "def"] into {"abc": 12, "def": -1}."""
+    cursors = {}
+    for value in values:
+        run_id, _, offset = value.partition(":")
+        cursors[run_id] = int(offset) if offset else -1
+    return cursors
+
+
+def encode_message(message):
+    return json.dumps(message) + "\n"